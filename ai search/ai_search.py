@@ -1,5 +1,6 @@
 import streamlit as st
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError
+import httpx
 from duckduckgo_search import DDGS
 from pathlib import Path
 import asyncio
@@ -9,11 +10,29 @@ import logging
 import json
 import atexit
 import psutil
+import time
+import random
+import threading
+from datetime import datetime, timezone
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+@st.cache_resource
+def get_openai_client(api_key, base_url):
+    """按 (base_url, api_key) 在进程内共享客户端，各轮对话复用已建立的 keep-alive 连接，安装 h2 时启用 HTTP/2"""
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=90),
+        http2=h2 is not None
+    )
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
 # 应用nest_asyncio
 nest_asyncio.apply()
 
@@ -109,7 +128,7 @@ with st.sidebar:
 
     # 添加 "获取模型列表" 按钮
     if st.button("获取模型列表"):
-        client = OpenAI(api_key=api_key, base_url=api_base)
+        client = get_openai_client(api_key, api_base)
         try:
             models = client.models.list()
             st.session_state.model_options = {m.id: m.id for m in models.data}
@@ -201,16 +220,112 @@ def process_deepseek_response(response, model):
         return re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
     return response
 
+# 大模型调用失败时的重试：429、5xx或连接失败按指数退避加随机抖动重试，网关返回Retry-After时按其等待
+LLM_MAX_RETRIES = 4
+LLM_MAX_DELAY = 60.0
+
+def get_retry_after(error):
+    """读取错误响应中的 Retry-After 秒数，未指定时返回None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+def is_retryable(error):
+    """连接失败、超时、限流和服务端错误可以重试"""
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code in (408, 409, 429) or error.status_code >= 500)
+
+def create_completion(client, **kwargs):
+    """
+    调用 chat.completions.create，可重试的错误按退避策略重试
+
+    Returns:
+        tuple: (回复, 重试次数)
+    """
+    client = client.with_options(max_retries=0)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return client.chat.completions.create(**kwargs), attempt
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(LLM_MAX_DELAY, 2 ** attempt))
+            delay = min(delay, LLM_MAX_DELAY)
+            logger.warning(f"调用大模型失败（{str(e)}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+
+_usage_lock = threading.Lock()
+
+def get_usage_path(month):
+    """按调用记录的用量文件 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'usage' / f'{month}.jsonl'
+
+def append_usage(record):
+    """追加一条用量记录到 usage/<YYYY-MM>.jsonl，会话结束后用量仍可统计"""
+    recorded_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    path = get_usage_path(recorded_at[:7])
+    try:
+        with _usage_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'recorded_at': recorded_at, 'source': 'ai_search', **record}, ensure_ascii=False) + '\n')
+    except Exception as e:
+        logger.error(f"写入用量记录失败 {path}: {str(e)}")
+
+def record_usage(stage, response, started, retries=0):
+    """记录一次大模型调用的token用量和耗时，汇总到本轮对话的用量中并保存到用量记录"""
+    latency = time.monotonic() - started
+    usage = getattr(response, 'usage', None)
+    details = getattr(usage, 'completion_tokens_details', None)
+    record = {
+        'stage': stage,
+        'model': st.session_state.model,
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+        'reasoning_tokens': getattr(details, 'reasoning_tokens', 0) or 0,
+        'latency': round(latency, 3),
+        'retries': retries
+    }
+    st.session_state.setdefault('turn_usage', []).append(record)
+    append_usage(record)
+    logger.info(f"{stage}用量: 提示 {record['prompt_tokens']} / 输出 {record['completion_tokens']} tokens"
+                f"（推理 {record['reasoning_tokens']}），耗时 {latency:.1f} 秒，重试 {retries} 次")
+
+def format_turn_usage(records):
+    """汇总本轮对话的用量"""
+    prompt_tokens = sum(r['prompt_tokens'] for r in records)
+    completion_tokens = sum(r['completion_tokens'] for r in records)
+    reasoning_tokens = sum(r['reasoning_tokens'] for r in records)
+    latency = sum(r['latency'] for r in records)
+    retries = sum(r.get('retries', 0) for r in records)
+    text = (f"本轮共调用大模型 {len(records)} 次，提示 {prompt_tokens} / 输出 {completion_tokens} tokens"
+            f"（推理 {reasoning_tokens}），累计耗时 {latency:.1f} 秒")
+    if retries:
+        text += f"，重试 {retries} 次"
+    return text
+
 def generate_search_query(user_input):
     """使用模型生成搜索关键词"""
     try:
-        client = OpenAI(api_key=api_key, base_url=api_base)
-        response = client.chat.completions.create(
+        client = get_openai_client(api_key, api_base)
+        started = time.monotonic()
+        response, retries = create_completion(
+            client,
             model=st.session_state.model,
             messages=[
                 {"role": "user", "content": f"请根据以下用户问题生成适用于duckduckgo的搜索关键词或短语，如有多个则以空格分隔：\n{user_input}"}
             ]
         )
+        record_usage('生成搜索关键词', response, started, retries)
         
         if not response or not response.choices or not response.choices[0].message or not response.choices[0].message.content:
             logger.error("API返回结果为空")
@@ -292,10 +407,13 @@ def generate_content_summary(content, query, client):
     - 使用中文回答
     """
     try:
-        response = client.chat.completions.create(
+        started = time.monotonic()
+        response, retries = create_completion(
+            client,
             model=st.session_state.model,
             messages=[{"role": "user", "content": prompt}]
         )
+        record_usage('生成摘要', response, started, retries)
         result = response.choices[0].message.content.strip()
         return process_deepseek_response(result, st.session_state.model)
     except Exception as e:
@@ -343,7 +461,7 @@ def web_search(query):
             return []
         
         # 创建OpenAI客户端
-        client = OpenAI(api_key=api_key, base_url=api_base)
+        client = get_openai_client(api_key, api_base)
 
         # 创建进度显示
         progress_placeholder = st.empty()
@@ -388,7 +506,8 @@ if prompt := st.chat_input("请输入您的问题"):
         st.markdown(prompt)
     
     # 创建OpenAI客户端
-    client = OpenAI(api_key=api_key, base_url=api_base)
+    client = get_openai_client(api_key, api_base)
+    st.session_state.turn_usage = []
     
     # 根据是否启用联网搜索执行不同的逻辑
     if st.session_state.enable_search:
@@ -456,14 +575,18 @@ if prompt := st.chat_input("请输入您的问题"):
     # 获取模型回复
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
-        response = client.chat.completions.create(
+        started = time.monotonic()
+        response, retries = create_completion(
+            client,
             model=st.session_state.model,
             messages=messages
         )
+        record_usage('回答', response, started, retries)
         
         full_response = response.choices[0].message.content
         #full_response = process_deepseek_response(full_response, st.session_state.model)
         message_placeholder.markdown(full_response)
+        st.caption(format_turn_usage(st.session_state.turn_usage))
     
     st.session_state.messages.append({"role": "assistant", "content": full_response})
    
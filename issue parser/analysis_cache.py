@@ -0,0 +1,119 @@
+"""
+Issue 分析结果的本地缓存
+
+以完整提示词和模型名的哈希作为键，缓存大模型的原始回复。
+issue 内容、评论、patch 和模型均未变化时直接命中缓存，不再消耗 token。
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_AGE_DAYS = 90
+
+_cache_lock = threading.Lock()
+_cache_instance = None
+
+def get_cache_path():
+    """获取缓存文件路径 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'analysis_cache.db'
+
+def make_cache_key(prompt, model):
+    """根据完整提示词和模型名生成缓存键"""
+    return hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
+
+class AnalysisCache:
+    """基于 SQLite 的分析缓存，按条目数和存活时间淘汰"""
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.path = Path(path) if path else get_cache_path()
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON analysis_cache(accessed_at)")
+
+    def _connect(self):
+        # 每次操作使用独立连接，便于在线程池中并发访问
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, prompt, model):
+        """读取缓存的模型回复，未命中或已过期时返回 None"""
+        key = make_cache_key(prompt, model)
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT content, created_at FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                content, created_at = row
+                if self.max_age_days and now - created_at > self.max_age_days * 86400:
+                    conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                return content
+        except Exception as e:
+            logger.warning(f"读取分析缓存失败: {str(e)}")
+            return None
+
+    def put(self, prompt, model, content):
+        """写入模型回复并执行淘汰"""
+        key = make_cache_key(prompt, model)
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, model, content, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, model, content, now, now)
+                )
+                self._evict(conn, now)
+        except Exception as e:
+            logger.warning(f"写入分析缓存失败: {str(e)}")
+
+    def _evict(self, conn, now):
+        if self.max_age_days:
+            conn.execute(
+                "DELETE FROM analysis_cache WHERE created_at < ?",
+                (now - self.max_age_days * 86400,)
+            )
+        if self.max_entries:
+            # 超出条目上限时淘汰最久未访问的条目
+            conn.execute("""
+                DELETE FROM analysis_cache WHERE key IN (
+                    SELECT key FROM analysis_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self):
+        """清空缓存"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM analysis_cache")
+
+def get_analysis_cache(max_entries=DEFAULT_MAX_ENTRIES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """获取进程内共享的缓存实例"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = AnalysisCache(max_entries=max_entries, max_age_days=max_age_days)
+        else:
+            _cache_instance.max_entries = max_entries
+            _cache_instance.max_age_days = max_age_days
+        return _cache_instance
@@ -0,0 +1,89 @@
+"""
+流式解析大模型的分析回复
+
+按 "#### 分析内容/风险评级/复现脚本/解释说明" 标题把增量文本切分为各个段落，
+每当段落内容增加或段落结束时回调，风险评级段落结束（即下一个标题出现）时即可确定风险等级。
+"""
+import re
+
+SECTION_NAMES = ('分析内容', '风险评级', '复现脚本', '解释说明')
+HEADING_PATTERN = re.compile(r'^\s*#### (' + '|'.join(SECTION_NAMES) + r')\s*$')
+
+def parse_risk_level(risk):
+    """将风险评级文本转换为风险等级：2为高风险，1为低风险，0为不涉及"""
+    if '高风险' in risk:
+        return 2
+    elif '低风险' in risk:
+        return 1
+    return 0
+
+class SectionStreamParser:
+    """
+    增量切分分析回复
+
+    Args:
+        on_section: 回调 on_section(段落名, 当前段落文本, 是否已结束)
+    """
+
+    def __init__(self, on_section=None):
+        self.on_section = on_section
+        self.sections = {}
+        self.current = None
+        self.risk_level = None
+        self._chunks = []
+        self._line = ''
+
+    @property
+    def text(self):
+        """已接收的完整文本"""
+        return ''.join(self._chunks)
+
+    def feed(self, delta):
+        """接收一段增量文本"""
+        if not delta:
+            return
+        self._chunks.append(delta)
+        self._line += delta
+        updated = False
+        while '\n' in self._line:
+            line, self._line = self._line.split('\n', 1)
+            updated = self._handle_line(line) or updated
+        if updated and self.current:
+            self._emit(self.current, False)
+
+    def close(self):
+        """输入结束，处理剩余内容并结束当前段落"""
+        if self._line:
+            self._handle_line(self._line)
+            self._line = ''
+        if self.current:
+            self._finish(self.current)
+            self.current = None
+
+    def _handle_line(self, line):
+        m = HEADING_PATTERN.match(line)
+        if m:
+            if self.current:
+                self._finish(self.current)
+            self.current = m.group(1)
+            self.sections[self.current] = ''
+            return False
+        if self.current is None:
+            return False
+        # 分隔线表示回答结束
+        if line.strip() == '---' and self.current == '解释说明':
+            self._finish(self.current)
+            self.current = None
+            return False
+        self.sections[self.current] += line + '\n'
+        return True
+
+    def _finish(self, name):
+        self.sections[name] = self.sections[name].strip()
+        if name == '风险评级':
+            self.risk_level = parse_risk_level(self.sections[name])
+        self._emit(name, True)
+
+    def _emit(self, name, closed):
+        if self.on_section:
+            self.on_section(name, self.sections[name].strip(), closed)
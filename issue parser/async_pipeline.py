@@ -0,0 +1,255 @@
+"""
+基于 asyncio 的分析流水线
+
+获取issue列表 → 获取详情 → 构建提示词 → 调用大模型 → 解析结果，各阶段之间用有界队列连接，
+第 N+1 个 issue 的 GitHub 请求与第 N 个 issue 的大模型调用同时进行，队列满时上游阶段等待，内存占用不随 issue 数增长。
+大模型调用使用共享的 AsyncOpenAI 客户端；GitHub 请求仍经过 github_client 的配额调度和条件请求缓存，
+在线程中执行。所有请求按目标主机限制并发数。
+流水线在独立线程的事件循环中运行，界面只通过任务日志和 on_result 回调观察进度，与线程池方式一致。
+不支持流式输出和多模型集成，需要时使用 analyze_issues_concurrently。
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from issue_analyzer import (load_config, get_configured_retry_policy, get_issue_details, build_analysis_messages,
+                            get_cache_prompt, parse_analysis_response, find_local_verdict, build_issue_result, build_usage,
+                            PROMPT_VERSION)
+from issue_loader import load_issue_details_bulk, parse_repo_fullname, PayloadMemo, BULK_BATCH_SIZE
+from llm_client import get_async_openai_client, close_async_clients
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 32
+GITHUB_HOST = 'api.github.com'
+DEFAULT_HOST_LIMIT = 8
+
+# 阶段结束标记，上游处理完所有issue后放入队列
+_DONE = object()
+
+class HostLimiter:
+    """按目标主机限制并发请求数，未单独设置的主机使用默认上限"""
+
+    def __init__(self, limits=None, default=DEFAULT_HOST_LIMIT):
+        self.limits = dict(limits or {})
+        self.default = default
+        self._semaphores = {}
+
+    def __call__(self, host):
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limits.get(host, self.default))
+        return self._semaphores[host]
+
+def get_host(base_url):
+    return urlparse(base_url or 'https://api.openai.com/v1').netloc
+
+async def run_stage(handler, inbox, outbox, workers):
+    """
+    启动 workers 个协程消费 inbox，全部结束后向 outbox 放入结束标记
+
+    Args:
+        handler: 处理单个元素的协程函数 handler(元素)，结果由其自行放入下游队列
+    """
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # 放回结束标记，让同阶段的其他协程也能退出
+                await inbox.put(_DONE)
+                return
+            await handler(item)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outbox is not None:
+        await outbox.put(_DONE)
+
+async def take_chunk(inbox, size):
+    """从队列中取出最多 size 个已就绪的元素，至少等待一个；队列已结束时返回空列表"""
+    item = await inbox.get()
+    if item is _DONE:
+        await inbox.put(_DONE)
+        return []
+    chunk = [item]
+    while len(chunk) < size and not inbox.empty():
+        item = inbox.get_nowait()
+        if item is _DONE:
+            await inbox.put(_DONE)
+            break
+        chunk.append(item)
+    return chunk
+
+async def run_pipeline(issues, api_key, base_url, github_token, model, github_workers=4, llm_workers=4,
+                       on_progress=None, on_result=None, payload_memo=None, triage_model=None, force_refresh=False,
+                       token_budget=None, cache=None, retry_policy=None, duplicate_index=None, prefilter=None,
+                       queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    异步流水线分析一批issue
+
+    Args:
+        issues: issue对象的可迭代对象，可以是按需分页的 LazyIssueList，在线程中逐个取出
+        github_workers / llm_workers: GitHub 与大模型主机的并发上限，也是对应阶段的协程数
+        其他参数与 analyze_issues_concurrently 相同
+
+    Returns:
+        list: 与issues顺序一致的 (issue, 分析结果, 错误信息) 列表
+    """
+    payload_memo = payload_memo or PayloadMemo()
+    retry_policy = retry_policy or get_configured_retry_policy(load_config())
+    llm_host = get_host(base_url)
+    limiter = HostLimiter({GITHUB_HOST: github_workers, llm_host: llm_workers})
+    client = get_async_openai_client(api_key, base_url)
+    total = len(issues) if hasattr(issues, '__len__') else None
+    order, outcomes = [], {}
+
+    detail_queue = asyncio.Queue(queue_size)
+    prompt_queue = asyncio.Queue(queue_size)
+    llm_queue = asyncio.Queue(queue_size)
+    parse_queue = asyncio.Queue(queue_size)
+
+    def finish(issue, result, error):
+        outcomes[issue.number] = (issue, result, error)
+        if on_result:
+            on_result(issue, result, error)
+        if on_progress:
+            on_progress(len(outcomes), total, issue, error)
+
+    async def list_issues():
+        """
+        获取issue列表：LazyIssueList 取下一项时可能请求下一页，在线程中执行
+
+        列表只由这一个协程顺序获取，不占用详情阶段的 GitHub 并发额度，避免详情请求较多时列表阶段被饿死
+        """
+        iterator = iter(issues)
+        while True:
+            issue = await asyncio.to_thread(next, iterator, _DONE)
+            if issue is _DONE:
+                break
+            order.append(issue)
+            local_result, match = find_local_verdict(issue, duplicate_index, prefilter)
+            if local_result is not None:
+                finish(issue, local_result, None)
+                continue
+            await detail_queue.put((issue, match))
+        await detail_queue.put(_DONE)
+
+    async def fetch_details(chunk):
+        """按批通过 GraphQL 加载详情，批量加载失败的issue单独获取"""
+        repo_fullname = parse_repo_fullname(chunk[0][0].html_url)
+        loaded = {}
+        if repo_fullname:
+            try:
+                async with limiter(GITHUB_HOST):
+                    loaded = await asyncio.to_thread(load_issue_details_bulk, repo_fullname,
+                                                     [issue.number for issue, _ in chunk], github_token, payload_memo)
+            except Exception as e:
+                logger.warning(f"批量获取Issue详情失败: {str(e)}")
+        for issue, match in chunk:
+            details = loaded.get(issue.number)
+            if details is None:
+                async with limiter(GITHUB_HOST):
+                    details = await asyncio.to_thread(get_issue_details, issue, github_token, payload_memo)
+            await prompt_queue.put((issue, match, details))
+
+    async def detail_stage():
+        async def worker():
+            while True:
+                chunk = await take_chunk(detail_queue, BULK_BATCH_SIZE)
+                if not chunk:
+                    return
+                await fetch_details(chunk)
+
+        await asyncio.gather(*(worker() for _ in range(github_workers)))
+        await prompt_queue.put(_DONE)
+
+    async def build_prompt(item):
+        issue, match, details = item
+        try:
+            # 按token预算压缩需要计算token数，在线程中执行
+            messages = await asyncio.to_thread(build_analysis_messages, issue.title, issue.body or '', details,
+                                               token_budget, bool(triage_model))
+        except Exception as e:
+            finish(issue, None, f"构建提示词失败: {str(e)}")
+            return
+        await llm_queue.put((issue, match, details, messages))
+
+    async def complete(messages, call_model):
+        """
+        调用大模型，提示词和模型均未变化时使用缓存的回复
+
+        分析缓存是 SQLite，等待写锁时会阻塞，读写在线程中执行，不阻塞其他阶段
+        """
+        prompt = get_cache_prompt(messages)
+        if not force_refresh and cache is not None:
+            content = await asyncio.to_thread(cache.get, prompt, call_model)
+            if content is not None:
+                return content, build_usage(None, 0, call_model, cached=True)
+        started = time.monotonic()
+        async with limiter(llm_host):
+            response, retries, hedges = await retry_policy.acall(client, model=call_model, messages=messages)
+        content = response.choices[0].message.content.strip()
+        if cache is not None:
+            await asyncio.to_thread(cache.put, prompt, call_model, content)
+        return content, build_usage(response.usage, time.monotonic() - started, call_model, prompt=prompt,
+                                    content=content, retries=retries, hedges=hedges)
+
+    async def call_llm(item):
+        issue, match, details, messages = item
+        usages = []
+        stage, stage_model = 'full', model
+        if triage_model:
+            try:
+                content, usage = await complete(messages, triage_model)
+                usages.append(usage)
+                stage, stage_model = 'triage', triage_model
+            except Exception as e:
+                logger.warning(f"初筛 Issue #{issue.number} 失败，改为完整分析: {str(e)}")
+            # 初筛判定存在风险或初筛失败时进行完整分析
+            if stage == 'full' or parse_analysis_response(content)[1] != 0:
+                messages = await asyncio.to_thread(build_analysis_messages, issue.title, issue.body or '', details,
+                                                   token_budget)
+                stage, stage_model = 'full', model
+        try:
+            if stage == 'full':
+                content, usage = await complete(messages, model)
+                usages.append(usage)
+        except Exception as e:
+            logger.error(f"分析 Issue #{issue.number} 时发生错误: {str(e)}")
+            finish(issue, None, f"分析失败: {str(e)}")
+            return
+        await parse_queue.put((issue, match, details, content, stage, stage_model, usages))
+
+    async def parse_result(item):
+        issue, match, details, content, stage, stage_model, usages = item
+        analysis_result, has_risk = parse_analysis_response(content)
+        analysis_result['prompt_version'] = PROMPT_VERSION
+        result = build_issue_result(issue, details, analysis_result, has_risk, stage, stage_model, usages, match)
+        if duplicate_index is not None:
+            duplicate_index.add_results([result])
+        finish(issue, result, None)
+
+    await asyncio.gather(
+        list_issues(),
+        detail_stage(),
+        run_stage(build_prompt, prompt_queue, llm_queue, 1),
+        run_stage(call_llm, llm_queue, parse_queue, llm_workers),
+        run_stage(parse_result, parse_queue, None, 1)
+    )
+    logger.info(f"PR/commit负载记忆表命中 {payload_memo.hits} 次，实际加载 {payload_memo.misses} 次")
+    return [outcomes[issue.number] for issue in order]
+
+def analyze_issues_pipelined(issues, api_key, base_url, github_token, model, **options):
+    """在新的事件循环中运行流水线，供线程池方式的调用方（如后台任务线程、命令行）直接替换使用"""
+    async def main():
+        # 默认线程池大小与CPU核数相关。GitHub 请求、提示词构建和分析缓存读写都在线程中执行，
+        # 按两类阶段的并发数之和设置线程池，缓存读写不必排在耗时数秒的 GraphQL 请求之后
+        workers = options.get('github_workers', 4) + options.get('llm_workers', 4) + 2
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+        try:
+            return await run_pipeline(issues, api_key, base_url, github_token, model, **options)
+        finally:
+            # 客户端的连接池绑定本次的事件循环，循环结束后无法复用，关闭以释放连接
+            await close_async_clients()
+
+    return asyncio.run(main())
@@ -0,0 +1,235 @@
+"""
+通过提供方的 Batch API 离线分析
+
+月度扫描不需要交互，可将时间窗口内所有 issue 的分析消息写成 JSONL，经 OpenAI 兼容的 /v1/files 和 /v1/batches 接口
+提交为一个批处理任务，轮询到完成后下载输出，用与同步分析相同的段落正则解析为分析结果。
+批处理的价格通常是同步调用的一半，代价是结果在 completion_window（24h）内才返回，适合 500 个以上 issue 的月份。
+近似重复、本地预筛和分析缓存在提交前生效，命中的 issue 不进入批处理；初筛、多模型集成和流式输出不适用于批处理。
+没有可用的网关时，可用 batch_stub_server.py 在本地启动一个兼容接口测试整个流程。
+"""
+import json
+import logging
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from issue_analyzer import (get_issue_details, build_analysis_messages, get_cache_prompt, parse_analysis_response,
+                            find_local_verdict, build_issue_result, build_usage, PROMPT_VERSION)
+from issue_loader import load_issue_details_bulk, parse_repo_fullname, PayloadMemo, BULK_BATCH_SIZE
+from llm_client import get_openai_client, is_retryable
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+DEFAULT_POLL_INTERVAL = 60
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def get_custom_id(issue_number):
+    return f'issue-{issue_number}'
+
+def build_batch_file(requests):
+    """
+    将 {custom_id: (模型, 消息)} 写为批处理输入的 JSONL 内容
+
+    Returns:
+        bytes: JSONL 文件内容
+    """
+    lines = [
+        json.dumps({
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {'model': model, 'messages': messages}
+        }, ensure_ascii=False)
+        for custom_id, (model, messages) in requests.items()
+    ]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def submit_batch(client, requests, metadata=None):
+    """
+    上传输入文件并创建批处理
+
+    Returns:
+        str: 批处理ID
+    """
+    input_file = client.files.create(file=('issues.jsonl', build_batch_file(requests)), purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata=metadata
+    )
+    logger.info(f"已提交批处理 {batch.id}，共 {len(requests)} 个请求")
+    return batch.id
+
+def wait_for_batch(client, batch_id, poll_interval=DEFAULT_POLL_INTERVAL, on_status=None):
+    """
+    轮询批处理直到结束，轮询时的限流和网络错误不会中断等待
+
+    Args:
+        on_status: 每次轮询后回调 on_status(批处理对象)
+
+    Returns:
+        批处理对象
+    """
+    while True:
+        try:
+            batch = client.batches.retrieve(batch_id)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            logger.warning(f"查询批处理 {batch_id} 状态失败: {str(e)}")
+        else:
+            counts = batch.request_counts
+            if counts is not None:
+                logger.info(f"批处理 {batch_id} 状态 {batch.status}，完成 {counts.completed}/{counts.total}，失败 {counts.failed}")
+            if on_status:
+                on_status(batch)
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+        time.sleep(poll_interval)
+
+def to_namespace(value):
+    """将 JSON 对象转换为可按属性访问的对象，与同步调用返回的用量对象一致"""
+    return json.loads(json.dumps(value), object_hook=lambda d: types.SimpleNamespace(**d))
+
+def download_batch_outputs(client, batch):
+    """
+    下载并解析批处理的输出和错误文件
+
+    Returns:
+        dict: {custom_id: {'content', 'usage'} 或 {'error'}}
+    """
+    outputs = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            body = response.get('body') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                error = record.get('error') or body.get('error') or {}
+                outputs[record['custom_id']] = {
+                    'error': error.get('message') or f"状态码 {response.get('status_code')}"
+                }
+                continue
+            outputs[record['custom_id']] = {
+                'content': (body['choices'][0]['message'].get('content') or '').strip(),
+                'usage': to_namespace(body['usage']) if body.get('usage') else None
+            }
+    return outputs
+
+def load_all_details(issues, github_token, github_workers=4, payload_memo=None):
+    """按批通过 GraphQL 加载所有issue的详情，批量加载失败的issue单独获取"""
+    payload_memo = payload_memo or PayloadMemo()
+
+    def load(chunk):
+        repo_fullname = parse_repo_fullname(chunk[0].html_url)
+        try:
+            return load_issue_details_bulk(repo_fullname, [issue.number for issue in chunk], github_token, payload_memo)
+        except Exception as e:
+            logger.warning(f"批量获取Issue详情失败: {str(e)}")
+            return {}
+
+    chunks = [issues[start:start + BULK_BATCH_SIZE] for start in range(0, len(issues), BULK_BATCH_SIZE)]
+    details = {}
+    with ThreadPoolExecutor(max_workers=github_workers) as executor:
+        for loaded in executor.map(load, chunks):
+            details.update(loaded)
+        missing = [issue for issue in issues if details.get(issue.number) is None]
+        for issue, loaded in zip(missing, executor.map(lambda i: get_issue_details(i, github_token, payload_memo), missing)):
+            details[issue.number] = loaded
+    return details
+
+def run_batch_analysis(issues, api_key, base_url, github_token, model, github_workers=4, token_budget=None, cache=None,
+                       payload_memo=None, duplicate_index=None, prefilter=None, force_refresh=False, batch_id=None,
+                       on_submitted=None, on_result=None, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    通过 Batch API 分析一批issue
+
+    Args:
+        batch_id: 已提交的批处理ID，恢复任务时传入，继续轮询而不重新提交
+        on_submitted: 提交批处理后回调 on_submitted(批处理ID)，用于记录到任务日志
+        on_result: 每得到一个issue的结论时回调 on_result(issue, 分析结果, 错误信息)
+        其他参数与 analyze_issues_concurrently 相同
+
+    Returns:
+        list: 与issues顺序一致的 (issue, 分析结果, 错误信息) 列表
+    """
+    outcomes = {}
+
+    def finish(issue, result, error):
+        outcomes[issue.number] = (issue, result, error)
+        if on_result:
+            on_result(issue, result, error)
+
+    pending, matches = [], {}
+    for issue in issues:
+        local_result, matches[issue.number] = find_local_verdict(issue, duplicate_index, prefilter)
+        if local_result is not None:
+            finish(issue, local_result, None)
+        else:
+            pending.append(issue)
+
+    details = load_all_details(pending, github_token, github_workers, payload_memo) if pending else {}
+    requests, prompts = {}, {}
+    for issue in pending:
+        messages = build_analysis_messages(issue.title, issue.body or '', details[issue.number], token_budget)
+        prompt = prompts[issue.number] = get_cache_prompt(messages)
+        content = None if force_refresh or cache is None else cache.get(prompt, model)
+        if content is not None:
+            analysis_result, has_risk = parse_analysis_response(content)
+            analysis_result['prompt_version'] = PROMPT_VERSION
+            usage = build_usage(None, 0, model, cached=True)
+            finish(issue, build_issue_result(issue, details[issue.number], analysis_result, has_risk, 'full', model,
+                                             [usage], matches[issue.number]), None)
+        else:
+            requests[get_custom_id(issue.number)] = (model, messages)
+
+    if requests:
+        logger.info(f"共 {len(issues)} 个 Issue，本地判定或命中缓存 {len(outcomes)} 个，{len(requests)} 个提交批处理")
+        client = get_openai_client(api_key, base_url)
+    by_custom_id = {get_custom_id(issue.number): issue for issue in pending}
+    resumed = batch_id is not None
+    while requests:
+        if batch_id is None:
+            batch_id = submit_batch(client, requests, metadata={'model': model})
+            if on_submitted:
+                on_submitted(batch_id)
+        started = time.monotonic()
+        batch = wait_for_batch(client, batch_id, poll_interval)
+        logger.info(f"批处理 {batch_id} 结束，状态 {batch.status}，耗时 {time.monotonic() - started:.0f} 秒")
+        outputs = download_batch_outputs(client, batch)
+
+        for custom_id in [c for c in requests if c in outputs]:
+            issue, output = by_custom_id[custom_id], outputs[custom_id]
+            del requests[custom_id]
+            if 'error' in output:
+                finish(issue, None, output['error'])
+                continue
+            analysis_result, has_risk = parse_analysis_response(output['content'])
+            analysis_result['prompt_version'] = PROMPT_VERSION
+            # 批处理中单个请求的耗时无从得知，只记录token用量
+            usage = build_usage(output['usage'], 0, model, prompt=prompts[issue.number], content=output['content'])
+            if cache is not None:
+                cache.put(prompts[issue.number], model, output['content'])
+            result = build_issue_result(issue, details[issue.number], analysis_result, has_risk, 'full', model, [usage],
+                                        matches[issue.number])
+            if duplicate_index is not None:
+                duplicate_index.add_results([result])
+            finish(issue, result, None)
+
+        if requests and resumed:
+            # 恢复的批处理中没有的issue（如任务恢复时新出现的issue）提交新的批处理
+            logger.info(f"批处理 {batch_id} 中没有 {len(requests)} 个 Issue 的结果，重新提交")
+            batch_id, resumed = None, False
+            continue
+        for custom_id in requests:
+            finish(by_custom_id[custom_id], None, f"批处理 {batch_id} 未返回结果（状态 {batch.status}）")
+        break
+
+    return [outcomes[issue.number] for issue in issues]
@@ -0,0 +1,221 @@
+"""
+本地的 Batch API 桩服务
+
+实现 OpenAI 兼容的 /v1/files、/v1/files/{id}/content、/v1/batches、/v1/batches/{id} 接口，
+批处理创建后经过 --delay 秒即视为完成，每个请求返回固定格式的分析回复：标题或内容含有 CVE、漏洞等关键词时
+评为高风险，否则评为不涉及；custom_id 包含在 --fail 指定的编号中时返回错误，用于测试失败处理。
+只用于在没有可用网关时测试 batch_analysis 的提交、轮询和解析流程，不会调用任何大模型。
+
+示例：
+    python batch_stub_server.py --port 8900 --delay 5
+    python issue_cli.py --batch --base-url http://127.0.0.1:8900/v1 ...
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+RISK_WORDS = re.compile(r'cve-\d|漏洞|vulnerab|escalat|提权|逃逸', re.IGNORECASE)
+REPLY_TEMPLATE = """---
+
+#### 分析内容
+本地桩服务的固定回复：{reason}
+
+#### 风险评级
+{risk}
+
+#### 复现脚本
+```python
+print("stub")
+```
+
+#### 解释说明
+桩服务不调用大模型，仅用于测试批处理流程。
+
+---"""
+
+class BatchStore:
+    """保存上传的文件和批处理，批处理在创建 delay 秒后生成输出"""
+
+    def __init__(self, delay=0, fail_ids=()):
+        self.delay = delay
+        self.fail_ids = set(fail_ids)
+        self.files = {}
+        self.batches = {}
+        self._lock = threading.Lock()
+
+    def add_file(self, filename, purpose, data):
+        file_id = f'file-{uuid.uuid4().hex[:12]}'
+        with self._lock:
+            self.files[file_id] = {
+                'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed', 'data': data
+            }
+        return self.describe_file(file_id)
+
+    def describe_file(self, file_id):
+        return {k: v for k, v in self.files[file_id].items() if k != 'data'}
+
+    def add_batch(self, params):
+        batch_id = f'batch_{uuid.uuid4().hex[:12]}'
+        now = int(time.time())
+        total = len([line for line in self.files[params['input_file_id']]['data'].splitlines() if line.strip()])
+        with self._lock:
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': params['endpoint'], 'errors': None,
+                'input_file_id': params['input_file_id'], 'completion_window': params['completion_window'],
+                'status': 'in_progress', 'output_file_id': None, 'error_file_id': None, 'created_at': now,
+                'in_progress_at': now, 'expires_at': now + 86400, 'completed_at': None, 'failed_at': None,
+                'expired_at': None, 'cancelled_at': None, 'metadata': params.get('metadata'),
+                'request_counts': {'total': total, 'completed': 0, 'failed': 0}
+            }
+        return self.get_batch(batch_id)
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            batch = self.batches[batch_id]
+            if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.delay:
+                self._complete(batch)
+            return dict(batch)
+
+    def _complete(self, batch):
+        outputs, errors = [], []
+        for line in self.files[batch['input_file_id']]['data'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            custom_id = request['custom_id']
+            if custom_id.rsplit('-', 1)[-1] in self.fail_ids:
+                errors.append({'id': f'req_{uuid.uuid4().hex[:12]}', 'custom_id': custom_id, 'response': {
+                    'status_code': 500, 'body': {'error': {'message': '桩服务模拟的失败', 'type': 'server_error'}}
+                }, 'error': None})
+                continue
+            outputs.append({'id': f'req_{uuid.uuid4().hex[:12]}', 'custom_id': custom_id, 'response': {
+                'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': build_completion(request['body'])
+            }, 'error': None})
+        if outputs:
+            batch['output_file_id'] = self._store_lines('batch_output.jsonl', outputs)
+        if errors:
+            batch['error_file_id'] = self._store_lines('batch_errors.jsonl', errors)
+        batch.update(status='completed', completed_at=int(time.time()))
+        batch['request_counts'].update(completed=len(outputs), failed=len(errors))
+
+    def _store_lines(self, filename, records):
+        file_id = f'file-{uuid.uuid4().hex[:12]}'
+        data = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')
+        self.files[file_id] = {
+            'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+            'filename': filename, 'purpose': 'batch_output', 'status': 'processed', 'data': data
+        }
+        return file_id
+
+def build_completion(body):
+    """按 user 消息中 issue 部分的关键词生成固定的分析回复，消息开头的分析指令不参与判断"""
+    user_content = '\n'.join(m['content'] for m in body['messages'] if m['role'] == 'user')
+    user_content = user_content[user_content.find('Issue 标题：'):]
+    prompt_chars = sum(len(m['content']) for m in body['messages'])
+    m = RISK_WORDS.search(user_content)
+    content = REPLY_TEMPLATE.format(
+        reason=f"内容包含 \"{m.group(0)}\"" if m else '未发现安全相关内容',
+        risk='高风险' if m else '不涉及'
+    )
+    prompt_tokens, completion_tokens = prompt_chars // 2, len(content) // 2
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex[:12]}', 'object': 'chat.completion', 'created': int(time.time()),
+        'model': body['model'],
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+def make_handler(store):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            path = self.path.split('?')[0].rstrip('/')
+            body = self._read_body()
+            if path.endswith('/files'):
+                # openai 客户端以 multipart/form-data 上传文件
+                message = BytesParser(policy=default_policy).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+                )
+                fields, filename, data = {}, 'input.jsonl', b''
+                for part in message.iter_parts():
+                    name = part.get_param('name', header='content-disposition')
+                    if name == 'file':
+                        filename = part.get_filename() or filename
+                        data = part.get_payload(decode=True)
+                    else:
+                        fields[name] = part.get_content().strip()
+                self._send_json(200, store.add_file(filename, fields.get('purpose', 'batch'), data))
+            elif path.endswith('/batches'):
+                params = json.loads(body)
+                if params.get('input_file_id') not in store.files:
+                    self._send_json(400, {'error': {'message': '输入文件不存在', 'type': 'invalid_request_error'}})
+                    return
+                self._send_json(200, store.add_batch(params))
+            else:
+                self._send_json(404, {'error': {'message': f'未实现的接口 {path}'}})
+
+        def do_GET(self):
+            path = self.path.split('?')[0].rstrip('/')
+            m = re.search(r'/files/([^/]+)/content$', path)
+            if m and m.group(1) in store.files:
+                data = store.files[m.group(1)]['data']
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            m = re.search(r'/files/([^/]+)$', path)
+            if m and m.group(1) in store.files:
+                self._send_json(200, store.describe_file(m.group(1)))
+                return
+            m = re.search(r'/batches/([^/]+)$', path)
+            if m and m.group(1) in store.batches:
+                self._send_json(200, store.get_batch(m.group(1)))
+                return
+            self._send_json(404, {'error': {'message': f'未找到 {path}'}})
+
+        def log_message(self, format, *args):
+            logger.info(format % args)
+
+    return Handler
+
+def create_server(host='127.0.0.1', port=8900, delay=0, fail_ids=()):
+    """创建桩服务，port 为 0 时自动分配端口"""
+    return ThreadingHTTPServer((host, port), make_handler(BatchStore(delay, fail_ids)))
+
+def main():
+    parser = argparse.ArgumentParser(description='本地的 OpenAI 兼容 Batch API 桩服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--delay', type=float, default=5, help='批处理创建后多少秒视为完成')
+    parser.add_argument('--fail', default='', help='返回错误的issue编号，用逗号分隔')
+    args = parser.parse_args()
+    server = create_server(args.host, args.port, args.delay, [n.strip() for n in args.fail.split(',') if n.strip()])
+    logger.info(f"Batch API 桩服务监听 http://{args.host}:{server.server_address[1]}/v1")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
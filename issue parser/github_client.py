@@ -0,0 +1,295 @@
+"""
+共享的 GitHub 客户端层
+
+- 按 core/search/graphql 等配额桶记录剩余次数和重置时间，配额将耗尽时等待重置后再发请求
+- REST GET 请求的 ETag/Last-Modified 保存在磁盘上，再次请求未变化的资源时返回 304，不计入配额
+- 遇到主/次级限流的 403/429 时按 Retry-After 或重置时间等待后重试
+- 同一 token 在进程内共享同一个客户端和 PyGithub 实例
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from github import Github
+
+logger = logging.getLogger(__name__)
+
+API_URL = 'https://api.github.com'
+GRAPHQL_URL = f'{API_URL}/graphql'
+# 每个配额桶保留的请求次数，避免与其他进程争抢到 0
+RATE_LIMIT_RESERVE = 5
+MAX_RETRIES = 3
+# 磁盘缓存的淘汰策略：条目数上限、最久未使用天数，以及每写入多少条检查一次
+DEFAULT_CACHE_MAX_ENTRIES = 20000
+DEFAULT_CACHE_MAX_AGE_DAYS = 30
+PRUNE_INTERVAL = 200
+
+_clients_lock = threading.Lock()
+_clients = {}
+_githubs = {}
+_search_githubs = {}
+
+def get_github_cache_dir():
+    """获取条件请求缓存目录 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'github_cache'
+
+def prune_cache_dir(cache_dir, max_entries=DEFAULT_CACHE_MAX_ENTRIES, max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS):
+    """
+    淘汰 "digest[:2]/digest.json" 布局的磁盘缓存
+
+    文件的修改时间即最近使用时间（读取命中时会刷新），先删除超过 max_age_days 未使用的条目，
+    条目数仍超过 max_entries 时再删除最久未使用的条目。上限为 0 或 None 表示不限制。
+    """
+    cache_dir = Path(cache_dir)
+    if not cache_dir.exists():
+        return 0
+    entries = []
+    for path in cache_dir.glob('*/*.json'):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    entries.sort(reverse=True)
+    expired = []
+    if max_age_days:
+        cutoff = time.time() - max_age_days * 86400
+        while entries and entries[-1][0] < cutoff:
+            expired.append(entries.pop())
+    if max_entries and len(entries) > max_entries:
+        expired.extend(entries[max_entries:])
+    removed = 0
+    for _, path in expired:
+        try:
+            path.unlink()
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"已淘汰 {removed} 个磁盘缓存条目: {cache_dir}")
+    return removed
+
+class RateLimitScheduler:
+    """按配额桶调度请求，剩余次数不足时等待配额重置"""
+
+    def __init__(self, reserve=RATE_LIMIT_RESERVE):
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def acquire(self, bucket):
+        """发请求前调用，配额不足时阻塞到重置时间"""
+        while True:
+            with self._lock:
+                state = self._buckets.get(bucket)
+                now = time.time()
+                if state is None or state['reset'] <= now or state['remaining'] > self.reserve:
+                    if state is not None and state['reset'] > now:
+                        # 预先扣减，避免并发线程同时用掉最后的配额
+                        state['remaining'] -= 1
+                    return
+                wait = state['reset'] - now + 1
+            logger.warning(f"GitHub {bucket} 配额即将耗尽，等待 {wait:.0f} 秒后继续")
+            time.sleep(wait)
+
+    def update(self, bucket, remaining, limit, reset):
+        with self._lock:
+            self._buckets[bucket] = {'remaining': remaining, 'limit': limit, 'reset': reset}
+
+    def observe(self, headers, default_bucket='core'):
+        """根据响应头更新配额状态"""
+        if 'X-RateLimit-Remaining' not in headers or 'X-RateLimit-Reset' not in headers:
+            return
+        try:
+            self.update(
+                headers.get('X-RateLimit-Resource', default_bucket),
+                int(headers['X-RateLimit-Remaining']),
+                int(headers.get('X-RateLimit-Limit', 0)),
+                int(headers['X-RateLimit-Reset'])
+            )
+        except ValueError:
+            pass
+
+    def observe_github(self, g, bucket):
+        """
+        根据 PyGithub 最近一次响应的配额信息更新状态
+
+        g 的最近一次响应须属于 bucket，多线程共用的实例中最近一次响应可能来自其他配额桶，应使用该桶专用的实例
+        """
+        try:
+            remaining, limit = g.rate_limiting
+            self.update(bucket, remaining, limit, g.rate_limiting_resettime)
+        except Exception as e:
+            logger.debug(f"读取 PyGithub 配额信息失败: {str(e)}")
+
+    def snapshot(self):
+        with self._lock:
+            return {bucket: dict(state) for bucket, state in self._buckets.items()}
+
+class ConditionalCache:
+    """保存 REST 响应的 ETag/Last-Modified 和内容，按条目数和最久未使用时间淘汰"""
+
+    def __init__(self, cache_dir=None, max_entries=DEFAULT_CACHE_MAX_ENTRIES, max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS):
+        self.cache_dir = Path(cache_dir) if cache_dir else get_github_cache_dir()
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.prune()
+
+    def prune(self):
+        """执行一次淘汰"""
+        try:
+            prune_cache_dir(self.cache_dir, self.max_entries, self.max_age_days)
+        except Exception as e:
+            logger.warning(f"淘汰条件请求缓存失败: {str(e)}")
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.cache_dir / digest[:2] / f'{digest}.json'
+
+    def get(self, key):
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # 刷新修改时间，作为淘汰依据的最近使用时间
+            os.utime(path)
+            return entry
+        except Exception as e:
+            logger.debug(f"读取条件请求缓存失败: {str(e)}")
+            return None
+
+    def put(self, key, etag, last_modified, body):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'etag': etag, 'last_modified': last_modified, 'body': body}, f, ensure_ascii=False)
+            tmp_path.replace(path)
+        except Exception as e:
+            logger.debug(f"写入条件请求缓存失败: {str(e)}")
+            return
+        with self._lock:
+            self._writes += 1
+            due = self._writes % PRUNE_INTERVAL == 0
+        if due:
+            self.prune()
+
+class GitHubClient:
+    """带配额调度和条件请求缓存的 GitHub HTTP 客户端"""
+
+    def __init__(self, github_token, cache_dir=None, pool_size=32):
+        self.scheduler = RateLimitScheduler()
+        self.cache = ConditionalCache(cache_dir)
+        # 缓存按 token 隔离，不同 token 可见的内容可能不同
+        self._token_key = hashlib.sha256(github_token.encode('utf-8')).hexdigest()[:16]
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f'bearer {github_token}'})
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+
+    def _request(self, method, url, bucket, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self.scheduler.acquire(bucket)
+            response = self.session.request(method, url, timeout=60, **kwargs)
+            self.scheduler.observe(response.headers, bucket)
+            if response.status_code not in (403, 429) or attempt == MAX_RETRIES:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                wait = int(retry_after) if retry_after.isdigit() else 60
+            elif response.headers.get('X-RateLimit-Remaining') == '0':
+                wait = max(int(response.headers.get('X-RateLimit-Reset', 0)) - time.time(), 0) + 1
+            else:
+                return response
+            logger.warning(f"GitHub 请求被限流，等待 {wait:.0f} 秒后重试: {url}")
+            time.sleep(wait)
+        return response
+
+    def get(self, path, accept='application/vnd.github+json', params=None, bucket='core'):
+        """
+        发送带条件请求缓存的 GET 请求
+
+        Args:
+            bucket: 请求所属的配额桶，如搜索接口为 search
+
+        Returns:
+            str: 响应内容，资源未变化（304）时返回缓存内容
+        """
+        url = path if path.startswith('http') else f'{API_URL}{path}'
+        key = f'{self._token_key}|{accept}|{url}|{json.dumps(params or {}, sort_keys=True)}'
+        cached = self.cache.get(key)
+        headers = {'Accept': accept}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self._request('GET', url, bucket, headers=headers, params=params)
+        if response.status_code == 304 and cached:
+            return cached['body']
+        response.raise_for_status()
+        if response.headers.get('ETag') or response.headers.get('Last-Modified'):
+            self.cache.put(key, response.headers.get('ETag'), response.headers.get('Last-Modified'), response.text)
+        return response.text
+
+    def get_json(self, path, params=None, bucket='core'):
+        return json.loads(self.get(path, params=params, bucket=bucket))
+
+    def get_all(self, path, params=None, per_page=100):
+        """按页获取列表接口的全部结果，返回条数不足一页时结束"""
+        items = []
+        page = 1
+        while True:
+            batch = self.get_json(path, params={**(params or {}), 'per_page': per_page, 'page': page})
+            items += batch
+            if len(batch) < per_page:
+                return items
+            page += 1
+
+    def graphql(self, query, variables=None):
+        """执行 GraphQL 查询，返回 data 字段"""
+        response = self._request('POST', GRAPHQL_URL, 'graphql', json={'query': query, 'variables': variables or {}})
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get('errors'):
+            # 部分节点不存在（如被删除的PR）时仍会返回其余数据
+            logger.warning(f"GraphQL 查询返回错误: {payload['errors'][:3]}")
+        if payload.get('data') is None:
+            raise RuntimeError(f"GraphQL 查询失败: {payload.get('errors')}")
+        return payload['data']
+
+def get_github_client(github_token):
+    """获取进程内共享的 GitHub 客户端"""
+    with _clients_lock:
+        if github_token not in _clients:
+            _clients[github_token] = GitHubClient(github_token)
+        return _clients[github_token]
+
+def get_github(github_token):
+    """获取进程内共享的 PyGithub 实例"""
+    with _clients_lock:
+        if github_token not in _githubs:
+            _githubs[github_token] = Github(github_token)
+        return _githubs[github_token]
+
+def get_search_github(github_token):
+    """
+    获取只用于搜索请求的 PyGithub 实例
+
+    与 get_github 分开，其最近一次响应的配额信息总是 search 桶，不会被其他线程的 core 请求覆盖
+    """
+    with _clients_lock:
+        if github_token not in _search_githubs:
+            _search_githubs[github_token] = Github(github_token)
+        return _search_githubs[github_token]
@@ -0,0 +1,1154 @@
+"""
+Issue 分析核心逻辑
+
+获取 Issue 及其详情、构建提示词、调用大模型分析和生成 Markdown 报告，不依赖 Streamlit，
+供 Web 界面（issue_parser.py）和命令行批量分析（issue_cli.py）共用。
+"""
+from datetime import datetime, time, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+import json
+import logging
+import re
+import threading
+import time as time_module
+from pathlib import Path
+from analysis_cache import get_analysis_cache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_AGE_DAYS
+from llm_client import get_openai_client, get_retry_policy, DEFAULT_MAX_RETRIES, DEFAULT_HEDGE_QUANTILE
+from scan_state import format_time, TIME_FORMAT
+from issue_source import LazyIssueList
+from analysis_stream import SectionStreamParser, parse_risk_level
+from prompt_budget import compact_issue_inputs, count_tokens
+from issue_loader import (load_issue_details_bulk, parse_repo_fullname, format_github_time, join_patches, PayloadMemo,
+                          get_payload_dir, BULK_BATCH_SIZE, MEMO_MAX_ENTRIES, PR_PATCH_LIMIT, COMMIT_PATCH_LIMIT)
+from github_client import get_search_github, get_github_client, DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_AGE_DAYS
+from near_duplicates import build_duplicate_index, DEFAULT_REUSE_THRESHOLD
+from prefilter import build_prefilter, DEFAULT_THRESHOLD as DEFAULT_PREFILTER_THRESHOLD
+from report_index import ReportIndex, get_index_path
+
+logger = logging.getLogger(__name__)
+
+# 配置管理相关函数
+def get_config_path():
+    """获取配置文件路径 - 直接保存在当前目录"""
+    return Path(__file__).parent / 'config.json'
+
+def load_config():
+    """加载配置"""
+    config_path = get_config_path()
+    if config_path.exists():
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"加载配置文件失败: {str(e)}")
+    return {}
+
+def save_config(config):
+    """保存配置"""
+    config_path = get_config_path()
+    try:
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=4)
+        return True
+    except Exception as e:
+        logger.error(f"保存配置文件失败: {str(e)}")
+        return False
+
+def get_issue_details(issue, github_token, memo=None):
+    """
+    获取issue的详细信息，包括评论和相关的commit
+
+    优先使用 GraphQL 批量加载，失败时回退到逐个调用 REST 接口
+    """
+    repo_fullname = parse_repo_fullname(issue.html_url)
+    if repo_fullname:
+        details = load_issue_details_bulk(repo_fullname, [issue.number], github_token, memo).get(issue.number)
+        if details is not None:
+            return details
+    return get_issue_details_rest(issue, github_token, memo)
+
+def get_configured_cache(config):
+    """按配置中的容量和保留天数获取分析缓存"""
+    return get_analysis_cache(
+        max_entries=config.get('cache_max_entries', DEFAULT_MAX_ENTRIES),
+        max_age_days=config.get('cache_max_age_days', DEFAULT_MAX_AGE_DAYS)
+    )
+
+def get_configured_retry_policy(config):
+    """按配置中的重试次数和对冲请求设置获取大模型调用策略"""
+    return get_retry_policy(
+        max_retries=config.get('llm_max_retries', DEFAULT_MAX_RETRIES),
+        hedge=config.get('llm_hedge', False),
+        hedge_quantile=config.get('llm_hedge_quantile', DEFAULT_HEDGE_QUANTILE)
+    )
+
+def create_payload_memo(config):
+    """创建一次分析批次内共享的PR/commit负载记忆表，配置 payload_memo_persist 时跨运行持久化"""
+    return PayloadMemo(
+        max_entries=config.get('payload_memo_max_entries', MEMO_MAX_ENTRIES),
+        persist_dir=get_payload_dir() if config.get('payload_memo_persist') else None,
+        persist_max_entries=config.get('payload_memo_persist_max_entries', DEFAULT_CACHE_MAX_ENTRIES),
+        persist_max_age_days=config.get('payload_memo_persist_max_age_days', DEFAULT_CACHE_MAX_AGE_DAYS)
+    )
+
+def build_pr_payload(pr, files):
+    """
+    聚合 PR 的文件级 patch，构建与 commit 一致的负载结构
+
+    Args:
+        pr: REST 接口返回的 PR
+        files: REST 接口返回的 PR 修改文件列表
+    """
+    patch_content = join_patches([(f['filename'], f.get('patch')) for f in files], PR_PATCH_LIMIT)
+    return {
+        'sha': (pr.get('head') or {}).get('sha') or f"PR#{pr['number']}",
+        'message': pr.get('title') or '',
+        'author': (pr.get('user') or {}).get('login', ''),
+        'date': format_github_time(pr.get('created_at')),
+        'url': pr['html_url'],
+        'files_changed': [f['filename'] for f in files],
+        'patch': patch_content or ''
+    }
+
+def build_commit_payload(commit):
+    """聚合 REST 接口返回的 commit 的文件级 patch"""
+    files = commit.get('files') or []
+    author = (commit.get('commit') or {}).get('author') or {}
+    return {
+        'sha': commit['sha'],
+        'message': commit['commit'].get('message') or '',
+        'author': author.get('name') or '',
+        'date': format_github_time(author.get('date')),
+        'url': commit['html_url'],
+        'files_changed': [f['filename'] for f in files],
+        'patch': join_patches([(f['filename'], f.get('patch')) for f in files], COMMIT_PATCH_LIMIT) or ''
+    }
+
+def get_issue_details_rest(issue, github_token, memo=None):
+    """
+    通过 REST 接口获取issue的详细信息，包括评论和相关的commit
+
+    请求经由共享的 GitHub 客户端，与 GraphQL 路径一样按配额桶调度并使用条件请求缓存
+    
+    Args:
+        issue: GitHub issue对象
+        github_token: GitHub token
+        memo: PR/commit 负载记忆表（可选）
+    
+    Returns:
+        dict: 包含issue详细信息的字典
+    """
+    try:
+        client = get_github_client(github_token)
+        memo = memo or PayloadMemo()
+        repo_fullname = parse_repo_fullname(issue.html_url)
+        
+        # 获取评论
+        comments = []
+        try:
+            if not repo_fullname:
+                raise RuntimeError("无法解析仓库名")
+            for comment in client.get_all(f"/repos/{repo_fullname}/issues/{issue.number}/comments"):
+                comments.append({
+                    'author': (comment.get('user') or {}).get('login', 'ghost'),
+                    'created_at': format_github_time(comment.get('created_at')),
+                    'body': comment.get('body') or ''
+                })
+        except Exception as e:
+            logger.warning(f"获取Issue #{issue.number}的评论失败: {str(e)}")
+        
+        # 获取相关的commit/PR
+        commits = []
+        try:
+            if not repo_fullname:
+                raise RuntimeError("无法解析仓库名")
+
+            # 汇总文本用于正则提取 PR/commit URL
+            all_text = (issue.body or '') + '\n'
+            for comment in comments:
+                all_text += (comment.get('body') or '') + '\n'
+
+            # 1) 从文本中提取 PR URL 中的编号
+            owner, name = repo_fullname.split('/', 1)
+            pr_nums_from_text = set(re.findall(rf'github\.com/{re.escape(owner)}/{re.escape(name)}/pull/(\d+)', all_text,
+                                               re.IGNORECASE))
+
+            # 2) 搜索引用当前 Issue 的 PR（如 Fixes #<num>/Closes #<num>/Resolves #<num> 等）
+            pr_nums_from_search = set()
+            try:
+                search_queries = [
+                    f"repo:{repo_fullname} is:pr in:body {issue.number}",
+                    f"repo:{repo_fullname} is:pr in:title {issue.number}",
+                ]
+                for q in search_queries:
+                    for pr_issue in client.get_json('/search/issues', params={'q': q}, bucket='search')['items']:
+                        if pr_issue.get('pull_request') is not None:  # 确认是PR
+                            pr_nums_from_search.add(str(pr_issue['number']))
+            except Exception as e:
+                logger.debug(f"搜索关联PR失败: {str(e)}")
+
+            related_pr_numbers = list({*pr_nums_from_text, *pr_nums_from_search})
+
+            # 3) 从文本中提取 commit URL，仅处理 40位完整 sha，避免误命中如 cb33accc 的短SHA
+            related_commits = [
+                (f"{o}/{n}", sha) for o, n, sha in
+                re.findall(r'github\.com/([^/\s]+)/([^/\s]+)/commit/([a-f0-9]{40})\b', all_text.lower())
+            ]
+
+            # 先处理关联 PR：直接从 PR 收集 patch（比散落commit链接更可靠）
+            def load_pr(pr_num):
+                pr = client.get_json(f"/repos/{repo_fullname}/pulls/{pr_num}")
+                return build_pr_payload(pr, client.get_all(f"/repos/{repo_fullname}/pulls/{pr_num}/files"))
+
+            for pr_num_str in related_pr_numbers:
+                try:
+                    pr_num = int(pr_num_str)
+                    commits.append(memo.get_or_load(
+                        f"pr:{repo_fullname.lower()}#{pr_num}",
+                        lambda pr_num=pr_num: load_pr(pr_num)
+                    ))
+                except Exception as e:
+                    logger.debug(f"获取PR #{pr_num_str}详情失败: {str(e)}")
+
+            # 再处理明确的 commit URL
+            for full_repo, sha in dict.fromkeys(related_commits):
+                try:
+                    commits.append(memo.get_or_load(
+                        f"commit:{full_repo}@{sha}",
+                        lambda full_repo=full_repo, sha=sha: build_commit_payload(
+                            client.get_json(f"/repos/{full_repo}/commits/{sha}")
+                        ),
+                        persist=True
+                    ))
+                except Exception as e:
+                    logger.debug(f"获取commit {full_repo}@{sha} 失败: {str(e)}")
+
+        except Exception as e:
+            logger.warning(f"获取Issue #{issue.number}的相关commit/PR失败: {str(e)}")
+        
+        return {
+            'comments': comments,
+            'commits': commits
+        }
+        
+    except Exception as e:
+        logger.error(f"获取Issue #{issue.number}的详细信息失败: {str(e)}")
+        return {'comments': [], 'commits': []}
+
+# Issue风险判断标准，完整分析和初筛共用
+RISK_CRITERIA = """    1. 风险评级分为三类，不涉及，低风险和高风险
+    2. 如果该issue描述的问题非安全问题，则风险评级判断为不涉及
+    3. 如果该issue描述的问题是安全问题，则需要根据问题描述及其影响判断风险等级，使用CVSS 3.1评分标准打分，high以上为高风险，其他均为低风险
+    4. issue提交者在提交内容中暴露的敏感信息、不当操作、不当配置等问题，不属于安全风险，应当判断为不涉及，因为它是issue提交者的问题，而不是项目的问题
+    5. 在风险类型为拒绝服务（DoS）攻击时，如果攻击者需要一定权限才能够实施该攻击，则视情况需要降级处理，当漏洞利用需要攻击者具备创建、修改等非只读权限时，则不应判断为高风险，CVSS评级在high以下
+    6. 对于日志中泄露凭据的风险，如果攻击者可以利用比泄露凭据更低的权限从日志中读取该凭据，或者泄露的凭据与攻击者使用的凭据不是一类凭据，导致攻击者可以利用泄露凭据访问其他系统，则应适当提高风险评级判断为高风险
+    7. 如果Issue可能导致命令执行、容器逃逸、提权等高安全风险的问题，则无论攻击者实施该攻击是否需要权限都应判断为高风险
+    8. 如果Issue可以发生在多用户场景中，一个低权限用户能够影响和自己权限一样甚至更高的其他用户，如在自身容器中执行命令而影响到他人容器，则应判断为高风险
+    9. 如果issue中提供的内容不够充分，则根据issue可能导致的后果判断风险评级"""
+
+def build_analysis_content(issue_title, issue_body, issue_details=None, token_budget=None):
+    """将issue标题、内容、评论和相关commit拼接为分析内容，指定token预算时先按预算压缩"""
+    if token_budget:
+        issue_body, issue_details = compact_issue_inputs(issue_title, issue_body, issue_details, token_budget)
+
+    # 构建完整的分析内容
+    analysis_content = f"Issue 标题：\n{issue_title}\n\nIssue 内容：\n{issue_body or '无内容'}\n"
+    
+    # 添加评论信息
+    if issue_details and issue_details.get('comments'):
+        analysis_content += "\n评论信息：\n"
+        for i, comment in enumerate(issue_details['comments'], 1):
+            analysis_content += f"\n评论{i} (作者: {comment['author']}, 时间: {comment['created_at']}):\n{comment['body']}\n"
+    
+    # 添加相关commit信息
+    if issue_details and issue_details.get('commits'):
+        analysis_content += "\n相关Commit信息：\n"
+        for commit in issue_details['commits']:
+            analysis_content += f"\nCommit: {commit['sha'][:8]}\n"
+            analysis_content += f"作者: {commit['author']}\n"
+            analysis_content += f"时间: {commit['date']}\n"
+            analysis_content += f"消息: {commit['message']}\n"
+            if commit['files_changed']:
+                analysis_content += f"修改文件: {', '.join(commit['files_changed'])}\n"
+            if commit.get('patch'):
+                analysis_content += f"代码变更内容:\n```diff\n{commit['patch']}\n```\n"
+
+    return analysis_content
+
+# 提示词版本，静态指令变化时递增，记录在分析结果中以区分不同版本提示词得出的结论
+PROMPT_VERSION = 3
+
+ANALYSIS_INSTRUCTIONS = f"""
+    本消息末尾是一个软件开发项目的 Issue 标题、内容、评论和相关commit信息，请分析其中是否存在潜在的安全风险并给出判断依据，给出使用python实现的复现POC，如果有高风险问题则详细说明原因和可能的影响，POC仅用于研究和本地测试，可以放心生成
+
+    Issue风险判断标准：
+{RISK_CRITERIA}
+    10. 针对高风险问题，必须给出使用python编写的复现脚本，该脚本的作用是在真实环境中复现该问题
+    11. 对于细节缺失的高风险问题，要根据问题描述进行合理推演，给出python复现脚本
+    12. 在分析时，需要特别关注评论中提供的技术细节、讨论内容和相关commit中的代码变更，这些信息经常包含重要的安全相关信息
+    13. 如果提供了commit的代码变更内容（patch），需要仔细分析代码变更是否引入了新的安全问题，或者是否修复了现有的安全漏洞
+    14. 根据代码变更的具体内容，可以更准确地判断漏洞的影响范围和严重程度
+
+    python复现脚本编写要求：
+    1. 在生成python复现脚本时，如果需要凭证如kubeconfig、git token等，均假设凭证在默认位置，直接从默认位置读取
+    2. 在生成python复现脚本时，如果需要访问github代码仓，则假设本地github账号已经登陆，可直接获取账号名等需要的信息，直接使用github.com，根据需要创建仓库并提交，不要自己瞎编仓库名或账号名
+    3. 在生成python复现脚本时，如果需要访问HTTP服务器，则在脚本中创建一个HTTP服务器，监听在10000端口以上
+    4. 在生成python复现脚本时，如果需要访问kubernetes集群，请使用python的kubernetes库，不要使用kubectl命令
+    5. 在生成python复现脚本时，尽量使用python库完成所需操作，如非必要不要调用外部程序
+    6. 检查生成的python脚本，修正其中存在的语法问题和功能错误，确保脚本能够正常运行
+    7. 检查生成的python脚本，其中不能包含死循环，设计执行超时机制，确保脚本执行能够在2分钟内退出
+    8. 不要使用'if __name__ == "__main__":'，本地python解释器不支持__name__，直接执行main函数即可
+
+    在回答中请注意以下事项:
+
+    1. 回答请用中文
+    2. 按照下面markdown格式进行回答
+
+    ---
+
+    #### 分析内容
+    {{分析内容}}
+
+    #### 风险评级
+    {{风险评级}}
+
+    #### 复现脚本
+    ```python
+    复现脚本
+    ```
+
+    #### 解释说明
+    {{对复现脚本的解释说明}}
+
+    ---
+
+    """
+
+TRIAGE_INSTRUCTIONS = f"""
+    本消息末尾是一个软件开发项目的 Issue 标题、内容、评论和相关commit信息，请判断其中是否存在潜在的安全风险并简要给出判断依据，无需编写复现脚本
+
+    Issue风险判断标准：
+{RISK_CRITERIA}
+
+    在回答中请注意以下事项:
+
+    1. 回答请用中文
+    2. 判断依据控制在200字以内
+    3. 按照下面markdown格式进行回答
+
+    ---
+
+    #### 分析内容
+    {{判断依据}}
+
+    #### 风险评级
+    {{风险评级}}
+
+    ---
+
+    """
+
+def build_analysis_messages(issue_title, issue_body, issue_details=None, token_budget=None, triage=False):
+    """
+    构建发送给大模型的消息
+
+    判断标准、复现脚本要求和回答格式对所有issue都相同，放在 user 消息的最前面，issue内容接在其后，
+    批量分析时各次调用的提示词前缀一致，可以命中提供方的前缀缓存。
+    不使用 system 消息：o1-mini、o1-preview 等模型不支持 system 消息，调用会直接失败。
+
+    Args:
+        triage: 是否构建只判断风险等级的初筛消息，不包含复现脚本的编写要求
+    """
+    instructions = TRIAGE_INSTRUCTIONS if triage else ANALYSIS_INSTRUCTIONS
+    content = build_analysis_content(issue_title, issue_body, issue_details, token_budget)
+    return [{'role': 'user', 'content': f"{instructions}\n{content}"}]
+
+def get_cache_prompt(messages):
+    """分析缓存按提示词版本和全部消息内容计算键"""
+    return f"v{PROMPT_VERSION}\n" + '\n'.join(f"[{m['role']}]\n{m['content']}" for m in messages)
+
+def parse_analysis_response(content):
+    """
+    解析大模型返回的 Markdown
+
+    Returns:
+        tuple: (分析结果字典, 风险等级)，风险等级 2为高风险，1为低风险，0为不涉及
+    """
+    # 提取分析内容
+    analysis_match = re.search(r'#### 分析内容\s*(.*?)\s*####', content, re.DOTALL)
+    analysis = analysis_match.group(1).strip() if analysis_match else ''
+    
+    # 提取风险评级
+    # 初筛回复中风险评级是最后一个段落，以分隔线结束
+    risk_match = re.search(r'#### 风险评级\s*(.*?)\s*(?:####|---|\Z)', content, re.DOTALL)
+    risk = risk_match.group(1).strip() if risk_match else '不涉及'
+    
+    # 提取复现脚本
+    poc_match = re.search(r'```python\s*(.*?)\s*```', content, re.DOTALL)
+    poc = poc_match.group(1).strip() if poc_match else ''
+    
+    # 提取解释说明
+    explain_match = re.search(r'#### 解释说明\s*(.*?)\s*---', content, re.DOTALL)
+    explain = explain_match.group(1).strip() if explain_match else ''
+    
+    # 构建结果
+    result = {
+        'analysis': analysis,
+        'has_risk': risk,
+        'poc': poc,
+        'explain': explain
+    }
+    
+    return result, parse_risk_level(risk)
+
+def analyze_issue(api_key, base_url, issue_title, issue_body, issue_details=None, model=None, force_refresh=False,
+                  stream=False, on_section=None, early_exit=False, triage=False, token_budget=None, cache=None,
+                  ensemble_models=None, ensemble_weights=None, retry_policy=None):
+    """
+    调用大模型分析issue
+
+    Args:
+        model: 分析使用的模型，工作线程中无法访问会话状态，需由调用方显式传入
+        ensemble_models: 多模型集成时额外使用的模型，与 model 并发分析同一提示词后投票得出结论
+        ensemble_weights: 各模型的投票权重 {模型: 权重}，未设置的模型权重为1
+        triage: 是否只做风险初筛，初筛使用不含复现脚本要求的简短提示词
+        token_budget: issue内容、评论和patch的token预算，为空时不压缩
+        stream: 是否使用流式输出，流式输出时每收到一个段落的内容就回调 on_section
+        on_section: 段落回调 on_section(段落名, 段落文本, 是否已结束)
+        early_exit: 流式输出时风险评级为不涉及则立即结束生成，不再生成复现脚本
+        cache: 分析缓存，为空时按 config.json 中的配置获取
+        retry_policy: 大模型调用的重试和对冲策略，为空时按 config.json 中的配置获取
+
+    Returns:
+        tuple: (分析结果字典, 风险等级)，失败时风险等级为-1，结果字典的 error 字段为错误信息；
+               成功时结果字典的 usage 字段记录token用量和耗时，多模型集成时 ensemble 字段记录各模型的投票
+    """
+    extra_models = [m for m in dict.fromkeys(ensemble_models or []) if m != model]
+    if extra_models and not triage:
+        return analyze_issue_ensemble(
+            api_key, base_url, issue_title, issue_body, issue_details, [model] + extra_models, ensemble_weights,
+            force_refresh=force_refresh, stream=stream, on_section=on_section, early_exit=early_exit,
+            token_budget=token_budget, cache=cache, retry_policy=retry_policy
+        )
+
+    messages = build_analysis_messages(issue_title, issue_body, issue_details, token_budget, triage)
+    prompt = get_cache_prompt(messages)
+
+    # 提示词和模型均未变化时直接使用缓存的回复
+    if cache is None or retry_policy is None:
+        config = load_config()
+        cache = cache or get_configured_cache(config)
+        retry_policy = retry_policy or get_configured_retry_policy(config)
+    if not force_refresh:
+        content = cache.get(prompt, model)
+        if content is not None:
+            logger.info('命中分析缓存')
+            if on_section:
+                # 缓存命中时同样按段落回调，界面展示保持一致
+                parser = SectionStreamParser(on_section)
+                parser.feed(content)
+                parser.close()
+            result, has_risk = parse_analysis_response(content)
+            result['usage'] = build_usage(None, 0, model, cached=True)
+            result['prompt_version'] = PROMPT_VERSION
+            return result, has_risk
+
+    try:
+        logger.info('开始分析')
+        client = get_openai_client(api_key, base_url)
+        started = time_module.monotonic()
+        if stream:
+            content, usage, retries, truncated = stream_analysis(client, model, messages, on_section, early_exit,
+                                                                 retry_policy)
+            # 流式调用不发出对冲请求
+            hedges = 0
+        else:
+            response, retries, hedges = create_completion(
+                client,
+                retry_policy,
+                model=model,
+                messages=messages
+            )
+            
+            # 解析返回的 Markdown
+            content = response.choices[0].message.content.strip()
+            usage = response.usage
+            truncated = False
+
+        #logger.info(f"返回的内容: {content}")
+        result, has_risk = parse_analysis_response(content)
+        result['usage'] = build_usage(usage, time_module.monotonic() - started, model, prompt=prompt, content=content,
+                                      retries=retries, hedges=hedges)
+        result['prompt_version'] = PROMPT_VERSION
+        # 提前结束的回复缺少复现脚本和解释说明，不写入缓存，避免之后的完整分析命中不完整的结果
+        if not truncated:
+            cache.put(prompt, model, content)
+        
+        logger.info('分析完成')
+        return result, has_risk
+    except Exception as e:
+        logger.error(f"分析 Issue 时发生错误: {str(e)}")
+        return {"error": f"分析失败: {str(e)}"}, -1
+
+def vote_risk_levels(votes):
+    """
+    按权重投票得出风险等级，得票相同时取较高的风险等级
+
+    Args:
+        votes: [(风险等级, 权重)]
+
+    Returns:
+        tuple: (风险等级, 该等级得票占总权重的比例)
+    """
+    tally = {}
+    for level, weight in votes:
+        tally[level] = tally.get(level, 0) + weight
+    level = max(tally, key=lambda lv: (tally[lv], lv))
+    total = sum(tally.values())
+    return level, round(tally[level] / total, 2) if total else 0.0
+
+def analyze_issue_ensemble(api_key, base_url, issue_title, issue_body, issue_details, models, weights=None,
+                           stream=False, on_section=None, **analyze_options):
+    """
+    多个模型并发分析同一提示词并投票
+
+    耗时取决于最慢的一次调用；流式输出和段落回调只用于第一个模型。
+    结论的分析内容和复现脚本取自投票结果一致的模型中排在最前的一个。
+
+    Returns:
+        tuple: 与 analyze_issue 相同，结果字典的 ensemble 字段为
+               {'votes': [{'model', 'has_risk', 'risk', 'weight', 'error'}], 'agreement', 'disagreement'}
+    """
+    weights = weights or {}
+
+    def run(index, model):
+        options = dict(analyze_options, stream=stream, on_section=on_section) if index == 0 else analyze_options
+        return analyze_issue(api_key, base_url, issue_title, issue_body, issue_details, model=model, **options)
+
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        outcomes = list(executor.map(run, range(len(models)), models))
+
+    votes = []
+    for model, (result, has_risk) in zip(models, outcomes):
+        vote = {'model': model, 'has_risk': has_risk, 'weight': weights.get(model, 1)}
+        if has_risk == -1:
+            vote['error'] = result['error']
+        else:
+            vote['risk'] = result['has_risk']
+        votes.append(vote)
+    valid = [(model, result, has_risk) for model, (result, has_risk) in zip(models, outcomes) if has_risk != -1]
+    if not valid:
+        return {'error': '; '.join(f"{v['model']}: {v['error']}" for v in votes)}, -1
+
+    has_risk, agreement = vote_risk_levels([(level, weights.get(model, 1)) for model, _, level in valid])
+    result = dict(next(result for _, result, level in valid if level == has_risk))
+    usage = merge_usage([r['usage'] for _, r, _ in valid])
+    # 各模型并发调用，耗时为最慢的一次
+    usage['latency'] = max(r['usage']['latency'] for _, r, _ in valid)
+    result['usage'] = usage
+    result['ensemble'] = {
+        'votes': votes,
+        'agreement': agreement,
+        'disagreement': len({level for _, _, level in valid}) > 1
+    }
+    logger.info(f"多模型集成结论 {has_risk}，一致度 {agreement}")
+    return result, has_risk
+
+RISK_LABELS = {2: '高风险', 1: '低风险', 0: '不涉及', -1: '失败'}
+
+def format_ensemble_votes(ensemble):
+    """将多模型投票格式化为一行文本"""
+    votes = '；'.join(
+        f"{v['model']}: {RISK_LABELS[v['has_risk']]}" + (f"（权重{v['weight']}）" if v['weight'] != 1 else '')
+        for v in ensemble['votes']
+    )
+    status = '存在分歧' if ensemble['disagreement'] else '结论一致'
+    return f"{votes}（{status}，一致度 {ensemble['agreement']}）"
+
+def create_duplicate_index(config, results=()):
+    """由历史报告检索库和已有结果构建近似重复索引，沿用结论的相似度阈值由 duplicate_reuse_threshold 设置"""
+    report_index = ReportIndex() if get_index_path().exists() else None
+    return build_duplicate_index(
+        results, report_index,
+        reuse_threshold=config.get('duplicate_reuse_threshold', DEFAULT_REUSE_THRESHOLD)
+    )
+
+def create_prefilter(config):
+    """构建本地预筛，历史报告检索库存在时用其中的结论训练模型，目标精度由 prefilter_threshold 设置"""
+    report_index = ReportIndex() if get_index_path().exists() else None
+    return build_prefilter(report_index, threshold=config.get('prefilter_threshold', DEFAULT_PREFILTER_THRESHOLD))
+
+USAGE_FIELDS = ('calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'reasoning_tokens', 'total_tokens', 'latency',
+                'retries', 'hedges')
+
+def create_completion(client, retry_policy=None, **kwargs):
+    """
+    按重试和对冲策略调用 chat.completions.create
+
+    Returns:
+        tuple: (解析后的回复，流式调用时为 Stream, 重试次数, 对冲请求数)
+    """
+    return (retry_policy or get_configured_retry_policy(load_config())).call(client, **kwargs)
+
+def build_usage(usage, latency, model, cached=False, prompt='', content='', retries=0, hedges=0):
+    """
+    整理一次调用的token用量、耗时、重试次数和对冲请求数，models 字段按模型记录同样的统计
+
+    cached_tokens 为提示词中命中提供方前缀缓存的token数，
+    接口未返回用量时（如流式输出提前结束）按提示词和回复估算，estimated 标记为真
+    """
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+        details = getattr(usage, 'completion_tokens_details', None)
+        reasoning_tokens = getattr(details, 'reasoning_tokens', None) or 0
+        cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+    else:
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        reasoning_tokens = cached_tokens = 0
+    stats = {
+        'calls': 0 if cached else 1,
+        'prompt_tokens': prompt_tokens,
+        'cached_tokens': cached_tokens,
+        'completion_tokens': completion_tokens,
+        'reasoning_tokens': reasoning_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+        'latency': round(latency, 3),
+        'retries': retries,
+        'hedges': hedges
+    }
+    return dict(stats, cached=cached, estimated=usage is None and not cached, models={model: dict(stats)})
+
+def merge_usage(usages):
+    """合并多次调用（如初筛和完整分析、多个issue）的用量"""
+    merged = dict.fromkeys(USAGE_FIELDS, 0)
+    merged.update(cached=True, estimated=False, models={})
+    for usage in usages:
+        for key in USAGE_FIELDS:
+            merged[key] += usage.get(key, 0)
+        merged['cached'] = merged['cached'] and usage['cached']
+        merged['estimated'] = merged['estimated'] or usage['estimated']
+        for model, stats in usage.get('models', {}).items():
+            model_stats = merged['models'].setdefault(model, dict.fromkeys(USAGE_FIELDS, 0))
+            for key in USAGE_FIELDS:
+                model_stats[key] += stats.get(key, 0)
+    merged['latency'] = round(merged['latency'], 3)
+    for stats in merged['models'].values():
+        stats['latency'] = round(stats['latency'], 3)
+    return merged
+
+def summarize_usage(results, top=5):
+    """
+    汇总一批分析结果的用量
+
+    Returns:
+        dict: {'total': 合并后的用量, 'top_issues': 按token数从高到低的前 top 个 (issue编号, 标题, 用量)}
+    """
+    with_usage = [r for r in results if r.get('usage')]
+    ranked = sorted(with_usage, key=lambda r: (r['usage']['total_tokens'], r['usage']['latency']), reverse=True)
+    return {
+        'total': merge_usage(r['usage'] for r in with_usage),
+        'top_issues': [(r['issue_number'], r['issue_title'], r['usage']) for r in ranked[:top]]
+    }
+
+def format_cache_hit_rate(usage):
+    """提示词token中命中提供方前缀缓存的比例"""
+    if not usage['prompt_tokens']:
+        return '-'
+    return f"{usage.get('cached_tokens', 0) / usage['prompt_tokens']:.1%}"
+
+def format_usage(usage):
+    """将用量格式化为一行文本"""
+    text = f"提示 {usage['prompt_tokens']}"
+    if usage.get('cached_tokens'):
+        text += f"（缓存命中 {usage['cached_tokens']}）"
+    text += f" / 输出 {usage['completion_tokens']} tokens"
+    if usage.get('reasoning_tokens'):
+        text += f"（推理 {usage['reasoning_tokens']}）"
+    text += f"，耗时 {usage['latency']:.1f} 秒"
+    if usage.get('retries'):
+        text += f"，重试 {usage['retries']} 次"
+    if usage.get('hedges'):
+        text += f"，对冲 {usage['hedges']} 次"
+    if usage.get('estimated'):
+        text += "（部分为估算）"
+    return text
+
+def stream_analysis(client, model, messages, on_section=None, early_exit=False, retry_policy=None):
+    """
+    流式获取分析回复
+
+    Returns:
+        tuple: (已接收的完整文本, 接口返回的用量, 重试次数, 是否提前结束)，提前结束或接口不支持时用量为None
+    """
+    parser = SectionStreamParser(on_section)
+    usage = None
+    truncated = False
+    response, retries, _ = create_completion(
+        client,
+        retry_policy,
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={'include_usage': True}
+    )
+    try:
+        for chunk in response:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            parser.feed(chunk.choices[0].delta.content or '')
+            if early_exit and parser.risk_level == 0:
+                # 不涉及安全风险时无需复现脚本，提前结束生成以节省token
+                logger.info('风险评级为不涉及，提前结束生成')
+                truncated = True
+                break
+    finally:
+        response.close()
+    parser.close()
+    return parser.text.strip(), usage, retries, truncated
+
+def get_issues(repo_name, labels, since_time, until_time, github_token, updated_since=None):
+    """
+    搜索符合条件的 Issue
+
+    返回按需分页的序列，只在访问时请求对应的搜索分页；结果超过搜索上限时自动拆分时间窗口。
+    updated_since 不为空时为增量查询：只返回起始时间之后创建、且在检查点之后更新过的 Issue，
+    按更新时间升序排列，便于逐步推进检查点；搜索失败时抛出异常，由调用方提示
+    """
+    # 搜索使用专用的 PyGithub 实例，翻页后读取的配额信息才属于 search 桶
+    g = get_search_github(github_token)
+    scheduler = get_github_client(github_token).scheduler
+
+    # 构建查询参数
+    labels_query = ' '.join([f'label:{label.strip()}' for label in labels.split(',')])
+    since_str = since_time.strftime('%Y-%m-%d')
+
+    if updated_since:
+        base_query = f'repo:{repo_name} is:issue {labels_query} created:>={since_str}'
+        since = datetime.strptime(updated_since, TIME_FORMAT).replace(tzinfo=timezone.utc)
+        return LazyIssueList(g, base_query, 'updated', since, datetime.now(timezone.utc), scheduler=scheduler)
+
+    base_query = f'repo:{repo_name} is:issue {labels_query}'
+    since = datetime.combine(since_time, time.min, tzinfo=timezone.utc)
+    until = datetime.combine(until_time, time(23, 59, 59), tzinfo=timezone.utc)
+    return LazyIssueList(g, base_query, 'created', since, until, scheduler=scheduler)
+
+# 分析结果的判定阶段
+STAGE_LABELS = {'triage': '初筛', 'full': '完整分析', 'duplicate': '近似重复', 'prefilter': '预筛'}
+
+def build_local_result(issue, analysis_result, has_risk, stage, stage_model, **extra):
+    """构建未调用大模型、在本地判定的分析结果，不包含issue详情"""
+    result = {
+        'issue_number': issue.number,
+        'issue_title': issue.title,
+        'issue_url': issue.html_url,
+        'labels': [label.name for label in issue.labels],
+        'created_at': format_time(issue.created_at),
+        'analysis': analysis_result,
+        'has_risk': has_risk,
+        'issue_body': issue.body or '',
+        'comments': [],
+        'commits': [],
+        'updated_at': format_time(issue.updated_at),
+        'stage': stage,
+        'stage_model': stage_model,
+        'usage': merge_usage([])
+    }
+    result.update(extra)
+    return result
+
+def build_duplicate_result(issue, match):
+    """沿用近似重复issue的结论构建分析结果，不获取详情也不调用大模型"""
+    verdict = match['verdict']
+    return build_local_result(
+        issue, dict(verdict['analysis']), verdict['has_risk'], 'duplicate', verdict['stage_model'],
+        similar_issue={
+            'issue_number': match['issue_number'],
+            'issue_url': verdict['issue_url'],
+            'similarity': round(match['similarity'], 2)
+        }
+    )
+
+def build_prefilter_result(issue, verdict):
+    """本地预筛判定为不涉及的分析结果"""
+    analysis_result = {'has_risk': '不涉及', 'analysis': f"本地预筛：{verdict['reason']}", 'poc': '', 'explain': ''}
+    return build_local_result(issue, analysis_result, 0, 'prefilter', verdict['method'], prefilter=verdict)
+
+def find_local_verdict(issue, duplicate_index=None, prefilter=None):
+    """
+    在调用大模型前按近似重复索引和本地预筛判定issue
+
+    Returns:
+        tuple: (本地判定的分析结果，需要调用大模型时为None, 近似重复索引中最相似的issue)
+    """
+    match = None
+    if duplicate_index is not None:
+        match = duplicate_index.find(issue.number, issue.title, issue.body or '')
+        if match and match['similarity'] >= duplicate_index.reuse_threshold:
+            logger.info(f"Issue #{issue.number} 与 #{match['issue_number']} 近似重复（相似度 {match['similarity']:.2f}），沿用其结论")
+            return build_duplicate_result(issue, match), match
+
+    if prefilter is not None:
+        verdict = prefilter.classify(issue.title, issue.body or '', [label.name for label in issue.labels])
+        if verdict:
+            logger.info(f"Issue #{issue.number} 预筛判定为不涉及: {verdict['reason']}")
+            return build_prefilter_result(issue, verdict), match
+    return None, match
+
+def build_issue_result(issue, issue_details, analysis_result, has_risk, stage, stage_model, usages, match=None,
+                       ensemble=None):
+    """构建调用大模型得出的分析结果，usages 为各阶段的用量"""
+    result = {
+        'issue_number': issue.number,
+        'issue_title': issue.title,
+        'issue_url': issue.html_url,
+        'labels': [label.name for label in issue.labels],
+        'created_at': format_time(issue.created_at),
+        'analysis': analysis_result,
+        'has_risk': has_risk,
+        'issue_body': issue.body or '',
+        'comments': issue_details['comments'], # 添加评论信息
+        'commits': issue_details['commits'], # 添加commit信息
+        'updated_at': format_time(issue.updated_at), # 用于增量扫描判断结果是否过期
+        'stage': stage, # 产生该结论的阶段
+        'stage_model': stage_model,
+        'usage': merge_usage(usages) # 各阶段合计的token用量和耗时
+    }
+    if ensemble:
+        result['ensemble'] = ensemble # 多模型集成时各模型的投票
+    if match:
+        result['similar_issue'] = {
+            'issue_number': match['issue_number'],
+            'issue_url': match['verdict']['issue_url'],
+            'similarity': round(match['similarity'], 2)
+        }
+    return result
+
+def run_issue_analysis(issue, api_key, base_url, github_token, model, github_semaphore=None, llm_semaphore=None,
+                       issue_details=None, triage_model=None, payload_memo=None, duplicate_index=None, prefilter=None,
+                       **analyze_options):
+    """
+    获取issue详情并调用大模型分析，不读写会话状态，可在工作线程中执行
+
+    Args:
+        issue: GitHub issue对象
+        api_key: OpenAI API Key
+        base_url: OpenAI Base URL
+        github_token: GitHub token
+        model: 分析使用的模型
+        github_semaphore: 限制GitHub并发请求的信号量（可选）
+        llm_semaphore: 限制大模型并发请求的信号量（可选）
+        issue_details: 已批量加载的issue详情，为空时单独获取
+        triage_model: 初筛模型，不为空时先用简短提示词初筛，只有低风险/高风险的issue才进行完整分析
+        payload_memo: 批次内共享的PR/commit负载记忆表（可选）
+        duplicate_index: 近似重复索引（可选），与已分析issue的相似度达到阈值时直接沿用其结论，
+                         否则在结果中关联最相似的issue，分析完成后加入索引
+        prefilter: 本地预筛（可选），按规则或历史结论模型可确定不涉及的issue不再调用大模型
+        analyze_options: 传给 analyze_issue 的其他参数，如 force_refresh、stream、cache
+
+    Returns:
+        tuple: (分析结果字典, 错误信息)，成功时错误信息为None
+    """
+    local_result, match = find_local_verdict(issue, duplicate_index, prefilter)
+    if local_result is not None:
+        return local_result, None
+
+    if issue_details is None:
+        with github_semaphore or nullcontext():
+            issue_details = get_issue_details(issue, github_token, payload_memo) # 获取issue的详细信息
+    usages = []
+    ensemble = None
+    with llm_semaphore or nullcontext():
+        if triage_model:
+            analysis_result, has_risk = analyze_issue(
+                api_key,
+                base_url,
+                issue.title,
+                issue.body or '',
+                issue_details,
+                model=triage_model,
+                force_refresh=analyze_options.get('force_refresh', False),
+                token_budget=analyze_options.get('token_budget'),
+                cache=analyze_options.get('cache'),
+                retry_policy=analyze_options.get('retry_policy'),
+                triage=True
+            )
+            stage, stage_model = 'triage', triage_model
+            if has_risk != -1:
+                usages.append(analysis_result.pop('usage'))
+        # 初筛判定存在风险或初筛失败时进行完整分析
+        if not triage_model or has_risk != 0:
+            analysis_result, has_risk = analyze_issue(
+                api_key,
+                base_url,
+                issue.title,
+                issue.body or '',
+                issue_details, # 传递issue的详细信息
+                model=model,
+                **analyze_options
+            )
+            stage, stage_model = 'full', model
+            if has_risk != -1:
+                usages.append(analysis_result.pop('usage'))
+                ensemble = analysis_result.pop('ensemble', None)
+    if has_risk == -1:
+        return None, analysis_result['error']
+
+    result = build_issue_result(issue, issue_details, analysis_result, has_risk, stage, stage_model, usages, match, ensemble)
+    if duplicate_index is not None:
+        duplicate_index.add_results([result])
+    return result, None
+
+def analyze_issues_concurrently(issues, api_key, base_url, github_token, model,
+                                github_workers=4, llm_workers=4, on_progress=None, on_result=None, payload_memo=None,
+                                **analyze_options):
+    """
+    使用有界线程池并发分析多个issue
+
+    issue详情按批通过 GraphQL 加载，多个issue引用的同一PR/commit在批次内只下载一次，
+    获取详情与调用大模型分别受各自信号量限制，
+    线程池大小为两者之和，使得一部分线程在等待大模型时另一部分线程可以继续拉取GitHub数据。
+
+    Args:
+        issues: 待分析的GitHub issue对象列表
+        github_workers: GitHub 最大并发请求数
+        llm_workers: 大模型最大并发请求数
+        on_progress: 每完成一个issue时在调用线程中回调 on_progress(已完成数, 总数, issue, 错误信息)
+        on_result: 每完成一个issue时在调用线程中回调 on_result(issue, 分析结果, 错误信息)，用于及时持久化结果
+        payload_memo: PR/commit负载记忆表，为空时创建仅在本批次内有效的记忆表
+        analyze_options: 传给 run_issue_analysis 的其他参数，如 triage_model、duplicate_index、prefilter、early_exit
+
+    Returns:
+        list: 与issues顺序一致的 (issue, 分析结果, 错误信息) 列表
+    """
+    if not issues:
+        return []
+
+    github_semaphore = threading.Semaphore(github_workers)
+    llm_semaphore = threading.Semaphore(llm_workers)
+    outcomes = [None] * len(issues)
+    payload_memo = payload_memo or PayloadMemo()
+
+    def load_details(chunk):
+        with github_semaphore:
+            repo_fullname = parse_repo_fullname(chunk[0].html_url)
+            if not repo_fullname:
+                return {}
+            return load_issue_details_bulk(repo_fullname, [issue.number for issue in chunk], github_token, payload_memo)
+
+    def analyze(idx):
+        issue = issues[idx]
+        # 批量加载失败的issue返回None，由 run_issue_analysis 单独获取
+        try:
+            details = detail_futures[idx // BULK_BATCH_SIZE].result().get(issue.number)
+        except Exception as e:
+            logger.warning(f"批量获取Issue #{issue.number}详情失败: {str(e)}")
+            details = None
+        return run_issue_analysis(issue, api_key, base_url, github_token, model,
+                                  github_semaphore, llm_semaphore, details, payload_memo=payload_memo, **analyze_options)
+
+    with ThreadPoolExecutor(max_workers=github_workers + llm_workers) as executor:
+        # 详情加载任务先于分析任务入队，分析任务等待时不会造成死锁
+        detail_futures = [
+            executor.submit(load_details, issues[start:start + BULK_BATCH_SIZE])
+            for start in range(0, len(issues), BULK_BATCH_SIZE)
+        ]
+        futures = {executor.submit(analyze, idx): idx for idx in range(len(issues))}
+        for done, future in enumerate(as_completed(futures), 1):
+            idx = futures[future]
+            issue = issues[idx]
+            try:
+                result, error = future.result()
+            except Exception as e:
+                logger.error(f"分析Issue #{issue.number}时发生错误: {str(e)}")
+                result, error = None, str(e)
+            outcomes[idx] = (issue, result, error)
+            if on_result:
+                on_result(issue, result, error)
+            if on_progress:
+                on_progress(done, len(issues), issue, error)
+
+    logger.info(f"PR/commit负载记忆表命中 {payload_memo.hits} 次，实际加载 {payload_memo.misses} 次")
+    return outcomes
+
+def fix_code_blocks_in_details(text):
+    """修复 <details> 标签中未闭合的代码块"""
+    if not text or '<details>' not in text:
+        return text
+
+    # 分割文本为 details 内外的部分
+    parts = []
+    current_pos = 0
+    
+    while True:
+        # 查找下一个 details 开始标签
+        start = text.find('<details>', current_pos)
+        if start == -1:
+            # 没有更多的 details 标签，添加剩余部分
+            if current_pos < len(text):
+                parts.append(text[current_pos:])
+            break
+            
+        # 添加 details 之前的内容
+        if start > current_pos:
+            parts.append(text[current_pos:start])
+            
+        # 查找对应的结束标签
+        end = text.find('</details>', start)
+        if end == -1:
+            # 如果没有找到结束标签，处理到文本末尾
+            end = len(text)
+            
+        # 获取 details 中的内容
+        details_content = text[start:end]
+        
+        # 检查是否有未闭合的代码块
+        code_marks = details_content.count('```')
+        if code_marks % 2 == 1:
+            # 在 details 结束前添加闭合标记
+            details_content = details_content + '\n```\n'
+            
+        parts.append(details_content)
+        current_pos = end
+        
+        # 如果已经到达文本末尾，退出循环
+        if end == len(text):
+            break
+            
+    return ''.join(parts)
+
+# 报告中风险分组的顺序和标题
+RISK_GROUPS = (
+    (2, "🚨 存在高风险的 Issues"),
+    (1, "⚠️ 存在低风险的 Issues"),
+    (0, "✅ 不涉及安全风险的 Issues"),
+)
+
+def iter_issue_section(item):
+    """逐段生成单个issue的 Markdown 内容"""
+    # 添加标题
+    yield f"## Issue #{item['issue_number']} {item['issue_title']}\n\n"
+
+    # 添加链接
+    yield f"- Issue 链接：[#{item['issue_number']}]({item['issue_url']})\n\n"
+
+    # 添加内容
+    yield "### Issue 内容\n\n"
+    if item['issue_body']:
+        issue_content = item['issue_body'].replace('### ', '#### ')
+        # 修复 details 中未闭合的代码块
+        issue_content = fix_code_blocks_in_details(issue_content)
+        yield f"{issue_content}\n\n"
+    else:
+        yield "无内容\n\n"
+
+    # 添加评论信息
+    if item.get('comments'):
+        yield "### 相关评论\n\n"
+        for i, comment in enumerate(item['comments'][:5], 1):  # 最多导出5条评论
+            yield f"#### 评论{i} - {comment['author']} ({comment['created_at']})\n\n"
+            if comment['body']:
+                comment_content = comment['body'].replace('### ', '##### ')
+                yield f"{comment_content}\n\n"
+            else:
+                yield "无内容\n\n"
+
+    # 添加相关commit信息
+    if item.get('commits'):
+        yield "### 相关Commit\n\n"
+        for commit in item['commits']:
+            yield f"#### Commit: {commit['sha'][:8]}\n\n"
+            yield f"- **作者：** {commit['author']}\n"
+            yield f"- **时间：** {commit['date']}\n"
+            yield f"- **消息：** {commit['message']}\n"
+            if commit['files_changed']:
+                yield f"- **修改文件：** {', '.join(commit['files_changed'])}\n"
+            if commit.get('patch'):
+                yield f"- **代码变更：**\n\n```diff\n{commit['patch']}\n```\n\n"
+            yield f"- **链接：** [{commit['sha'][:8]}]({commit['url']})\n\n"
+
+    # 添加分析结果
+    yield "### 分析结果\n\n"
+    analysis_data = item['analysis']
+
+    # 添加风险定级
+    yield f"**风险定级：**  \n{analysis_data['has_risk']}\n\n"
+
+    # 添加判定阶段
+    if item.get('stage'):
+        yield f"**判定阶段：**  \n{STAGE_LABELS[item['stage']]}（{item.get('stage_model', '')}）\n\n"
+
+    # 添加用量，命中缓存或本地判定的结果没有调用大模型
+    if item.get('usage', {}).get('calls'):
+        yield f"**用量：**  \n{format_usage(item['usage'])}\n\n"
+
+    # 添加多模型投票
+    if item.get('ensemble'):
+        yield f"**多模型结论：**  \n{format_ensemble_votes(item['ensemble'])}\n\n"
+
+    # 添加相似issue
+    similar = item.get('similar_issue')
+    if similar:
+        yield f"**相似Issue：**  \n[#{similar['issue_number']}]({similar['issue_url']})（相似度 {similar['similarity']}）\n\n"
+
+    # 添加判断依据
+    yield f"**判断依据：**  \n{analysis_data['analysis']}\n\n"
+
+    # 添加复现过程（如果有）
+    if analysis_data.get('poc'):
+        yield f"**复现过程：**\n\n```python\n{analysis_data['poc']}\n```\n\n\n"
+
+    if analysis_data.get('explain'):
+        yield f"**解释说明：**\n\n{analysis_data['explain']}\n\n"
+
+    # 添加分隔线
+    yield "---\n\n\n"
+
+def iter_markdown_report(results, model):
+    """
+    按风险分组顺序逐段生成 Markdown 报告
+
+    只记录各分组包含哪些结果，各issue的内容在输出时才生成，不会在内存中拼接完整报告
+
+    Args:
+        results: 分析结果的可迭代对象
+        model: 报告中记录的分析模型
+    """
+    yield f"# Issue 安全分析报告\n\n> 分析模型：{model}\n\n"
+
+    groups = {level: [] for level, _ in RISK_GROUPS}
+    for item in results:
+        groups[item['has_risk'] if item['has_risk'] in groups else 0].append(item)
+
+    yield from iter_usage_summary([item for level, _ in RISK_GROUPS for item in groups[level]])
+
+    for level, title in RISK_GROUPS:
+        if groups[level]:
+            yield f"# {title} ({len(groups[level])} 个)\n\n"
+            for item in groups[level]:
+                yield from iter_issue_section(item)
+
+def iter_usage_summary(results):
+    """生成报告开头的用量统计：按模型汇总，并列出耗费最多的issue"""
+    summary = summarize_usage(results)
+    total = summary['total']
+    if not total['calls']:
+        return
+    yield "## 用量统计\n\n"
+    yield "| 模型 | 调用次数 | 提示tokens | 缓存命中率 | 输出tokens | 推理tokens | 耗时(秒) | 重试次数 |\n"
+    yield "| --- | --- | --- | --- | --- | --- | --- | --- |\n"
+    for name, stats in sorted(total['models'].items()) + [('合计', total)]:
+        yield (f"| {name} | {stats['calls']} | {stats['prompt_tokens']} | {format_cache_hit_rate(stats)} | "
+               f"{stats['completion_tokens']} | {stats['reasoning_tokens']} | {stats['latency']:.1f} | {stats['retries']} |\n")
+    yield "\n"
+    yield "耗费最多的Issue：\n\n"
+    for number, title, usage in summary['top_issues']:
+        yield f"- #{number} {title}：{usage['total_tokens']} tokens，{usage['latency']:.1f} 秒\n"
+    yield "\n"
+
+def write_markdown_report(results, model, f):
+    """将 Markdown 报告逐段写入文本文件对象"""
+    for chunk in iter_markdown_report(results, model):
+        f.write(chunk)
@@ -0,0 +1,244 @@
+"""
+命令行批量分析 Issue
+
+不依赖 Streamlit，可在定时任务中运行，按仓库、标签和时间范围获取 Issue，并发分析后生成与界面导出一致的 Markdown 报告。
+API Key、GitHub Token 等参数默认读取 config.json，命令行参数优先。
+每完成一个 issue 即写入任务日志，中断后可通过 --job 指定任务ID继续，已完成的 issue 不会重复分析。
+
+示例：
+    python issue_cli.py -r kubernetes/kubernetes -l kind/bug --since 2025-01-01 --until 2025-01-31 -o 2025-01.md
+"""
+import argparse
+import json
+import logging
+import sys
+from datetime import datetime, date, timedelta
+
+from scan_state import load_scan_state, save_scan_state, merge_results, is_analysis_current, advance_checkpoint, format_time
+from prompt_budget import DEFAULT_TOKEN_BUDGET
+from issue_analyzer import (load_config, get_configured_cache, get_configured_retry_policy, create_payload_memo, create_duplicate_index, create_prefilter,
+                            get_issues, analyze_issues_concurrently, write_markdown_report, summarize_usage, format_usage)
+from job_store import create_job, load_job, record_result, record_error, record_batch, record_done
+from batch_analysis import run_batch_analysis, DEFAULT_POLL_INTERVAL
+from async_pipeline import analyze_issues_pipelined
+from result_store import append_results, compact_month
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+def parse_date(value):
+    """解析 YYYY-MM-DD 格式的日期"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式应为 YYYY-MM-DD: {value}")
+
+def parse_args(config):
+    # 默认分析上个自然月
+    last_month_end = date.today().replace(day=1) - timedelta(days=1)
+
+    parser = argparse.ArgumentParser(description='批量分析GitHub仓库Issue的安全风险并生成Markdown报告')
+    parser.add_argument('-r', '--repo', default=config.get('repo_name', 'kubernetes/kubernetes'),
+                        help='GitHub仓库名称，格式为 owner/repo，默认读取配置')
+    parser.add_argument('-l', '--labels', default=config.get('labels', 'kind/bug'), help='标签，用逗号分隔，默认读取配置')
+    parser.add_argument('--since', type=parse_date, default=last_month_end.replace(day=1),
+                        help='起始日期 YYYY-MM-DD，默认为上个月第一天')
+    parser.add_argument('--until', type=parse_date, default=last_month_end, help='结束日期 YYYY-MM-DD，默认为上个月最后一天')
+    parser.add_argument('-o', '--output', help='Markdown报告路径，默认为 issue_analysis_<仓库>_<起始>_<结束>.md')
+    parser.add_argument('--json', dest='json_output', help='同时将分析结果保存为JSON文件')
+    parser.add_argument('--base-url', default=config.get('openai_base_url'), help='OpenAI兼容接口地址，默认读取配置')
+    parser.add_argument('-m', '--model', default=config.get('model'), help='分析使用的模型，默认读取配置')
+    parser.add_argument('--ensemble-models', default=','.join(config.get('ensemble_models', [])),
+                        help='多模型集成时额外使用的模型，用逗号分隔，与 -m 指定的模型并发分析后投票，权重读取配置中的 ensemble_weights')
+    parser.add_argument('--triage-model', default=config.get('triage_model') if config.get('two_stage') else None,
+                        help='初筛模型，设置后先初筛，只有低风险/高风险的issue才进行完整分析')
+    parser.add_argument('--github-workers', type=int, default=config.get('github_workers', 4), help='GitHub并发数')
+    parser.add_argument('--llm-workers', type=int, default=config.get('llm_workers', 4), help='大模型并发数')
+    parser.add_argument('--token-budget', type=int, default=config.get('prompt_token_budget', DEFAULT_TOKEN_BUDGET),
+                        help='提示词token预算，0表示不限制')
+    parser.add_argument('--early-exit', action=argparse.BooleanOptionalAction, default=config.get('early_exit', False),
+                        help='风险评级为不涉及时提前结束生成，--no-early-exit 可关闭配置中开启的该选项')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量扫描：只分析检查点之后新创建或更新的issue，并与已有结果合并')
+    parser.add_argument('--max-retries', type=int, default=config.get('llm_max_retries'),
+                        help='大模型调用在429、5xx或连接失败时的最大重试次数，默认4')
+    parser.add_argument('--hedge', action=argparse.BooleanOptionalAction, default=config.get('llm_hedge', False),
+                        help='非流式调用超过该模型近期耗时的p95仍未返回时发出对冲请求，取先完成的结果')
+    parser.add_argument('--refresh', action='store_true', help='忽略本地分析缓存，重新调用大模型分析')
+    parser.add_argument('--dedupe', action=argparse.BooleanOptionalAction, default=config.get('duplicate_detection', False),
+                        help='与历史报告检索库和已有结果近似重复的issue直接沿用已有结论')
+    parser.add_argument('--prefilter', action=argparse.BooleanOptionalAction, default=config.get('prefilter', False),
+                        help='按标签、标题规则和历史结论模型直接判定明显不涉及的issue，不调用大模型')
+    parser.add_argument('--prefilter-threshold', type=float, default=config.get('prefilter_threshold'),
+                        help='预筛模型的目标精度，默认0.97')
+    parser.add_argument('--pipeline', action=argparse.BooleanOptionalAction, default=config.get('async_pipeline', False),
+                        help='使用异步流水线：获取详情与调用大模型重叠进行，开启提前结束或多模型集成时改用线程池')
+    parser.add_argument('--batch', action=argparse.BooleanOptionalAction, default=config.get('batch_mode', False),
+                        help='通过提供方的Batch API离线提交所有分析请求，轮询到完成后解析结果，价格更低但最长需等待24小时；'
+                             '不支持初筛和多模型集成')
+    parser.add_argument('--poll-interval', type=float, default=config.get('batch_poll_interval', DEFAULT_POLL_INTERVAL),
+                        help='Batch API模式下查询批处理状态的间隔秒数')
+    parser.add_argument('--job', help='恢复指定ID的任务，沿用任务的仓库、标签、时间范围、模型和Batch API模式，跳过已完成的issue')
+    return parser.parse_args()
+
+def main():
+    config = load_config()
+    args = parse_args(config)
+
+    api_key = config.get('openai_api_key')
+    base_url = args.base_url
+    github_token = config.get('github_token')
+    if not all([api_key, github_token, args.model, args.repo, args.labels]):
+        logger.error("config.json 中缺少 openai_api_key、github_token 或 model 配置")
+        return 1
+
+    job = None
+    if args.job:
+        job = load_job(args.job)
+        if job is None:
+            logger.error(f"任务 {args.job} 不存在")
+            return 1
+        params = job['params']
+        args.repo, args.labels, args.incremental = params['repo_name'], params['labels'], params['scan_mode'] == '增量'
+        args.since, args.until = date.fromisoformat(params['since']), date.fromisoformat(params['until'])
+        args.batch = args.batch or params.get('batch', False)
+        # 沿用任务创建时的模型，报告按同一模型标注，恢复的批处理也是用该模型提交的
+        if params.get('model') and params['model'] != args.model:
+            logger.info(f"恢复任务沿用任务创建时的模型 {params['model']}（当前为 {args.model}）")
+        args.model = params.get('model') or args.model
+        logger.info(f"恢复任务 {args.job}，已完成 {len(job['results'])} 个分析结果")
+
+    scan = None
+    existing = []
+    updated_since = None
+    if args.incremental:
+        scan = load_scan_state(args.repo, args.labels)
+        existing = list(scan['results'])
+        # 恢复任务时沿用任务创建时的检查点
+        updated_since = job['params'].get('updated_since') if job else scan['checkpoint']
+        logger.info(f"增量扫描：检查点 {updated_since}，已有 {len(existing)} 个分析结果")
+    if job:
+        existing = merge_results(existing, job['results'])
+
+    try:
+        issues = get_issues(args.repo, args.labels, args.since, args.until, github_token, updated_since=updated_since)
+        # 定时任务需要完整结果，一次性取回所有分页
+        issues = issues[:len(issues)]
+    except Exception as e:
+        logger.error(f"获取 Issues 失败: {str(e)}")
+        return 1
+
+    existing_by_number = {r['issue_number']: r for r in existing}
+    pending = [
+        issue for issue in issues
+        if not is_analysis_current(existing_by_number.get(issue.number), format_time(issue.updated_at))
+    ]
+    logger.info(f"共 {len(issues)} 个 Issue，待分析 {len(pending)} 个")
+
+    job_id = args.job or create_job({
+        'repo_name': args.repo,
+        'labels': args.labels,
+        'since': args.since.isoformat(),
+        'until': args.until.isoformat(),
+        'scan_mode': '增量' if args.incremental else '全量',
+        'updated_since': updated_since,
+        'model': args.model,
+        'batch': args.batch
+    })
+    logger.info(f"任务ID: {job_id}，中断后可使用 --job {job_id} 继续")
+
+    touched_months = set()
+
+    def on_result(issue, result, error):
+        if error is None:
+            record_result(job_id, result)
+            touched_months.update(append_results([result]))
+        else:
+            record_error(job_id, issue.number, error)
+
+    def on_progress(done, total, issue, error):
+        status = f'失败: {error}' if error else '完成'
+        logger.info(f"[{done}/{total}] Issue #{issue.number} 分析{status}")
+
+    duplicate_index = create_duplicate_index(config, existing) if args.dedupe else None
+    retry_config = dict(config, llm_hedge=args.hedge)
+    if args.max_retries is not None:
+        retry_config['llm_max_retries'] = args.max_retries
+    prefilter = None
+    if args.prefilter:
+        prefilter_config = dict(config, prefilter_threshold=args.prefilter_threshold) if args.prefilter_threshold else config
+        prefilter = create_prefilter(prefilter_config)
+    ensemble_models = [m.strip() for m in args.ensemble_models.split(',') if m.strip()]
+    # 流水线不支持流式输出和多模型集成，开启这两项时与界面一致改用线程池
+    use_pipeline = args.pipeline and not args.early_exit and not ensemble_models
+    if args.pipeline and not use_pipeline:
+        logger.info("异步流水线不支持提前结束和多模型集成，改用线程池分析")
+    if args.batch:
+        if args.triage_model or ensemble_models:
+            logger.warning("Batch API模式不支持初筛和多模型集成，将只使用 -m 指定的模型完整分析")
+        # 恢复任务时继续轮询已提交的批处理，不重复提交
+        outcomes = run_batch_analysis(
+            pending, api_key, base_url, github_token, args.model, github_workers=args.github_workers,
+            token_budget=args.token_budget, cache=get_configured_cache(config), payload_memo=create_payload_memo(config),
+            duplicate_index=duplicate_index, prefilter=prefilter, force_refresh=args.refresh,
+            batch_id=job.get('batch_id') if job else None, on_submitted=lambda batch_id: record_batch(job_id, batch_id),
+            on_result=on_result, poll_interval=args.poll_interval
+        )
+    elif use_pipeline:
+        outcomes = analyze_issues_pipelined(
+            pending, api_key, base_url, github_token, args.model,
+            github_workers=args.github_workers, llm_workers=args.llm_workers, on_progress=on_progress, on_result=on_result,
+            triage_model=args.triage_model, force_refresh=args.refresh, token_budget=args.token_budget,
+            payload_memo=create_payload_memo(config), cache=get_configured_cache(config),
+            retry_policy=get_configured_retry_policy(retry_config), duplicate_index=duplicate_index, prefilter=prefilter
+        )
+    else:
+        outcomes = analyze_issues_concurrently(
+            pending, api_key, base_url, github_token, args.model,
+            github_workers=args.github_workers, llm_workers=args.llm_workers, on_progress=on_progress, on_result=on_result,
+            triage_model=args.triage_model, force_refresh=args.refresh, stream=args.early_exit, early_exit=args.early_exit,
+            token_budget=args.token_budget, payload_memo=create_payload_memo(config), cache=get_configured_cache(config),
+            retry_policy=get_configured_retry_policy(retry_config),
+            duplicate_index=duplicate_index, prefilter=prefilter,
+            ensemble_models=ensemble_models,
+            ensemble_weights=config.get('ensemble_weights')
+        )
+    summary = summarize_usage([result for _, result, error in outcomes if error is None])
+    record_done(job_id, summary['total'])
+    logger.info(f"本次用量：{summary['total']['calls']} 次调用，{format_usage(summary['total'])}")
+    for name, stats in sorted(summary['total']['models'].items()):
+        logger.info(f"  {name}: {stats['calls']} 次调用，{format_usage(stats)}")
+    for number, title, usage in summary['top_issues']:
+        logger.info(f"  Issue #{number} {title}: {usage['total_tokens']} tokens，{usage['latency']:.1f} 秒")
+    if prefilter is not None:
+        skipped = sum(1 for _, result, error in outcomes if error is None and result.get('stage') == 'prefilter')
+        (logger.info if prefilter.classifier is not None else logger.warning)(f"预筛跳过 {skipped} 个 Issue，{prefilter.describe()}")
+    # 安装 pyarrow 时将本次写入的月份压缩为 Parquet
+    for repo_name, month in sorted(touched_months):
+        compact_month(repo_name, month)
+    results = [result for _, result, error in outcomes if error is None]
+    failures = len(outcomes) - len(results)
+    if job:
+        results = merge_results(job['results'], results)
+
+    if scan is not None:
+        scan['results'] = merge_results(scan['results'], results)
+        issue_updates = [(format_time(issue.updated_at), issue.number) for issue in issues]
+        scan['checkpoint'] = advance_checkpoint(scan['checkpoint'], issue_updates, scan['results'])
+        if not save_scan_state(scan):
+            logger.error("保存增量扫描状态失败")
+        results = scan['results']
+
+    output = args.output or f"issue_analysis_{args.repo.replace('/', '_')}_{args.since}_{args.until}.md"
+    with open(output, 'w', encoding='utf-8') as f:
+        write_markdown_report(results, args.model, f)
+    if args.json_output:
+        with open(args.json_output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+
+    logger.info(f"报告已保存到 {output}，成功 {len(outcomes) - failures} 个，失败 {failures} 个")
+    return 1 if failures and not results else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
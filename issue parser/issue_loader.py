@@ -0,0 +1,394 @@
+"""
+基于 GraphQL 的 Issue 详情批量加载
+
+一次 GraphQL 查询即可取回一批 issue 的评论、时间线中关联的 PR 及其修改文件列表，
+PR/commit 的 patch 通过 REST 的 diff 格式一次性获取，替代逐个 issue 的
+评论分页、PR 搜索、get_pull、get_files 和 get_commit 调用。
+返回结构与 get_issue_details 一致：{'comments': [...], 'commits': [...]}
+
+同一批次中多个 issue 引用同一个 PR/commit 时，通过 PayloadMemo 只下载一次。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from pathlib import Path
+
+from github_client import (get_github_client, get_github_cache_dir, prune_cache_dir,
+                           DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_AGE_DAYS)
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 10
+PR_PATCH_LIMIT = 20000
+COMMIT_PATCH_LIMIT = 10000
+MEMO_MAX_ENTRIES = 500
+
+PR_FRAGMENT = """
+fragment PrFields on PullRequest {
+  number
+  title
+  url
+  createdAt
+  headRefOid
+  author { login }
+  repository { nameWithOwner }
+  files(first: 100) { nodes { path } }
+}
+"""
+
+COMMENT_FIELDS = "pageInfo { hasNextPage endCursor } nodes { author { login } createdAt body }"
+
+def parse_repo_fullname(html_url):
+    """从 issue 链接解析 owner/repo"""
+    m = re.search(r'github\.com/([^/]+)/([^/]+)/(?:issues|pull)/\d+', html_url or '')
+    return f"{m.group(1)}/{m.group(2)}" if m else None
+
+def format_github_time(value):
+    """将 GraphQL 返回的 ISO 时间转换为与 REST 路径一致的格式"""
+    if not value:
+        return ''
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y-%m-%d %H:%M:%S')
+
+def split_diff(diff_text):
+    """
+    将 unified diff 按文件拆分
+
+    Returns:
+        list: (文件名, patch) 列表，patch 与 REST 文件接口的 patch 字段一致（从第一个 @@ 开始）
+    """
+    files = []
+    for section in re.split(r'^diff --git ', diff_text or '', flags=re.MULTILINE)[1:]:
+        header, _, body = section.partition('\n')
+        m = re.match(r'a/(.*?) b/(.*)$', header)
+        filename = m.group(2) if m else header
+        hunk_start = body.find('@@')
+        patch = body[hunk_start:].rstrip('\n') if hunk_start != -1 else ''
+        files.append((filename, patch))
+    return files
+
+def join_patches(files, limit):
+    """按原有格式拼接各文件的 patch 并截断"""
+    patch_content = "\n\n".join(f"--- {name} ---\n{patch}" for name, patch in files if patch)
+    if patch_content and len(patch_content) > limit:
+        patch_content = patch_content[:limit] + "\n... (patch内容已截断)"
+    return patch_content
+
+def get_payload_dir():
+    """PR/commit 负载的持久化目录"""
+    return get_github_cache_dir() / 'payloads'
+
+class PayloadMemo:
+    """
+    PR/commit 负载的记忆表
+
+    按 "仓库+编号/sha" 记忆已构建的负载，条目数超过上限时按 LRU 淘汰；
+    多个线程同时请求同一 key 时只有第一个线程实际加载，其余线程等待其结果。
+
+    Args:
+        max_entries: 内存中最多保留的条目数
+        persist_dir: 持久化目录（可选），设置后 persist=True 的条目同时写入磁盘，跨运行复用
+        persist_max_entries: 磁盘上最多保留的条目数
+        persist_max_age_days: 磁盘条目最久未使用的天数，超过后淘汰
+    """
+
+    def __init__(self, max_entries=MEMO_MAX_ENTRIES, persist_dir=None,
+                 persist_max_entries=DEFAULT_CACHE_MAX_ENTRIES, persist_max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS):
+        self.max_entries = max_entries
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self.persist_max_entries = persist_max_entries
+        self.persist_max_age_days = persist_max_age_days
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        if self.persist_dir:
+            try:
+                prune_cache_dir(self.persist_dir, persist_max_entries, persist_max_age_days)
+            except Exception as e:
+                logger.warning(f"淘汰负载缓存失败: {str(e)}")
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.persist_dir / digest[:2] / f'{digest}.json'
+
+    def _load_persisted(self, key):
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            # 刷新修改时间，作为淘汰依据的最近使用时间
+            os.utime(path)
+            return value
+        except Exception as e:
+            logger.debug(f"读取负载缓存失败 {key}: {str(e)}")
+            return None
+
+    def _persist(self, key, value):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            tmp_path.replace(path)
+        except Exception as e:
+            logger.debug(f"写入负载缓存失败 {key}: {str(e)}")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, persist=False):
+        """
+        获取 key 对应的负载，不存在时调用 loader() 加载
+
+        loader 返回 None 表示加载失败，不会被记忆，下次请求时重新加载。
+        persist 只应用于内容不可变的负载，如按 sha 定位的 commit。
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = self._load_persisted(key) if persist and self.persist_dir else None
+            if value is None:
+                value = loader()
+                if value is not None and persist and self.persist_dir:
+                    self._persist(key, value)
+            if value is not None:
+                self._remember(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+class IssueDetailLoader:
+    """
+    批量加载 issue 详情
+
+    Args:
+        client: GitHubClient
+        memo: PR/commit 负载记忆表（可选），在多次 load 之间共享时可跨批次去重
+    """
+
+    def __init__(self, client, memo=None):
+        self.client = client
+        self.memo = memo or PayloadMemo()
+
+    def graphql(self, query, variables=None):
+        return self.client.graphql(query, variables)
+
+    def get_diff(self, path):
+        # 经由共享客户端的条件请求缓存，未变化的patch返回304不计入配额
+        return self.client.get(path, accept='application/vnd.github.v3.diff')
+
+    def load(self, repo_fullname, issue_numbers):
+        """
+        批量加载同一仓库中多个 issue 的详情
+
+        Args:
+            repo_fullname: 仓库名，格式为 owner/repo
+            issue_numbers: issue 编号列表
+
+        Returns:
+            dict: issue编号 -> {'comments': [...], 'commits': [...]}，加载失败的issue不在结果中
+        """
+        owner, name = repo_fullname.split('/', 1)
+        details = {}
+        for start in range(0, len(issue_numbers), BULK_BATCH_SIZE):
+            chunk = issue_numbers[start:start + BULK_BATCH_SIZE]
+            try:
+                details.update(self._load_chunk(owner, name, chunk))
+            except Exception as e:
+                logger.warning(f"批量获取Issue详情失败 {chunk}: {str(e)}")
+        return details
+
+    def _load_chunk(self, owner, name, numbers):
+        repo_fullname = f"{owner}/{name}"
+        fields = "\n".join(f"""
+            i{number}: issue(number: {number}) {{
+              number
+              body
+              comments(first: 100) {{ {COMMENT_FIELDS} }}
+              timelineItems(first: 100, itemTypes: [CROSS_REFERENCED_EVENT, CONNECTED_EVENT, CLOSED_EVENT]) {{
+                nodes {{
+                  ... on CrossReferencedEvent {{ source {{ ... on PullRequest {{ ...PrFields }} }} }}
+                  ... on ConnectedEvent {{ subject {{ ... on PullRequest {{ ...PrFields }} }} }}
+                  ... on ClosedEvent {{ closer {{ ... on PullRequest {{ ...PrFields }} }} }}
+                }}
+              }}
+            }}""" for number in numbers)
+        query = f"query($owner: String!, $name: String!) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}\n{PR_FRAGMENT}"
+        repository = self.graphql(query, {'owner': owner, 'name': name})['repository'] or {}
+
+        issues = {}
+        prs = {}
+        for number in numbers:
+            node = repository.get(f'i{number}')
+            if not node:
+                continue
+            comments = node['comments']['nodes']
+            if node['comments']['pageInfo']['hasNextPage']:
+                comments += self._load_more_comments(owner, name, number, node['comments']['pageInfo']['endCursor'])
+
+            pr_numbers = []
+            for event in node['timelineItems']['nodes']:
+                pr = (event or {}).get('source') or (event or {}).get('subject') or (event or {}).get('closer')
+                # 只关注本仓库的PR，其他仓库的引用多为下游跟踪
+                if pr and pr.get('number') and pr['repository']['nameWithOwner'].lower() == repo_fullname.lower():
+                    prs[pr['number']] = pr
+                    pr_numbers.append(pr['number'])
+
+            all_text = (node.get('body') or '') + '\n' + '\n'.join(c.get('body') or '' for c in comments)
+            text_prs = re.findall(rf'github\.com/{re.escape(owner)}/{re.escape(name)}/pull/(\d+)', all_text, re.IGNORECASE)
+            pr_numbers += [int(n) for n in text_prs]
+            # 仅处理完整40位sha，避免误命中短SHA
+            commit_refs = [
+                (f"{o}/{n}", sha) for o, n, sha in
+                re.findall(r'github\.com/([^/\s]+)/([^/\s]+)/commit/([a-f0-9]{40})\b', all_text.lower())
+            ]
+            issues[number] = {
+                'comments': [{
+                    'author': (c.get('author') or {}).get('login', 'ghost'),
+                    'created_at': format_github_time(c.get('createdAt')),
+                    'body': c.get('body') or ''
+                } for c in comments],
+                'pr_numbers': list(dict.fromkeys(pr_numbers)),
+                'commit_refs': list(dict.fromkeys(commit_refs))
+            }
+
+        # 正文和评论中引用、但未出现在时间线中的PR
+        missing = sorted({n for i in issues.values() for n in i['pr_numbers']} - set(prs))
+        if missing:
+            prs.update(self._load_pulls(owner, name, missing))
+
+        result = {}
+        for number, info in issues.items():
+            commits = []
+            for pr_number in info['pr_numbers']:
+                pr = prs.get(pr_number)
+                if pr:
+                    # PR的diff随head变化，key中带上head sha，head不变时可持久化复用
+                    key = f"pr:{repo_fullname.lower()}#{pr_number}@{pr.get('headRefOid') or ''}"
+                    entry = self.memo.get_or_load(key, lambda pr=pr: self._load_pr_entry(repo_fullname, pr),
+                                                  persist=bool(pr.get('headRefOid')))
+                    commits.append(entry or self._build_pr_entry(pr))
+            for full_repo, sha in info['commit_refs']:
+                entry = self.memo.get_or_load(f"commit:{full_repo}@{sha}",
+                                              lambda full_repo=full_repo, sha=sha: self._build_commit_entry(full_repo, sha),
+                                              persist=True)
+                if entry:
+                    commits.append(entry)
+            result[number] = {'comments': info['comments'], 'commits': commits}
+        return result
+
+    def _load_more_comments(self, owner, name, number, cursor):
+        comments = []
+        while cursor:
+            query = f"""
+            query($owner: String!, $name: String!, $number: Int!, $cursor: String) {{
+              repository(owner: $owner, name: $name) {{
+                issue(number: $number) {{ comments(first: 100, after: $cursor) {{ {COMMENT_FIELDS} }} }}
+              }}
+            }}"""
+            data = self.graphql(query, {'owner': owner, 'name': name, 'number': number, 'cursor': cursor})
+            page = data['repository']['issue']['comments']
+            comments += page['nodes']
+            cursor = page['pageInfo']['endCursor'] if page['pageInfo']['hasNextPage'] else None
+        return comments
+
+    def _load_pulls(self, owner, name, numbers):
+        prs = {}
+        for start in range(0, len(numbers), BULK_BATCH_SIZE):
+            chunk = numbers[start:start + BULK_BATCH_SIZE]
+            fields = "\n".join(f"p{n}: pullRequest(number: {n}) {{ ...PrFields }}" for n in chunk)
+            query = f"query($owner: String!, $name: String!) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}\n{PR_FRAGMENT}"
+            try:
+                repository = self.graphql(query, {'owner': owner, 'name': name})['repository'] or {}
+            except Exception as e:
+                logger.debug(f"获取PR {chunk} 失败: {str(e)}")
+                continue
+            for n in chunk:
+                if repository.get(f'p{n}'):
+                    prs[n] = repository[f'p{n}']
+        return prs
+
+    def _load_pr_entry(self, repo_fullname, pr):
+        """下载PR的patch并构建负载，下载失败时返回None"""
+        try:
+            files = split_diff(self.get_diff(f"/repos/{repo_fullname}/pulls/{pr['number']}"))
+        except Exception as e:
+            logger.debug(f"获取PR #{pr['number']} patch失败: {str(e)}")
+            return None
+        return self._build_pr_entry(pr, join_patches(files, PR_PATCH_LIMIT))
+
+    def _build_pr_entry(self, pr, patch_content=''):
+        return {
+            'sha': pr.get('headRefOid') or f"PR#{pr['number']}",
+            'message': pr.get('title') or '',
+            'author': (pr.get('author') or {}).get('login', ''),
+            'date': format_github_time(pr.get('createdAt')),
+            'url': pr['url'],
+            'files_changed': [f['path'] for f in (pr.get('files') or {}).get('nodes', [])],
+            'patch': patch_content or ''
+        }
+
+    def _build_commit_entry(self, full_repo, sha):
+        owner, name = full_repo.split('/', 1)
+        query = """
+        query($owner: String!, $name: String!, $oid: GitObjectID!) {
+          repository(owner: $owner, name: $name) {
+            object(oid: $oid) { ... on Commit { oid message url author { name date } } }
+          }
+        }"""
+        try:
+            data = self.graphql(query, {'owner': owner, 'name': name, 'oid': sha})
+            commit = (data.get('repository') or {}).get('object')
+            if not commit:
+                return None
+            files = split_diff(self.get_diff(f"/repos/{full_repo}/commits/{sha}"))
+        except Exception as e:
+            logger.debug(f"获取commit {full_repo}@{sha} 失败: {str(e)}")
+            return None
+        author = commit.get('author') or {}
+        date = author.get('date')
+        return {
+            'sha': commit['oid'],
+            'message': commit.get('message') or '',
+            'author': author.get('name') or '',
+            'date': datetime.fromisoformat(date).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S') if date else '',
+            'url': commit['url'],
+            'files_changed': [name for name, _ in files],
+            'patch': join_patches(files, COMMIT_PATCH_LIMIT) or ''
+        }
+
+def load_issue_details_bulk(repo_fullname, issue_numbers, github_token, memo=None):
+    """批量加载 issue 详情的便捷函数，memo 在同一批次的多次调用间共享时可避免重复下载PR/commit"""
+    return IssueDetailLoader(get_github_client(github_token), memo).load(repo_fullname, list(issue_numbers))
@@ -1,10 +1,22 @@
-from github import Github
-from openai import OpenAI
-from datetime import datetime
+from datetime import datetime, date
 import streamlit as st
-import json, sys, math
+import sys, math, time, os
 import logging
-from pathlib import Path
+import tempfile
+import html
+from scan_state import (load_scan_state, save_scan_state, merge_results, is_analysis_current,
+                        advance_checkpoint, format_time)
+from prompt_budget import DEFAULT_TOKEN_BUDGET
+from prefilter import DEFAULT_THRESHOLD as DEFAULT_PREFILTER_THRESHOLD
+from llm_client import get_openai_client, DEFAULT_MAX_RETRIES
+from async_pipeline import analyze_issues_pipelined
+from issue_analyzer import (load_config, save_config, get_configured_cache, get_configured_retry_policy, create_payload_memo, create_duplicate_index,
+                            create_prefilter, get_issues, run_issue_analysis, analyze_issues_concurrently,
+                            fix_code_blocks_in_details, write_markdown_report, format_ensemble_votes, summarize_usage,
+                            format_usage, STAGE_LABELS)
+from job_store import (create_job, load_job, list_jobs, record_result, start_background_job, get_job_progress,
+                       add_job_notice)
+from result_store import append_results
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,46 +30,27 @@ st.set_page_config(
 
 st.title("GitHub Issue 安全分析工具 🛡️")
 
-# 添加配置管理相关函数
-def get_config_path():
-    """获取配置文件路径 - 直接保存在当前目录"""
-    return Path(__file__).parent / 'config.json'
-
-def load_config():
-    """加载配置"""
-    config_path = get_config_path()
-    if config_path.exists():
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"加载配置文件失败: {str(e)}")
-    return {}
-
-def save_config(config):
-    """保存配置"""
-    config_path = get_config_path()
-    try:
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
-        return True
-    except Exception as e:
-        logger.error(f"保存配置文件失败: {str(e)}")
-        return False
-
 # 初始化会话状态
 def init_session_state():
     """初始化会话状态"""
     if 'current_page' not in st.session_state:
         st.session_state.current_page = 1
     if 'analysis_results' not in st.session_state:
-        st.session_state.analysis_results = []
+        # issue编号 -> 分析结果，字典保持插入顺序，导出时按分析顺序输出
+        st.session_state.analysis_results = {}
+    if 'results_version' not in st.session_state:
+        # 分析结果每次变化时递增，用于判断导出的报告是否需要重新生成
+        st.session_state.results_version = 0
     if 'total_issues' not in st.session_state:
         st.session_state.total_issues = 0
     if 'issues' not in st.session_state:
         st.session_state.issues = []
     if 'analysis_complete' not in st.session_state:
         st.session_state.analysis_complete = False
+    if 'scan_state' not in st.session_state:
+        st.session_state.scan_state = None
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
     if "model_options" not in st.session_state:
         st.session_state.model_options = {'o1-mini': 'o1-mini', 'o3-mini': 'o3-mini', 'deepseek-r1': 'deepseek-r1'}
 
@@ -80,13 +73,41 @@ with st.sidebar:
     labels = st.text_input("标签（用逗号分隔）", saved_config.get('labels', "kind/bug"))
     since_time = st.date_input("起始时间", datetime(2025, 1, 1))
     until_time = st.date_input("结束时间", datetime.now())
+    # 增量模式只获取上次扫描检查点之后创建或更新的 issue
+    scan_mode = st.radio("扫描模式", ["全量", "增量"], horizontal=True,
+                         help="增量模式记录每个仓库+标签组合的扫描检查点，只分析检查点之后创建或更新的Issue，并与已有结果合并")
     openai_api_key = st.text_input("OpenAI API Key", value=saved_config.get('openai_api_key', ''), type="password")
     openai_base_url = st.text_input("OpenAI Base URL（可选）", value=saved_config.get('openai_base_url', "https://api.wlai.vip/v1"))
     github_token = st.text_input("GitHub Token", value=saved_config.get('github_token', ''), type="password")
+
+    # 批量分析的并发数，GitHub 与大模型分别限流
+    github_workers = st.number_input("GitHub并发数", min_value=1, max_value=16, value=saved_config.get('github_workers', 4))
+    llm_workers = st.number_input("大模型并发数", min_value=1, max_value=16, value=saved_config.get('llm_workers', 4))
+    # 网关限流或出错时的重试次数，以及超过近期耗时p95仍未返回时的对冲请求
+    llm_max_retries = st.number_input("大模型重试次数", min_value=0, max_value=10,
+                                      value=saved_config.get('llm_max_retries', DEFAULT_MAX_RETRIES),
+                                      help="429、5xx或连接失败时按指数退避重试，网关返回Retry-After时按其等待")
+    async_pipeline = st.toggle("异步流水线", value=saved_config.get('async_pipeline', False),
+                               help="批量分析时获取详情、构建提示词、调用大模型和解析结果分阶段异步执行，"
+                                    "GitHub请求与大模型调用重叠进行；开启提前结束或集成模型时不生效")
+    llm_hedge = st.toggle("对冲请求", value=saved_config.get('llm_hedge', False),
+                          help="非流式调用超过该模型近期耗时的p95仍未返回时再发出一个相同请求，取先完成的结果，会增加少量调用")
+
+    # 提示词中issue内容、评论和patch的token预算，0表示不限制
+    token_budget = st.number_input("提示词token预算", min_value=0, max_value=200000, step=1000,
+                                   value=saved_config.get('prompt_token_budget', DEFAULT_TOKEN_BUDGET),
+                                   help="按预算过滤机器人评论、截断超长内容，并按相关性保留patch中的hunk；0表示不限制")
+
+    # 开启后忽略本地分析缓存，重新调用大模型
+    force_refresh = st.toggle("强制刷新（忽略缓存）", value=False)
+    # 单个分析时逐段显示模型输出；批量分析时可在判定为不涉及后提前结束生成
+    stream_output = st.toggle("流式输出", value=saved_config.get('stream_output', True))
+    early_exit = st.toggle("批量分析不涉及时提前结束", value=saved_config.get('early_exit', False),
+                           help="批量分析时使用流式输出，风险评级为不涉及后立即停止生成，不再生成复现脚本")
     
     # 添加 "获取模型列表" 按钮
     if st.button("获取模型列表"):
-        client = OpenAI(api_key=openai_api_key, base_url=openai_base_url)
+        client = get_openai_client(openai_api_key, openai_base_url)
         try:
             models = client.models.list()
             st.session_state.model_options = {m.id: m.id for m in models.data}
@@ -112,6 +133,42 @@ with st.sidebar:
     
     st.session_state.model = st.session_state.selected_model
 
+    # 多模型集成：其他模型与当前模型并发分析同一提示词，按 config.json 中的 ensemble_weights 加权投票
+    ensemble_models = st.multiselect(
+        "集成模型（可选）",
+        options=[m for m in st.session_state.model_options if m != st.session_state.model],
+        format_func=lambda x: st.session_state.model_options[x],
+        default=[m for m in saved_config.get('ensemble_models', [])
+                 if m in st.session_state.model_options and m != st.session_state.model],
+        help="选择后与当前模型并发分析同一Issue，投票得出风险等级并标记模型间的分歧，耗时取决于最慢的模型"
+    )
+
+    # 两阶段分析：先用简短提示词初筛，只有存在风险的issue才进行含复现脚本的完整分析
+    two_stage = st.toggle("两阶段分析", value=saved_config.get('two_stage', False),
+                          help="先用只判断风险等级的简短提示词初筛，只有低风险/高风险的Issue才进行完整分析")
+    triage_model = None
+    if two_stage:
+        model_keys = list(st.session_state.model_options.keys())
+        saved_triage_model = saved_config.get('triage_model', st.session_state.model)
+        triage_model = st.selectbox(
+            "初筛模型",
+            options=model_keys,
+            format_func=lambda x: st.session_state.model_options[x],
+            index=model_keys.index(saved_triage_model) if saved_triage_model in model_keys else model_keys.index(st.session_state.model)
+        )
+
+    # 批量分析时与历史报告和已有结果中近似重复的issue直接沿用已有结论
+    duplicate_detection = st.toggle("近似重复沿用结论", value=saved_config.get('duplicate_detection', False),
+                                    help="批量分析时，与已分析Issue（历史报告检索库和当前结果）内容近似重复的Issue直接沿用其结论，不再调用大模型")
+    # 批量分析时按标签、标题规则和历史结论模型直接判定明显不涉及的issue
+    prefilter_enabled = st.toggle("本地预筛", value=saved_config.get('prefilter', False),
+                                  help="批量分析时，flake、失败测试、文档等明显不涉及安全的Issue不调用大模型，直接判定为不涉及")
+    prefilter_threshold = saved_config.get('prefilter_threshold', DEFAULT_PREFILTER_THRESHOLD)
+    retry_config = dict(saved_config, llm_max_retries=int(llm_max_retries), llm_hedge=llm_hedge)
+    if prefilter_enabled:
+        prefilter_threshold = st.slider("预筛目标精度", min_value=0.8, max_value=1.0, step=0.01, value=prefilter_threshold,
+                                        help="历史结论模型判定为不涉及的Issue中确实不涉及的比例，越高越保守，交叉验证达不到时只使用规则")
+
     # 添加保存配置按钮
     if st.button("保存配置"):
         # 先读取现有配置
@@ -130,6 +187,21 @@ with st.sidebar:
             current_config['github_token'] = github_token
         if st.session_state.selected_model:
             current_config['model'] = st.session_state.selected_model
+        current_config['github_workers'] = int(github_workers)
+        current_config['llm_workers'] = int(llm_workers)
+        current_config['llm_max_retries'] = int(llm_max_retries)
+        current_config['llm_hedge'] = llm_hedge
+        current_config['async_pipeline'] = async_pipeline
+        current_config['stream_output'] = stream_output
+        current_config['prompt_token_budget'] = int(token_budget)
+        current_config['two_stage'] = two_stage
+        if triage_model:
+            current_config['triage_model'] = triage_model
+        current_config['early_exit'] = early_exit
+        current_config['duplicate_detection'] = duplicate_detection
+        current_config['ensemble_models'] = ensemble_models
+        current_config['prefilter'] = prefilter_enabled
+        current_config['prefilter_threshold'] = prefilter_threshold
             
         # 保存更新后的配置
         if save_config(current_config):
@@ -139,302 +211,14 @@ with st.sidebar:
     
     execute_button = st.button("获取issue")
 
-def get_issue_details(issue, github_token):
-    """
-    获取issue的详细信息，包括评论和相关的commit
-    
-    Args:
-        issue: GitHub issue对象
-        github_token: GitHub token
-    
-    Returns:
-        dict: 包含issue详细信息的字典
-    """
-    try:
-        g = Github(github_token)
-        
-        # 获取评论
-        comments = []
-        try:
-            issue_comments = issue.get_comments()
-            for comment in issue_comments:
-                comments.append({
-                    'author': comment.user.login,
-                    'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'body': comment.body
-                })
-        except Exception as e:
-            logger.warning(f"获取Issue #{issue.number}的评论失败: {str(e)}")
-        
-        # 获取相关的commit/PR
-        commits = []
-        try:
-            # 解析仓库 fullname，兼容不同来源的 Issue 对象
-            try:
-                repo_fullname = issue.repository.full_name  # type: ignore[attr-defined]
-            except Exception:
-                # 从 html_url 兜底解析 owner/repo
-                import re as _re
-                m = _re.search(r'github\.com/([^/]+)/([^/]+)/issues/\\d+', issue.html_url)
-                repo_fullname = f"{m.group(1)}/{m.group(2)}" if m else None
-            if not repo_fullname:
-                raise RuntimeError("无法解析仓库名")
-
-            repo = g.get_repo(repo_fullname)
-
-            # 汇总文本用于正则提取 PR/commit URL
-            import re
-            all_text = (issue.body or '') + '\n'
-            for comment in comments:
-                all_text += (comment.get('body') or '') + '\n'
-
-            # 1) 从文本中提取 PR URL 中的编号
-            pr_nums_from_text = set(re.findall(r'github\\.com/[^/]+/[^/]+/pull/(\\d+)', all_text))
-
-            # 2) 搜索引用当前 Issue 的 PR（如 Fixes #<num>/Closes #<num>/Resolves #<num> 等）
-            pr_nums_from_search = set()
-            try:
-                search_queries = [
-                    f"repo:{repo_fullname} is:pr in:body {issue.number}",
-                    f"repo:{repo_fullname} is:pr in:title {issue.number}",
-                ]
-                for q in search_queries:
-                    for pr_issue in g.search_issues(q):
-                        if pr_issue.pull_request is not None:  # 确认是PR
-                            pr_nums_from_search.add(str(pr_issue.number))
-            except Exception as e:
-                logger.debug(f"搜索关联PR失败: {str(e)}")
-
-            related_pr_numbers = list({*pr_nums_from_text, *pr_nums_from_search})
-
-            # 3) 从文本中提取 commit URL
-            #    捕获 owner、repo、sha，其中仅处理 40位完整 sha
-            commit_urls = re.findall(r'github\\.com/([^/]+)/([^/]+)/commit/([a-f0-9]{7,40})', all_text.lower())
-            related_commits = []
-            for owner, name, sha in commit_urls:
-                if len(sha) != 40:
-                    continue  # 跳过短SHA，避免误命中如 cb33accc
-                related_commits.append((f"{owner}/{name}", sha))
-
-            # 先处理关联 PR：直接从 PR 收集 patch（比散落commit链接更可靠）
-            for pr_num_str in related_pr_numbers:
-                try:
-                    pr_num = int(pr_num_str)
-                    pr = repo.get_pull(pr_num)
-
-                    # 聚合 PR 的文件级 patch
-                    file_patches = []
-                    files = list(pr.get_files())
-                    for f in files:
-                        if hasattr(f, 'patch') and f.patch:
-                            file_patches.append(f"--- {f.filename} ---\n{f.patch}")
-                    patch_content = "\n\n".join(file_patches)
-                    if patch_content and len(patch_content) > 20000:
-                        patch_content = patch_content[:20000] + "\n... (patch内容已截断)"
-
-                    commits.append({
-                        'sha': (pr.head.sha if pr.head and pr.head.sha else f"PR#{pr.number}"),
-                        'message': pr.title or '',
-                        'author': (pr.user.login if pr.user else ''),
-                        'date': pr.created_at.strftime('%Y-%m-%d %H:%M:%S') if pr.created_at else '',
-                        'url': pr.html_url,
-                        'files_changed': [f.filename for f in files],
-                        'patch': patch_content or ''
-                    })
-                except Exception as e:
-                    logger.debug(f"获取PR #{pr_num_str}详情失败: {str(e)}")
-
-            # 再处理明确的 commit URL（仅完整40位sha）
-            for full_repo, sha in related_commits:
-                try:
-                    repo_obj = repo if full_repo.lower() == repo_fullname.lower() else g.get_repo(full_repo)
-                    commit = repo_obj.get_commit(sha)
-
-                    patches = []
-                    for file in commit.files:
-                        if hasattr(file, 'patch') and file.patch:
-                            patches.append(f"--- {file.filename} ---\n{file.patch}")
-                    patch_content = "\n\n".join(patches)
-                    if patch_content and len(patch_content) > 10000:
-                        patch_content = patch_content[:10000] + "\n... (patch内容已截断)"
-
-                    commits.append({
-                        'sha': commit.sha,
-                        'message': commit.commit.message,
-                        'author': commit.commit.author.name if commit.commit and commit.commit.author else '',
-                        'date': commit.commit.author.date.strftime('%Y-%m-%d %H:%M:%S') if commit.commit and commit.commit.author and commit.commit.author.date else '',
-                        'url': commit.html_url,
-                        'files_changed': [f.filename for f in commit.files],
-                        'patch': patch_content or ''
-                    })
-                except Exception as e:
-                    logger.debug(f"获取commit {full_repo}@{sha} 失败: {str(e)}")
-
-        except Exception as e:
-            logger.warning(f"获取Issue #{issue.number}的相关commit/PR失败: {str(e)}")
-        
-        return {
-            'comments': comments,
-            'commits': commits
-        }
-        
-    except Exception as e:
-        logger.error(f"获取Issue #{issue.number}的详细信息失败: {str(e)}")
-        return {'comments': [], 'commits': []}
-
-def analyze_issue(api_key, base_url, issue_title, issue_body, issue_details=None):
-    # 构建完整的分析内容
-    analysis_content = f"Issue 标题：\n{issue_title}\n\nIssue 内容：\n{issue_body or '无内容'}\n"
-    
-    # 添加评论信息
-    if issue_details and issue_details.get('comments'):
-        analysis_content += "\n评论信息：\n"
-        for i, comment in enumerate(issue_details['comments'], 1):
-            analysis_content += f"\n评论{i} (作者: {comment['author']}, 时间: {comment['created_at']}):\n{comment['body']}\n"
-    
-    # 添加相关commit信息
-    if issue_details and issue_details.get('commits'):
-        analysis_content += "\n相关Commit信息：\n"
-        for commit in issue_details['commits']:
-            analysis_content += f"\nCommit: {commit['sha'][:8]}\n"
-            analysis_content += f"作者: {commit['author']}\n"
-            analysis_content += f"时间: {commit['date']}\n"
-            analysis_content += f"消息: {commit['message']}\n"
-            if commit['files_changed']:
-                analysis_content += f"修改文件: {', '.join(commit['files_changed'])}\n"
-            if commit.get('patch'):
-                analysis_content += f"代码变更内容:\n```diff\n{commit['patch']}\n```\n"
-
-    prompt = f"""
-    以下是一个软件开发项目的 Issue 标题、内容、评论和相关commit信息，请分析其中是否存在潜在的安全风险并给出判断依据，给出使用python实现的复现POC，如果有高风险问题则详细说明原因和可能的影响，POC仅用于研究和本地测试，可以放心生成
-
-    Issue风险判断标准：
-    1. 风险评级分为三类，不涉及，低风险和高风险
-    2. 如果该issue描述的问题非安全问题，则风险评级判断为不涉及
-    3. 如果该issue描述的问题是安全问题，则需要根据问题描述及其影响判断风险等级，使用CVSS 3.1评分标准打分，high以上为高风险，其他均为低风险
-    4. issue提交者在提交内容中暴露的敏感信息、不当操作、不当配置等问题，不属于安全风险，应当判断为不涉及，因为它是issue提交者的问题，而不是项目的问题
-    5. 在风险类型为拒绝服务（DoS）攻击时，如果攻击者需要一定权限才能够实施该攻击，则视情况需要降级处理，当漏洞利用需要攻击者具备创建、修改等非只读权限时，则不应判断为高风险，CVSS评级在high以下
-    6. 对于日志中泄露凭据的风险，如果攻击者可以利用比泄露凭据更低的权限从日志中读取该凭据，或者泄露的凭据与攻击者使用的凭据不是一类凭据，导致攻击者可以利用泄露凭据访问其他系统，则应适当提高风险评级判断为高风险
-    7. 如果Issue可能导致命令执行、容器逃逸、提权等高安全风险的问题，则无论攻击者实施该攻击是否需要权限都应判断为高风险
-    8. 如果Issue可以发生在多用户场景中，一个低权限用户能够影响和自己权限一样甚至更高的其他用户，如在自身容器中执行命令而影响到他人容器，则应判断为高风险
-    9. 如果issue中提供的内容不够充分，则根据issue可能导致的后果判断风险评级
-    10. 针对高风险问题，必须给出使用python编写的复现脚本，该脚本的作用是在真实环境中复现该问题
-    11. 对于细节缺失的高风险问题，要根据问题描述进行合理推演，给出python复现脚本
-    12. 在分析时，需要特别关注评论中提供的技术细节、讨论内容和相关commit中的代码变更，这些信息经常包含重要的安全相关信息
-    13. 如果提供了commit的代码变更内容（patch），需要仔细分析代码变更是否引入了新的安全问题，或者是否修复了现有的安全漏洞
-    14. 根据代码变更的具体内容，可以更准确地判断漏洞的影响范围和严重程度
-
-    {analysis_content}
-
-    python复现脚本编写要求：
-    1. 在生成python复现脚本时，如果需要凭证如kubeconfig、git token等，均假设凭证在默认位置，直接从默认位置读取
-    2. 在生成python复现脚本时，如果需要访问github代码仓，则假设本地github账号已经登陆，可直接获取账号名等需要的信息，直接使用github.com，根据需要创建仓库并提交，不要自己瞎编仓库名或账号名
-    3. 在生成python复现脚本时，如果需要访问HTTP服务器，则在脚本中创建一个HTTP服务器，监听在10000端口以上
-    4. 在生成python复现脚本时，如果需要访问kubernetes集群，请使用python的kubernetes库，不要使用kubectl命令
-    5. 在生成python复现脚本时，尽量使用python库完成所需操作，如非必要不要调用外部程序
-    6. 检查生成的python脚本，修正其中存在的语法问题和功能错误，确保脚本能够正常运行
-    7. 检查生成的python脚本，其中不能包含死循环，设计执行超时机制，确保脚本执行能够在2分钟内退出
-    8. 不要使用'if __name__ == "__main__":'，本地python解释器不支持__name__，直接执行main函数即可
-
-    在回答中请注意以下事项:
-
-    1. 回答请用中文
-    2. 按照下面markdown格式进行回答
-
-    ---
-
-    #### 分析内容
-    {{分析内容}}
-
-    #### 风险评级
-    {{风险评级}}
-
-    #### 复现脚本
-    ```python
-    复现脚本
-    ```
-
-    #### 解释说明
-    {{对复现脚本的解释说明}}
-
-    ---
-
-    """
-
-    try:
-        logger.info('开始分析')
-        client = OpenAI(api_key=api_key, base_url=base_url)
-        response = client.chat.completions.create(
-            model=st.session_state.model,
-            messages=[{'role': 'user', 'content': prompt}]
-        )
-        
-        # 解析返回的 Markdown
-        content = response.choices[0].message.content.strip()
-
-        #logger.info(f"返回的内容: {content}")
-        # 使用正则表达式提取每个字段的内容
-        import re
-        
-        # 提取分析内容
-        analysis_match = re.search(r'#### 分析内容\s*(.*?)\s*####', content, re.DOTALL)
-        analysis = analysis_match.group(1).strip() if analysis_match else ''
-        
-        # 提取风险评级
-        risk_match = re.search(r'#### 风险评级\s*(.*?)\s*####', content, re.DOTALL)
-        risk = risk_match.group(1).strip() if risk_match else '不涉及'
-        
-        # 提取复现脚本
-        poc_match = re.search(r'```python\s*(.*?)\s*```', content, re.DOTALL)
-        poc = poc_match.group(1).strip() if poc_match else ''
-        
-        # 提取解释说明
-        explain_match = re.search(r'#### 解释说明\s*(.*?)\s*---', content, re.DOTALL)
-        explain = explain_match.group(1).strip() if explain_match else ''
-        
-        # 构建结果
-        result = {
-            'analysis': analysis,
-            'has_risk': risk,
-            'poc': poc,
-            'explain': explain
-        }
-        
-        # 解析风险等级
-        if '高风险' in risk:
-            has_risk = 2
-        elif '低风险' in risk:
-            has_risk = 1
-        else:
-            has_risk = 0
-        
-        logger.info('分析完成')
-        return result, has_risk
-    except Exception as e:
-        logger.error(f"分析 Issue 时发生错误: {str(e)}")
-        st.error(f"分析失败: {str(e)}")
-        return {"error": "分析失败，请稍后重试"}, -1
-
-def get_issues(repo_name, labels, since_time, until_time, github_token):
-    try:
-        g = Github(github_token)
-        repo = g.get_repo(repo_name)
-
-        # 构建查询参数
-        labels_query = ' '.join([f'label:{label.strip()}' for label in labels.split(',')])
-        since_str = since_time.strftime('%Y-%m-%d')
-        until_str = until_time.strftime('%Y-%m-%d')
-
-        query = f'repo:{repo_name} is:issue {labels_query} created:{since_str}..{until_str}'
-
-        # 搜索 Issue 并转换为列表
-        issues = list(g.search_issues(query))
-        return issues
-
-    except Exception as e:
-        logger.error(f"获取 Issues 时发生错误: {str(e)}")
-        st.error(f"获取 Issues 失败: {str(e)}")
-        return []
+    # 分析结果实时写入任务日志，可按任务ID恢复
+    if st.session_state.job_id:
+        st.caption(f"当前任务：{st.session_state.job_id}")
+    recent_jobs = list_jobs()
+    if recent_jobs:
+        resume_job_id = st.selectbox("历史任务", recent_jobs)
+        if st.button("恢复任务"):
+            st.query_params['job'] = resume_job_id
 
 def display_issue(issue, analysis=None):
     """显示单个issue的函数"""
@@ -493,6 +277,13 @@ def display_issue(issue, analysis=None):
                     analysis_data = analysis['analysis']  # 获取分析结果
                     st.markdown("**分析结果**  \n")
                     st.markdown(f"**风险定级：**  \n{analysis_data['has_risk']}\n")
+                    if analysis.get('stage'):
+                        st.markdown(f"**判定阶段：**  \n{STAGE_LABELS[analysis['stage']]}（{analysis.get('stage_model', '')}）\n")
+                    if analysis.get('ensemble'):
+                        st.markdown(f"**多模型结论：**  \n{format_ensemble_votes(analysis['ensemble'])}\n")
+                    similar = analysis.get('similar_issue')
+                    if similar:
+                        st.markdown(f"**相似Issue：**  \n[#{similar['issue_number']}]({similar['issue_url']})（相似度 {similar['similarity']}）\n")
                     st.markdown(f"**判断依据：**  \n{analysis_data['analysis']}\n")
                     if analysis_data.get('poc'):  # 只有当 poc 不为空时才显示
                         st.markdown("**复现过程：**")
@@ -506,56 +297,158 @@ def display_issue(issue, analysis=None):
             st.markdown('<div class="analyze-button">', unsafe_allow_html=True)
             button_text = "重新分析" if analysis else "分析"
             st.button(button_text, key=f"analyze_{issue.number}", type="secondary", use_container_width=True,
-                     on_click=analyze_single_issue, args=(issue, openai_api_key, openai_base_url, github_token))
+                     on_click=analyze_single_issue, args=(issue, openai_api_key, openai_base_url, github_token, force_refresh, stream_output, triage_model,
+                           int(token_budget), ensemble_models))
             st.markdown('</div>', unsafe_allow_html=True)
 
-def analyze_single_issue(issue, api_key, base_url, github_token):
+def store_analysis_result(result, journal=True):
+    """将分析结果写入会话状态，已存在的issue结果会被替换；journal 为真时同时追加到当前任务日志和结构化结果"""
+    if 'analysis_results' not in st.session_state:
+        st.session_state.analysis_results = {}
+    if journal:
+        append_results([result])
+        if st.session_state.get('job_id'):
+            record_result(st.session_state.job_id, result)
+
+    # 已存在的结果原位替换，保持原有顺序
+    st.session_state.analysis_results[result['issue_number']] = result
+    st.session_state.results_version += 1
+
+def analyze_single_issue(issue, api_key, base_url, github_token, force_refresh=False, stream=False, triage_model=None,
+                         token_budget=None, ensemble_models=None):
     """分析单个issue的辅助函数"""
     try:
-        issue_details = get_issue_details(issue, github_token) # 获取issue的详细信息
-        analysis_result, has_risk = analyze_issue(
-            api_key,
-            base_url,
-            issue.title,
-            issue.body or '',
-            issue_details # 传递issue的详细信息
-        )
-        if has_risk == -1:
-            st.error(f"分析Issue #{issue.number}失败: {analysis_result}")
+        on_section = display_streaming_analysis(issue) if stream else None
+        result, error = run_issue_analysis(issue, api_key, base_url, github_token, st.session_state.model,
+                                           cache=get_configured_cache(saved_config),
+                                           retry_policy=get_configured_retry_policy(retry_config),
+                                           triage_model=triage_model, force_refresh=force_refresh,
+                                           stream=stream, on_section=on_section, token_budget=token_budget,
+                                           ensemble_models=ensemble_models,
+                                           ensemble_weights=saved_config.get('ensemble_weights'))
+        if error is not None:
+            st.error(f"分析Issue #{issue.number}失败: {error}")
             return
-            
-        result = {
-            'issue_number': issue.number,
-            'issue_title': issue.title,
-            'issue_url': issue.html_url,
-            'analysis': analysis_result,
-            'has_risk': has_risk,
-            'issue_body': issue.body or '',
-            'comments': issue_details['comments'], # 添加评论信息
-            'commits': issue_details['commits'] # 添加commit信息
-        }
-        
-        if 'analysis_results' not in st.session_state:
-            st.session_state.analysis_results = []
-            
-        # 查找是否已存在该 issue 的分析结果
-        existing_index = next(
-            (i for i, r in enumerate(st.session_state.analysis_results) 
-             if r['issue_number'] == issue.number), 
-            -1
-        )
-        
-        if existing_index != -1:
-            # 如果已存在，替换原有结果
-            st.session_state.analysis_results[existing_index] = result
-        else:
-            # 如果不存在，添加新结果
-            st.session_state.analysis_results.append(result)
-            
+
+        store_analysis_result(result)
+        persist_incremental_scan()
         st.session_state.analysis_complete = True
     except Exception as e:
         st.error(f"分析Issue #{issue.number}失败: {str(e)}")
 
+def persist_incremental_scan():
+    """增量模式下将当前结果合并进扫描状态，并推进检查点"""
+    scan = st.session_state.get('scan_state')
+    if not scan:
+        return
+    scan['results'] = merge_results(scan['results'], st.session_state.analysis_results.values())
+    # 只使用已加载的连续结果推进检查点，避免为此拉取全部分页
+    loaded_issues = st.session_state.issues.loaded_prefix()
+    issue_updates = [(format_time(issue.updated_at), issue.number) for issue in loaded_issues]
+    scan['checkpoint'] = advance_checkpoint(scan['checkpoint'], issue_updates, scan['results'])
+    if not save_scan_state(scan):
+        st.error("保存增量扫描状态失败")
+
+def fetch_issues(params, job_results=()):
+    """
+    按任务参数获取Issue列表，增量模式下载入已有结果
+
+    Args:
+        params: 任务参数，包括仓库、标签、起止日期和扫描模式
+        job_results: 恢复任务时任务日志中已完成的分析结果
+
+    Returns:
+        str: 增量扫描使用的检查点，全量模式为None
+    """
+    updated_since = None
+    st.session_state.scan_state = None
+    if params['scan_mode'] == "增量":
+        # 载入已有结果，只获取检查点之后变化的 Issue；恢复任务时沿用任务创建时的检查点
+        scan = load_scan_state(params['repo_name'], params['labels'])
+        st.session_state.scan_state = scan
+        st.session_state.analysis_results = {r['issue_number']: r for r in scan['results']}
+        st.session_state.results_version += 1
+        updated_since = params['updated_since'] if 'updated_since' in params else scan['checkpoint']
+        if updated_since:
+            st.info(f"增量扫描：检查点 {updated_since}，已有 {len(scan['results'])} 个分析结果")
+    for result in job_results:
+        store_analysis_result(result, journal=False)
+
+    with st.spinner('正在获取 Issue 列表...'):
+        st.session_state.issues = get_issues(params['repo_name'], params['labels'], date.fromisoformat(params['since']),
+                                             date.fromisoformat(params['until']), github_token, updated_since=updated_since)
+        st.session_state.total_issues = len(st.session_state.issues)
+    return updated_since
+
+def reattach_job(job_id):
+    """页面刷新或恢复任务时，按任务日志重建Issue列表和已完成的结果"""
+    job = load_job(job_id)
+    if job is None:
+        st.warning(f"任务 {job_id} 不存在")
+        del st.query_params['job']
+        return False
+    try:
+        fetch_issues(job['params'], job['results'])
+    except Exception as e:
+        logger.error(f"恢复任务 {job_id} 时发生错误: {str(e)}")
+        st.error(f"恢复任务失败: {str(e)}")
+        return False
+    st.session_state.job_id = job_id
+    persist_incremental_scan()
+    st.info(f"已恢复任务 {job_id}，已完成 {len(job['results'])} 个分析结果")
+    return True
+
+def wait_for_background_job():
+    """后台任务运行时显示进度并等待完成，完成后载入任务日志中的结果"""
+    job_id = st.session_state.job_id
+    progress = get_job_progress(job_id) if job_id else None
+    if not progress or not (progress['running'] or st.session_state.get('job_pending_sync')):
+        return
+    st.session_state.job_pending_sync = True
+
+    progress_text = st.empty()
+    progress_bar = st.progress(0)
+    while progress['running']:
+        progress_bar.progress(progress['completed'] / max(progress['total'], 1))
+        progress_text.text(f"任务 {job_id} 正在后台分析 ({progress['completed']}/{progress['total']})，"
+                           f"已消耗 {progress['tokens']} tokens，刷新页面不会中断分析")
+        time.sleep(1)
+        progress = get_job_progress(job_id)
+
+    for result in load_job(job_id)['results']:
+        store_analysis_result(result, journal=False)
+    persist_incremental_scan()
+    st.session_state.job_pending_sync = False
+    progress_bar.progress(1.0)
+    progress_text.text('分析完成！')
+    for notice in progress['notices']:
+        st.warning(notice)
+    if progress['error']:
+        st.error(f"任务执行失败: {progress['error']}")
+    elif progress['failed']:
+        st.warning(f"{progress['failed']} 个Issue分析失败，可再次点击分析重试")
+    else:
+        st.session_state.analysis_complete = True
+
+def display_streaming_analysis(issue):
+    """创建流式分析的展示区域，返回段落回调"""
+    status = st.status(f"正在分析 Issue #{issue.number}...", expanded=True)
+    placeholders = {}
+
+    def on_section(name, text, closed):
+        if name not in placeholders:
+            with status:
+                st.markdown(f"**{name}：**")
+                placeholders[name] = st.empty()
+        if name == '复现脚本':
+            placeholders[name].code(text.strip('`').removeprefix('python').strip(), language="python")
+        else:
+            placeholders[name].markdown(text)
+        if name == '风险评级' and closed:
+            status.update(label=f"Issue #{issue.number} 风险评级：{text}")
+
+    return on_section
+
 def change_page(page_number):
     """更新页码的回调函数"""
     st.session_state.current_page = page_number
@@ -656,154 +549,6 @@ def display_pagination(current_page, total_pages):
                 st.button("⟫", key="last_page", use_container_width=False,
                          on_click=change_page, args=(total_pages,))
 
-def fix_code_blocks_in_details(text):
-    """修复 <details> 标签中未闭合的代码块"""
-    if not text or '<details>' not in text:
-        return text
-
-    # 分割文本为 details 内外的部分
-    parts = []
-    current_pos = 0
-    
-    while True:
-        # 查找下一个 details 开始标签
-        start = text.find('<details>', current_pos)
-        if start == -1:
-            # 没有更多的 details 标签，添加剩余部分
-            if current_pos < len(text):
-                parts.append(text[current_pos:])
-            break
-            
-        # 添加 details 之前的内容
-        if start > current_pos:
-            parts.append(text[current_pos:start])
-            
-        # 查找对应的结束标签
-        end = text.find('</details>', start)
-        if end == -1:
-            # 如果没有找到结束标签，处理到文本末尾
-            end = len(text)
-            
-        # 获取 details 中的内容
-        details_content = text[start:end]
-        
-        # 检查是否有未闭合的代码块
-        code_marks = details_content.count('```')
-        if code_marks % 2 == 1:
-            # 在 details 结束前添加闭合标记
-            details_content = details_content + '\n```\n'
-            
-        parts.append(details_content)
-        current_pos = end
-        
-        # 如果已经到达文本末尾，退出循环
-        if end == len(text):
-            break
-            
-    return ''.join(parts)
-
-def json_to_markdown(json_string):
-    """将 JSON 数据转换为 Markdown 格式"""
-    markdown = f"# Issue 安全分析报告\n\n> 分析模型：{st.session_state.model}\n\n"
-    
-    # 分离不同风险等级的 issues
-    risk_issues = []
-    low_risk_issues = []
-    no_risk_issues = []
-    
-    json_data = json.loads(json_string)
-    for item in json_data:
-        content = ""
-        # 添加标题
-        content += f"## Issue #{item['issue_number']} {item['issue_title']}\n\n"
-        
-        # 添加链接
-        content += f"- Issue 链接：[#{item['issue_number']}]({item['issue_url']})\n\n"
-        
-        # 添加内容
-        content += "### Issue 内容\n\n"
-        if item['issue_body']:
-            issue_content = item['issue_body'].replace('### ', '#### ')
-            # 修复 details 中未闭合的代码块
-            issue_content = fix_code_blocks_in_details(issue_content)
-            content += f"{issue_content}\n\n"
-        else:
-            content += "无内容\n\n"
-        
-        # 添加评论信息
-        if item.get('comments'):
-            content += "### 相关评论\n\n"
-            for i, comment in enumerate(item['comments'][:5], 1):  # 最多导出5条评论
-                content += f"#### 评论{i} - {comment['author']} ({comment['created_at']})\n\n"
-                if comment['body']:
-                    comment_content = comment['body'].replace('### ', '##### ')
-                    content += f"{comment_content}\n\n"
-                else:
-                    content += "无内容\n\n"
-        
-        # 添加相关commit信息
-        if item.get('commits'):
-            content += "### 相关Commit\n\n"
-            for commit in item['commits']:
-                content += f"#### Commit: {commit['sha'][:8]}\n\n"
-                content += f"- **作者：** {commit['author']}\n"
-                content += f"- **时间：** {commit['date']}\n"
-                content += f"- **消息：** {commit['message']}\n"
-                if commit['files_changed']:
-                    content += f"- **修改文件：** {', '.join(commit['files_changed'])}\n"
-                if commit.get('patch'):
-                    content += f"- **代码变更：**\n\n```diff\n{commit['patch']}\n```\n\n"
-                content += f"- **链接：** [{commit['sha'][:8]}]({commit['url']})\n\n"
-        
-        # 添加分析结果
-        content += "### 分析结果\n\n"
-        analysis_data = item['analysis']
-        
-        # 添加风险定级
-        content += f"**风险定级：**  \n{analysis_data['has_risk']}\n\n"
-        
-        # 添加判断依据
-        content += f"**判断依据：**  \n{analysis_data['analysis']}\n\n"
-        
-        # 添加复现过程（如果有）
-        if analysis_data.get('poc'):
-            content += "**复现过程：**\n\n```python\n"
-            content += analysis_data['poc']
-            content += "\n```\n\n\n"
-        
-        if analysis_data.get('explain'):
-            content += "**解释说明：**\n\n"
-            content += analysis_data['explain']
-            content += "\n\n"
-        
-        # 添加分隔线
-        content += "---\n\n\n"
-        
-        # 根据分析结果分类
-        if item['has_risk'] == 2:
-            risk_issues.append(content)
-        elif item['has_risk'] == 1:
-            low_risk_issues.append(content)
-        else:
-            no_risk_issues.append(content)
-    
-    # 添加高风险的 issues
-    if risk_issues:
-        markdown += f"# 🚨 存在高风险的 Issues ({len(risk_issues)} 个)\n\n"
-        markdown += "".join(risk_issues)
-    
-    # 添加低风险的 issues
-    if low_risk_issues:
-        markdown += f"# ⚠️ 存在低风险的 Issues ({len(low_risk_issues)} 个)\n\n"
-        markdown += "".join(low_risk_issues)
-    
-    # 添加无风险的 issues
-    if no_risk_issues:
-        markdown += f"# ✅ 不涉及安全风险的 Issues ({len(no_risk_issues)} 个)\n\n"
-        markdown += "".join(no_risk_issues)
-    
-    return markdown
-
 def display_action_buttons():
     """显示操作按钮（导出和清除）和分析进度"""
     st.markdown("""
@@ -885,15 +630,12 @@ def display_action_buttons():
     total_issues = len(st.session_state.issues) if hasattr(st.session_state, 'issues') else 0
     analyzed_issues = len(st.session_state.analysis_results)
     progress_text = f'<div class="analysis-progress">已分析<span class="progress-numbers">{analyzed_issues}/{total_issues}</span>个issues</div>'
-    
-    # 创建功能按钮
-    results_json = json.dumps(
-        st.session_state.analysis_results,
-        ensure_ascii=False,
-        indent=4
-    )
-
-    results_md = json_to_markdown(results_json)
+    # 已分析结果的累计用量，按模型的明细悬停查看
+    usage = summarize_usage(st.session_state.analysis_results.values())['total']
+    if usage['calls']:
+        model_details = '&#10;'.join(html.escape(f"{name}: {stats['calls']} 次，{format_usage(stats)}")
+                                     for name, stats in sorted(usage['models'].items()))
+        progress_text += f'<div class="analysis-progress" title="{model_details}">{format_usage(usage)}</div>'
     
     # 使用列布局
     cols = st.columns([2, 1, 1])
@@ -903,10 +645,10 @@ def display_action_buttons():
         st.markdown(progress_text, unsafe_allow_html=True)
     
     # 显示导出按钮
-    with cols[1]:
+    with cols[1], open(export_report(), 'rb') as report_file:
         st.download_button(
             '导出结果',
-            data=results_md,
+            data=report_file,
             file_name='issue_analysis_results.md',
             mime='text/markdown',
             use_container_width=False
@@ -918,9 +660,30 @@ def display_action_buttons():
     
     st.markdown('</div></div>', unsafe_allow_html=True)
 
+def export_report():
+    """
+    将分析结果逐段写入报告文件，返回文件路径
+
+    报告不在内存中整体拼接；分析结果和模型均未变化时直接复用上次生成的文件，不必每次页面刷新都重新生成
+    """
+    report_path = st.session_state.get('report_path')
+    if report_path is None or not os.path.exists(report_path):
+        fd, report_path = tempfile.mkstemp(prefix='issue_analysis_', suffix='.md')
+        os.close(fd)
+        st.session_state.report_path = report_path
+        st.session_state.report_key = None
+
+    report_key = (st.session_state.results_version, st.session_state.model)
+    if st.session_state.get('report_key') != report_key:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            write_markdown_report(st.session_state.analysis_results.values(), st.session_state.model, f)
+        st.session_state.report_key = report_key
+    return report_path
+
 def clear_results():
     """清除分析结果的回调函数"""
-    st.session_state.analysis_results = []
+    st.session_state.analysis_results = {}
+    st.session_state.results_version += 1
 
 def main():
     # 添加全局样式
@@ -960,18 +723,39 @@ def main():
             st.error("请填写所有必需的字段")
             return
 
+        params = {
+            'repo_name': repo_name,
+            'labels': labels,
+            'since': since_time.isoformat(),
+            'until': until_time.isoformat(),
+            'scan_mode': scan_mode,
+            'model': st.session_state.model
+        }
         try:
-            with st.spinner('正在获取 Issue 列表...'):
-                st.session_state.issues = get_issues(repo_name, labels, since_time, until_time, github_token)
-                st.session_state.total_issues = len(st.session_state.issues)
+            params['updated_since'] = fetch_issues(params)
+            # 每次获取Issue创建一个任务，写入地址栏，页面刷新后据此恢复
+            st.session_state.job_id = create_job(params)
+            st.query_params['job'] = st.session_state.job_id
 
             if not st.session_state.issues:
+                if st.session_state.scan_state and st.session_state.analysis_results:
+                    # 增量模式下没有变化时仍可导出已有结果
+                    st.success("检查点之后没有新创建或更新的 Issue")
+                    display_action_buttons()
+                    return
                 st.warning("未找到符合条件的 Issues")
                 return
         except Exception as e:
             logger.error(f"获取 Issues 时发生错误: {str(e)}")
             st.error(f"获取 Issues 失败: {str(e)}")
             return
+    elif st.query_params.get('job') and st.query_params.get('job') != st.session_state.job_id:
+        # 会话状态丢失（如页面刷新）或选择了历史任务时，按任务ID重新关联
+        if not github_token:
+            st.error("请填写 GitHub Token 后再恢复任务")
+            return
+        if not reattach_job(st.query_params['job']):
+            return
 
     # 如果已经有issues数据，则显示分页内容
     if hasattr(st.session_state, 'issues') and st.session_state.issues:
@@ -987,25 +771,68 @@ def main():
         analyze_button_key = f"analyze_page_{current_page}"
         if st.button("分析当前页面所有Issue", key=analyze_button_key):
             current_issues = st.session_state.issues[start_idx:end_idx]
-            progress_text = st.empty()
-            progress_bar = st.progress(0)
-            
-            for idx, issue in enumerate(current_issues):
-                if not any(r['issue_number'] == issue.number for r in st.session_state.analysis_results):
-                    progress_text.text(f'正在分析 Issue #{issue.number}...')
-                    analyze_single_issue(issue, openai_api_key, openai_base_url, github_token)
-                progress_bar.progress((idx + 1) / len(current_issues))
-            
-            progress_text.text('分析完成！')
-            st.session_state.analysis_complete = True
+            pending_issues = [
+                issue for issue in current_issues
+                if not is_analysis_current(
+                    st.session_state.analysis_results.get(issue.number),
+                    format_time(issue.updated_at)
+                )
+            ]
+
+            # 后台线程中无法访问会话状态，参数需提前取出
+            model = st.session_state.model
+            job_id = st.session_state.job_id
+            payload_memo = create_payload_memo(saved_config)
+            cache = get_configured_cache(saved_config)
+            retry_policy = get_configured_retry_policy(retry_config)
+            known_results = list(st.session_state.analysis_results.values()) if duplicate_detection else None
+            # 流水线不支持流式输出和多模型集成，选择了这两项时仍使用线程池
+            use_pipeline = async_pipeline and not early_exit and not ensemble_models
+
+            def run(issues, on_result):
+                """执行批量分析，返回本次的用量汇总"""
+                # 构建索引需要读取历史报告检索库，在后台线程中进行
+                duplicate_index = create_duplicate_index(saved_config, known_results) if known_results is not None else None
+                prefilter = create_prefilter(dict(saved_config, prefilter_threshold=prefilter_threshold)) if prefilter_enabled else None
+                if prefilter is not None and prefilter.classifier is None:
+                    add_job_notice(job_id, prefilter.describe())
+
+                def record(issue, result, error):
+                    if error is None:
+                        append_results([result])
+                    on_result(issue, result, error)
+
+                if use_pipeline:
+                    # 异步流水线：GitHub 请求与大模型调用在同一事件循环中重叠进行
+                    outcomes = analyze_issues_pipelined(
+                        issues, openai_api_key, openai_base_url, github_token, model,
+                        github_workers=int(github_workers), llm_workers=int(llm_workers), on_result=record,
+                        triage_model=triage_model, force_refresh=force_refresh, token_budget=int(token_budget),
+                        payload_memo=payload_memo, cache=cache, retry_policy=retry_policy,
+                        duplicate_index=duplicate_index, prefilter=prefilter
+                    )
+                    return summarize_usage([result for _, result, error in outcomes if error is None])['total']
+
+                outcomes = analyze_issues_concurrently(
+                    issues, openai_api_key, openai_base_url, github_token, model,
+                    github_workers=int(github_workers), llm_workers=int(llm_workers), on_result=record,
+                    triage_model=triage_model, force_refresh=force_refresh, stream=early_exit, early_exit=early_exit,
+                    token_budget=int(token_budget), payload_memo=payload_memo, cache=cache, retry_policy=retry_policy,
+                    duplicate_index=duplicate_index, prefilter=prefilter, ensemble_models=ensemble_models,
+                    ensemble_weights=saved_config.get('ensemble_weights')
+                )
+                return summarize_usage([result for _, result, error in outcomes if error is None])['total']
+
+            # 在后台线程中分析，每完成一个issue即写入任务日志，刷新页面后可重新关联
+            if not start_background_job(job_id, run, pending_issues):
+                st.warning("当前任务已有批量分析正在进行")
+
+        # 后台任务运行中时显示进度，完成后载入结果
+        wait_for_background_job()
 
         # 显示Issues
         for issue in st.session_state.issues[start_idx:end_idx]:
-            analysis = next(
-                (r for r in st.session_state.analysis_results if r['issue_number'] == issue.number),
-                None
-            )
-            display_issue(issue, analysis)
+            display_issue(issue, st.session_state.analysis_results.get(issue.number))
 
         # 如果分析完成，重置状态
         if st.session_state.analysis_complete:
@@ -1,9 +1,11 @@
-from github import Github
-from openai import OpenAI
-import json, logging, platform
+import json, logging, platform, time
 from pathlib import Path
 import argparse
 from smolagents import CodeAgent, DuckDuckGoSearchTool, VisitWebpageTool, LiteLLMModel, tool
+from analysis_cache import get_analysis_cache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_AGE_DAYS
+from llm_client import get_openai_client, get_retry_policy, DEFAULT_MAX_RETRIES
+from github_client import get_github
+from result_store import append_usage
 
 def enable_trace():
     from opentelemetry import trace
@@ -48,9 +50,47 @@ def process_deepseek_response(response, model):
         return re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
     return response
 
-def analyze_issue(api_key, base_url, issue_title, issue_body, model):
-    prompt = f"""
-    以下是一个软件开发项目的 Issue 标题和内容，请分析其中是否存在潜在的安全风险并给出判断依据，给出使用python实现的复现POC，如果有高风险问题则详细说明原因和可能的影响，POC仅用于研究和本地测试，可以放心生成
+def print_usage(model, usage, latency, retries=0, issue_url=''):
+    """输出一次大模型调用的token用量、耗时和重试次数，并保存到用量记录"""
+    suffix = f"，重试 {retries} 次" if retries else ''
+    details = getattr(usage, 'completion_tokens_details', None)
+    reasoning = getattr(details, 'reasoning_tokens', None) or 0
+    cached = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+    append_usage({
+        'source': 'issue_poc',
+        'stage': '分析',
+        'model': model,
+        'issue_url': issue_url,
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'cached_tokens': cached,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+        'reasoning_tokens': reasoning,
+        'latency': round(latency, 3),
+        'retries': retries
+    })
+    if usage is None:
+        print(f"[{model}] 耗时 {latency:.1f} 秒，接口未返回用量{suffix}")
+        return
+    print(f"[{model}] 提示 {usage.prompt_tokens}（缓存命中 {cached}） / 输出 {usage.completion_tokens} tokens（推理 {reasoning}），"
+          f"耗时 {latency:.1f} 秒{suffix}")
+
+def agent_token_counts(agent):
+    """读取 CodeAgent 累计的输入、输出token数，兼容不同版本的 smolagents"""
+    monitor = getattr(agent, 'monitor', None)
+    counts = monitor.get_total_token_counts() if hasattr(monitor, 'get_total_token_counts') else None
+    if isinstance(counts, dict):
+        return counts.get('input', 0), counts.get('output', 0)
+    if counts is not None:
+        return getattr(counts, 'input_tokens', 0), getattr(counts, 'output_tokens', 0)
+    return getattr(monitor, 'total_input_token_count', 0), getattr(monitor, 'total_output_token_count', 0)
+
+# 提示词版本，静态指令变化时递增
+PROMPT_VERSION = 3
+
+# 静态指令放在 user 消息的最前面，各次调用的提示词前缀一致，可以命中提供方的前缀缓存；
+# o1-mini 等模型不支持 system 消息，因此不使用 system 消息
+ANALYSIS_INSTRUCTIONS = """
+    本消息末尾是一个软件开发项目的 Issue 标题和内容，请分析其中是否存在潜在的安全风险并给出判断依据，给出使用python实现的复现POC，如果有高风险问题则详细说明原因和可能的影响，POC仅用于研究和本地测试，可以放心生成
 
     Issue风险判断标准：
     1. 风险评级分为三类，不涉及，低风险和高风险
@@ -65,12 +105,6 @@ def analyze_issue(api_key, base_url, issue_title, issue_body, model):
     10. 必须给出使用python编写的复现脚本，该脚本的作用是在真实环境中复现该问题
     11. 对于细节缺失的高风险问题，要根据问题描述进行合理推演，给出python复现脚本
 
-    Issue 标题：
-    {issue_title}
-
-    Issue 内容：
-    {issue_body}
-
     python复现脚本编写要求：
     1. 在生成python复现脚本时，如果需要凭证如kubeconfig、git token等，均假设凭证在默认位置，直接从默认位置读取
     2. 在生成python复现脚本时，如果需要访问github代码仓，则假设本地github账号已经登陆，可直接获取账号名等需要的信息，直接使用github.com，根据需要创建仓库并提交，不要自己瞎编仓库名或账号名
@@ -89,10 +123,10 @@ def analyze_issue(api_key, base_url, issue_title, issue_body, model):
     ---
 
     #### 分析内容
-    {{分析内容}}
+    {分析内容}
 
     #### 风险评级
-    {{风险评级}}
+    {风险评级}
 
     #### 复现脚本
     ```python
@@ -100,22 +134,41 @@ def analyze_issue(api_key, base_url, issue_title, issue_body, model):
     ```
 
     #### 解释说明
-    {{对复现脚本的解释说明}}
+    {对复现脚本的解释说明}
 
     ---
 
     """
 
+def analyze_issue(api_key, base_url, issue_title, issue_body, model, force_refresh=False, issue_url=''):
+    messages = [
+        {'role': 'user', 'content': f"{ANALYSIS_INSTRUCTIONS}\nIssue 标题：\n{issue_title}\n\nIssue 内容：\n{issue_body}\n"}
+    ]
+    prompt = f"v{PROMPT_VERSION}\n" + '\n'.join(f"[{m['role']}]\n{m['content']}" for m in messages)
+
     try:
-        client = OpenAI(api_key=api_key, base_url=base_url)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{'role': 'user', 'content': prompt}]
+        config = load_config()
+        cache = get_analysis_cache(
+            max_entries=config.get('cache_max_entries', DEFAULT_MAX_ENTRIES),
+            max_age_days=config.get('cache_max_age_days', DEFAULT_MAX_AGE_DAYS)
         )
-        
-        # 解析返回的 Markdown
-        content = response.choices[0].message.content.strip()
-        content = process_deepseek_response(content, model)
+        content = None if force_refresh else cache.get(prompt, model)
+        if content is None:
+            client = get_openai_client(api_key, base_url)
+            # 网关限流或出错时按退避策略重试
+            retry_policy = get_retry_policy(max_retries=config.get('llm_max_retries', DEFAULT_MAX_RETRIES))
+            started = time.monotonic()
+            response, retries, _ = retry_policy.call(
+                client,
+                model=model,
+                messages=messages
+            )
+            print_usage(model, response.usage, time.monotonic() - started, retries, issue_url)
+            
+            # 解析返回的 Markdown
+            content = response.choices[0].message.content.strip()
+            content = process_deepseek_response(content, model)
+            cache.put(prompt, model, content)
         # 使用正则表达式提取每个字段的内容
         import re
         
@@ -170,7 +223,7 @@ def get_one_issue(repo_name, issue_id, github_token):
         list: 包含单个Issue对象的列表
     """
     try:
-        g = Github(github_token)
+        g = get_github(github_token)
         repo = g.get_repo(repo_name)
         
         try:
@@ -298,7 +351,8 @@ def process_issue(config, args):
 
     issue = issues[0]
     print(f"\n开始分析Issue #{issue.number}: {issue.title} ...\n")
-    analysis_result, has_risk = analyze_issue(config['openai_api_key'], config['openai_base_url'], issue.title, issue.body, config['model'])
+    analysis_result, has_risk = analyze_issue(config['openai_api_key'], config['openai_base_url'], issue.title, issue.body, config['model'],
+                                              force_refresh=args.refresh, issue_url=issue.html_url)
     print(f"\n风险等级: {has_risk}\n")
     analysis_result['issue_number'] = issue.number
     analysis_result['issue_title'] = issue.title
@@ -397,6 +451,7 @@ def main():
     parser.add_argument('-i', '--issue', type=int, default=123471, help='要获取的Issue ID，默认为 123471')
     parser.add_argument('-t', '--trace', action='store_true', help='启用OpenTelemetry跟踪（需要本地运行phoenix.server）')
     parser.add_argument('-d', '--debug', action='store_true', help='启用debug模式，直接读取当前目录的result.md文件')
+    parser.add_argument('--refresh', action='store_true', help='忽略本地分析缓存，重新调用大模型分析')
     
     args = parser.parse_args()
     config = load_config()
@@ -501,7 +556,22 @@ main()
 {result_md}
 """
 
-    agent.run(prompt)
+    started = time.monotonic()
+    try:
+        agent.run(prompt)
+    finally:
+        input_tokens, output_tokens = agent_token_counts(agent)
+        latency = time.monotonic() - started
+        append_usage({
+            'source': 'issue_poc',
+            'stage': '复现',
+            'model': config['model'],
+            'issue_url': f"https://github.com/{args.repo}/issues/{args.issue}",
+            'prompt_tokens': input_tokens,
+            'completion_tokens': output_tokens,
+            'latency': round(latency, 3)
+        })
+        print(f"\n复现用量：输入 {input_tokens} / 输出 {output_tokens} tokens，耗时 {latency:.1f} 秒")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,169 @@
+"""
+按需分页获取 GitHub 搜索结果
+
+GitHub 搜索接口单个查询最多只能取回 1000 条结果，这里将时间窗口自动二分拆成多个子窗口，
+每个子窗口的结果数都不超过上限；对外表现为一个支持 len() 和切片的只读序列，
+只在访问到某一页时才请求对应的搜索分页，并在后台预取后续若干页。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RESULT_LIMIT = 1000
+PREFETCH_WORKERS = 4
+
+# 所有序列共享的预取线程池，界面每次获取issue都会创建新的序列，不必各自创建线程
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='issue-prefetch')
+
+def format_search_time(dt):
+    """格式化为搜索语法支持的 ISO8601 时间"""
+    return dt.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+class SearchWindow:
+    """一个结果数不超过搜索上限的子窗口"""
+
+    def __init__(self, query, paginated, total, first_page):
+        self.query = query
+        self.paginated = paginated
+        self.total = total
+        self.pages = {0: first_page}
+
+class LazyIssueList:
+    """
+    按需分页的 Issue 序列
+
+    Args:
+        g: Github 对象，其 per_page 决定每个搜索分页的大小
+        base_query: 不含时间范围的查询条件
+        field: 用于拆分时间窗口的字段，created 或 updated
+        since: 窗口起始时间（UTC datetime）
+        until: 窗口结束时间（UTC datetime）
+        prefetch_pages: 每次访问后在后台预取的分页数
+        scheduler: 配额调度器（可选），每次搜索请求前等待 search 配额
+    """
+
+    def __init__(self, g, base_query, field, since, until, prefetch_pages=1, scheduler=None):
+        self.g = g
+        self.scheduler = scheduler
+        self.base_query = base_query
+        self.field = field
+        self.page_size = g.per_page
+        self.prefetch_pages = prefetch_pages
+        self._lock = threading.Lock()
+        self.windows = []
+        self._split_window(since, until)
+        # 每个窗口在全局序列中的起始下标
+        self._offsets = []
+        offset = 0
+        for window in self.windows:
+            self._offsets.append(offset)
+            offset += window.total
+        self._length = offset
+
+    def _search(self, since, until):
+        query = f'{self.base_query} {self.field}:{format_search_time(since)}..{format_search_time(until)}'
+        paginated = self.g.search_issues(query, sort=self.field, order='asc')
+        first_page = self._get_page(paginated, 0)
+        return query, paginated, paginated.totalCount, first_page
+
+    def _get_page(self, paginated, p):
+        if self.scheduler:
+            self.scheduler.acquire('search')
+        page = paginated.get_page(p)
+        if self.scheduler:
+            self.scheduler.observe_github(self.g, 'search')
+        return page
+
+    def _split_window(self, since, until):
+        """按时间顺序二分窗口，直到每个子窗口的结果数不超过搜索上限"""
+        query, paginated, total, first_page = self._search(since, until)
+        if total > SEARCH_RESULT_LIMIT and until - since > timedelta(seconds=1):
+            middle = since + (until - since) / 2
+            middle = middle.replace(microsecond=0)
+            logger.info(f"搜索结果 {total} 条超过上限，拆分时间窗口: {query}")
+            self._split_window(since, middle)
+            self._split_window(middle + timedelta(seconds=1), until)
+            return
+        if total > SEARCH_RESULT_LIMIT:
+            logger.warning(f"时间窗口无法继续拆分，只能获取前 {SEARCH_RESULT_LIMIT} 条结果: {query}")
+            total = SEARCH_RESULT_LIMIT
+        self.windows.append(SearchWindow(query, paginated, total, first_page))
+
+    def __len__(self):
+        return self._length
+
+    def _locate(self, index):
+        """将全局下标映射为 (窗口序号, 分页序号, 页内偏移)"""
+        for w in range(len(self.windows) - 1, -1, -1):
+            if index >= self._offsets[w]:
+                local = index - self._offsets[w]
+                return w, local // self.page_size, local % self.page_size
+        raise IndexError(index)
+
+    def _fetch_page(self, w, p):
+        window = self.windows[w]
+        with self._lock:
+            if p in window.pages:
+                return window.pages[p]
+        page = self._get_page(window.paginated, p)
+        with self._lock:
+            window.pages[p] = page
+        return page
+
+    def _prefetch(self, w, p):
+        """在后台预取 (w, p) 之后的若干分页"""
+        for _ in range(self.prefetch_pages):
+            p += 1
+            if p * self.page_size >= self.windows[w].total:
+                w, p = w + 1, 0
+                if w >= len(self.windows):
+                    return
+            if p not in self.windows[w].pages:
+                _prefetch_executor.submit(self._safe_fetch, w, p)
+
+    def _safe_fetch(self, w, p):
+        try:
+            self._fetch_page(w, p)
+        except Exception as e:
+            logger.warning(f"预取搜索分页失败: {str(e)}")
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            items = []
+            last = None
+            for i in range(start, stop, step):
+                w, p, offset = self._locate(i)
+                page = self._fetch_page(w, p)
+                # 两次请求间结果可能发生变化，页内条目不足时跳过
+                if offset < len(page):
+                    items.append(page[offset])
+                last = (w, p)
+            if last:
+                self._prefetch(*last)
+            return items
+        if key < 0:
+            key += self._length
+        if not 0 <= key < self._length:
+            raise IndexError(key)
+        w, p, offset = self._locate(key)
+        page = self._fetch_page(w, p)
+        self._prefetch(w, p)
+        if offset >= len(page):
+            raise IndexError(key)
+        return page[offset]
+
+    def loaded_prefix(self):
+        """返回从头开始连续已加载的条目，不会触发新的请求"""
+        items = []
+        with self._lock:
+            for window in self.windows:
+                pages = (window.total + self.page_size - 1) // self.page_size
+                for p in range(pages):
+                    if p not in window.pages:
+                        return items
+                    items.extend(window.pages[p])
+        return items
@@ -0,0 +1,198 @@
+"""
+可恢复的批量分析任务
+
+每个任务对应 jobs 目录下的一个 JSONL 日志文件：第一行记录任务参数，之后每完成一个 issue 追加一行结果，
+结束时追加完成标记。写入后立即 fsync，浏览器刷新、脚本异常或容器重启都不会丢失已完成的分析结果；
+按任务ID重新打开时跳过已完成的 issue，界面刷新后可通过任务ID重新关联到仍在运行的后台任务。
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_locks_lock = threading.Lock()
+_locks = {}
+_running_lock = threading.Lock()
+_running = {}
+
+def get_job_dir():
+    """获取任务日志目录 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'jobs'
+
+def get_job_path(job_id):
+    return get_job_dir() / f'{job_id}.jsonl'
+
+def _get_lock(job_id):
+    with _locks_lock:
+        return _locks.setdefault(job_id, threading.Lock())
+
+def _append(job_id, record):
+    """追加一条记录并落盘"""
+    path = get_job_path(job_id)
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _get_lock(job_id):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'ab+') as f:
+            # 上次写入中途退出留下的不完整行单独成行，避免与本条记录粘连
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = '\n' + line
+            f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def create_job(params):
+    """
+    创建任务
+
+    Args:
+        params: 任务参数，如仓库、标签、时间范围、模型，需可序列化为 JSON
+
+    Returns:
+        str: 任务ID
+    """
+    job_id = datetime.now().strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+    _append(job_id, {'type': 'job', 'id': job_id, 'created_at': _now(), 'params': params})
+    return job_id
+
+def record_result(job_id, result):
+    """记录一个已完成的分析结果"""
+    _append(job_id, {'type': 'result', 'at': _now(), 'result': result})
+
+def record_error(job_id, issue_number, error):
+    """记录分析失败的 issue，恢复任务时会重新分析"""
+    _append(job_id, {'type': 'error', 'at': _now(), 'issue_number': issue_number, 'error': str(error)})
+
+def record_batch(job_id, batch_id):
+    """记录提交到提供方 Batch API 的批处理ID，恢复任务时继续轮询该批处理而不是重新提交"""
+    _append(job_id, {'type': 'batch', 'at': _now(), 'batch_id': batch_id})
+
+def record_done(job_id, usage=None):
+    """记录任务完成，usage 为本次执行的用量汇总"""
+    record = {'type': 'done', 'at': _now()}
+    if usage:
+        record['usage'] = usage
+    _append(job_id, record)
+
+def load_job(job_id):
+    """
+    读取任务日志
+
+    Returns:
+        dict: {'id', 'params', 'results', 'errors', 'done'}，results 按 issue 编号去重、保持完成顺序，
+              提交过批处理时 batch_id 为最近一次的批处理ID；任务不存在时返回 None
+    """
+    path = get_job_path(job_id)
+    if not path.exists():
+        return None
+    job = {'id': job_id, 'params': {}, 'results': {}, 'errors': {}, 'done': False}
+    with _get_lock(job_id), open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 进程在写入中途退出时最后一行可能不完整
+                logger.warning(f"任务 {job_id} 日志存在无法解析的行，已跳过")
+                continue
+            kind = record.get('type')
+            if kind == 'job':
+                job['params'] = record.get('params', {})
+                job['created_at'] = record.get('created_at')
+            elif kind == 'result':
+                result = record['result']
+                job['results'][result['issue_number']] = result
+                job['errors'].pop(result['issue_number'], None)
+            elif kind == 'error':
+                job['errors'][record['issue_number']] = record.get('error')
+            elif kind == 'batch':
+                job['batch_id'] = record['batch_id']
+            elif kind == 'done':
+                job['done'] = True
+                if record.get('usage'):
+                    job['usage'] = record['usage']
+    job['results'] = list(job['results'].values())
+    return job
+
+def list_jobs(limit=20):
+    """按创建时间倒序列出最近的任务ID"""
+    job_dir = get_job_dir()
+    if not job_dir.exists():
+        return []
+    return sorted((p.stem for p in job_dir.glob('*.jsonl')), reverse=True)[:limit]
+
+def start_background_job(job_id, run, issues):
+    """
+    在后台线程中执行任务，不随 Streamlit 会话结束而中断
+
+    Args:
+        job_id: 任务ID
+        run: 执行函数 run(issues, on_result)，每完成一个 issue 调用 on_result(issue, 结果, 错误信息)，
+             返回值为本次执行的用量汇总（可选），随完成标记写入任务日志
+        issues: 待分析的 issue 列表
+
+    Returns:
+        bool: 同一任务已在运行时返回 False
+    """
+    state = {'total': len(issues), 'completed': 0, 'failed': 0, 'tokens': 0, 'error': None, 'notices': []}
+
+    def on_result(issue, result, error):
+        if error is None:
+            record_result(job_id, result)
+            state['tokens'] += result.get('usage', {}).get('total_tokens', 0)
+        else:
+            record_error(job_id, issue.number, error)
+            state['failed'] += 1
+        state['completed'] += 1
+
+    def target():
+        try:
+            record_done(job_id, run(issues, on_result))
+        except Exception as e:
+            logger.error(f"任务 {job_id} 执行失败: {str(e)}")
+            state['error'] = str(e)
+
+    with _running_lock:
+        current = _running.get(job_id)
+        if current and current['thread'].is_alive():
+            return False
+        state['thread'] = threading.Thread(target=target, name=f'job-{job_id}', daemon=True)
+        _running[job_id] = state
+        state['thread'].start()
+    return True
+
+def get_job_progress(job_id):
+    """
+    获取后台任务的进度
+
+    Returns:
+        dict: {'running', 'total', 'completed', 'failed', 'tokens', 'error', 'notices'}，当前进程中没有该任务时返回 None
+    """
+    with _running_lock:
+        state = _running.get(job_id)
+        if not state:
+            return None
+        return {
+            'running': state['thread'].is_alive(),
+            'total': state['total'],
+            'completed': state['completed'],
+            'failed': state['failed'],
+            'tokens': state['tokens'],
+            'error': state['error'],
+            'notices': list(state['notices'])
+        }
+
+def add_job_notice(job_id, notice):
+    """记录后台任务执行中需要提示用户的信息，如预筛模型未启用，界面在任务结束后显示"""
+    with _running_lock:
+        state = _running.get(job_id)
+        if state:
+            state['notices'].append(notice)
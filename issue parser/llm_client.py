@@ -0,0 +1,305 @@
+"""
+大模型调用层：共享客户端、重试、退避和对冲请求
+
+同一 (base_url, api_key) 在进程内共享一个 OpenAI 客户端和 httpx 连接池，批量分析中的调用复用已建立的
+keep-alive 连接，不必每次重新握手；安装 h2 时启用 HTTP/2，网关支持时多个请求复用同一连接。
+异步客户端的连接绑定事件循环，按事件循环分别缓存，事件循环结束前由 close_async_clients 关闭。
+
+网关返回 429、5xx 或连接失败时按指数退避加随机抖动重试，响应带有 Retry-After 时按其等待，
+OpenAI 客户端自带的重试被关闭，重试次数由这里统一计算并计入用量。
+开启对冲请求后，非流式调用耗时超过该模型近期耗时的 p95 仍未返回时再发出一个相同请求，取先完成的结果，
+以少量额外调用换取批量分析的尾部耗时可控；对冲发出的请求单独计数，不占用重试次数。
+各次调用的策略按各自的配置创建，只有近期耗时在进程内共享。
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_HEDGE_QUANTILE = 0.95
+# 近期耗时样本不足时不对冲，避免用几次调用估出的 p95 频繁发出重复请求
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+RETRYABLE_STATUS = {408, 409, 429}
+# 连接池上限需覆盖大模型并发数与对冲请求
+POOL_MAX_CONNECTIONS = 64
+POOL_MAX_KEEPALIVE = 32
+KEEPALIVE_EXPIRY = 90
+
+_clients_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_pool_limits():
+    return httpx.Limits(max_connections=POOL_MAX_CONNECTIONS, max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+def get_openai_client(api_key, base_url=None):
+    """获取进程内共享的 OpenAI 客户端"""
+    key = (base_url or '', api_key)
+    with _clients_lock:
+        if key not in _clients:
+            http_client = httpx.Client(limits=get_pool_limits(), http2=h2 is not None)
+            _clients[key] = openai.OpenAI(api_key=api_key, base_url=base_url or None, http_client=http_client)
+        return _clients[key]
+
+def get_async_openai_client(api_key, base_url=None):
+    """获取当前事件循环内共享的 AsyncOpenAI 客户端，需在协程中调用"""
+    loop = asyncio.get_running_loop()
+    key = (base_url or '', api_key)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            http_client = httpx.AsyncClient(limits=get_pool_limits(), http2=h2 is not None)
+            clients[key] = openai.AsyncOpenAI(api_key=api_key, base_url=base_url or None, http_client=http_client)
+        return clients[key]
+
+async def close_async_clients():
+    """关闭当前事件循环中共享的 AsyncOpenAI 客户端及其连接池，需在事件循环结束前调用"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.pop(loop, {})
+    for client in clients.values():
+        await client.close()
+
+def is_retryable(error):
+    """连接失败、超时、限流和服务端错误可以重试，额度耗尽和请求本身的错误不重试"""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return False
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+def get_retry_after(error):
+    """
+    读取响应中的 Retry-After / retry-after-ms
+
+    Returns:
+        float: 需要等待的秒数，响应未指定时返回None
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        # HTTP 日期格式
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class LatencyTracker:
+    """按模型记录近期成功调用的耗时，用于估算对冲请求的等待时间"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, model, latency):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+    def quantile(self, model, q):
+        """样本数不足 HEDGE_MIN_SAMPLES 时返回None"""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+# 各策略实例共享的近期耗时
+_latencies = LatencyTracker()
+
+class RetryPolicy:
+    """
+    大模型调用的重试和对冲策略
+
+    Args:
+        max_retries: 最大重试次数，不含首次请求
+        base_delay / max_delay: 指数退避的初始和最大等待秒数，实际等待在 [0, 上限] 内随机
+        hedge: 是否对非流式调用发出对冲请求
+        hedge_quantile: 等待超过该分位的近期耗时后发出对冲请求
+        latencies: 近期耗时记录，为空时单独记录
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 hedge=False, hedge_quantile=DEFAULT_HEDGE_QUANTILE, latencies=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.latencies = latencies or LatencyTracker()
+
+    def backoff_delay(self, attempt, error=None):
+        """第 attempt 次重试前的等待秒数，响应指定了 Retry-After 时以其为准"""
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, client, **kwargs):
+        """
+        调用 chat.completions.create，可重试的错误按退避策略重试
+
+        Returns:
+            tuple: (解析后的回复，流式调用时为 Stream, 重试次数, 对冲请求数)
+        """
+        client = client.with_options(max_retries=0)
+        model = kwargs.get('model')
+        hedge_after = None
+        if self.hedge and not kwargs.get('stream'):
+            hedge_after = self.latencies.quantile(model, self.hedge_quantile)
+
+        retries = hedges = 0
+        while True:
+            started = time.monotonic()
+            try:
+                if hedge_after is None:
+                    response = client.chat.completions.with_raw_response.create(**kwargs).parse()
+                else:
+                    response, hedged = self._call_hedged(client, hedge_after, kwargs)
+                    hedges += hedged
+            except Exception as e:
+                if retries >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff_delay(retries, e)
+                retries += 1
+                logger.warning(f"调用 {model} 失败（{str(e)}），{delay:.1f} 秒后第 {retries} 次重试")
+                time.sleep(delay)
+                continue
+            if not kwargs.get('stream'):
+                self.latencies.record(model, time.monotonic() - started)
+            return response, retries, hedges
+
+    def _call_hedged(self, client, hedge_after, kwargs):
+        """
+        先发出一个请求，超过 hedge_after 秒未返回时再发出一个相同请求，取先成功的结果
+
+        落后的请求无法中途取消，在后台线程中结束后丢弃其结果。
+
+        Returns:
+            tuple: (解析后的回复, 发出的对冲请求数)
+        """
+        def submit():
+            future = Future()
+
+            def run():
+                try:
+                    future.set_result(client.chat.completions.with_raw_response.create(**kwargs).parse())
+                except Exception as e:
+                    future.set_exception(e)
+            threading.Thread(target=run, daemon=True).start()
+            return future
+
+        pending = {submit()}
+        done, pending = wait(pending, timeout=hedge_after)
+        if done:
+            return next(iter(done)).result(), 0
+        logger.info(f"{kwargs.get('model')} 超过 {hedge_after:.1f} 秒未返回，发出对冲请求")
+        pending.add(submit())
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), 1
+                error = future.exception()
+        raise error
+
+    async def acall(self, client, **kwargs):
+        """
+        call 的异步版本，client 为 AsyncOpenAI 客户端，重试等待不阻塞事件循环
+
+        Returns:
+            tuple: (回复, 重试次数, 对冲请求数)
+        """
+        client = client.with_options(max_retries=0)
+        model = kwargs.get('model')
+        hedge_after = None
+        if self.hedge and not kwargs.get('stream'):
+            hedge_after = self.latencies.quantile(model, self.hedge_quantile)
+
+        retries = hedges = 0
+        while True:
+            started = time.monotonic()
+            try:
+                if hedge_after is None:
+                    response = await client.chat.completions.create(**kwargs)
+                else:
+                    response, hedged = await self._acall_hedged(client, hedge_after, kwargs)
+                    hedges += hedged
+            except Exception as e:
+                if retries >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff_delay(retries, e)
+                retries += 1
+                logger.warning(f"调用 {model} 失败（{str(e)}），{delay:.1f} 秒后第 {retries} 次重试")
+                await asyncio.sleep(delay)
+                continue
+            if not kwargs.get('stream'):
+                self.latencies.record(model, time.monotonic() - started)
+            return response, retries, hedges
+
+    async def _acall_hedged(self, client, hedge_after, kwargs):
+        """_call_hedged 的异步版本，先成功的请求返回后取消落后的请求"""
+        pending = {asyncio.ensure_future(client.chat.completions.create(**kwargs))}
+        done, pending = await asyncio.wait(pending, timeout=hedge_after)
+        if done:
+            return next(iter(done)).result(), 0
+        logger.info(f"{kwargs.get('model')} 超过 {hedge_after:.1f} 秒未返回，发出对冲请求")
+        pending.add(asyncio.ensure_future(client.chat.completions.create(**kwargs)))
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), 1
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+def get_retry_policy(max_retries=DEFAULT_MAX_RETRIES, hedge=False, hedge_quantile=DEFAULT_HEDGE_QUANTILE):
+    """
+    按配置创建策略实例
+
+    并发的会话和后台任务各自持有策略，互不修改对方的设置；近期耗时在进程内共享，对冲等待时间按所有调用估算
+    """
+    return RetryPolicy(max_retries=max_retries, hedge=hedge, hedge_quantile=hedge_quantile, latencies=_latencies)
@@ -0,0 +1,188 @@
+"""
+近似重复 issue 检测
+
+对 issue 标题和内容做归一化（去除内存地址、goroutine 编号、时间戳、行号偏移等易变部分）后取词级 shingle，
+计算 MinHash 签名并按 LSH 分桶，只与同桶的已分析 issue 比较估算 Jaccard 相似度。
+重复提交的 issue 和同一堆栈反复出现的 flake（如 DATA RACE 报告）可直接沿用已有结论，不再调用大模型。
+索引由历史报告检索库（report_index.db）和已有分析结果构建，批量分析过程中新完成的结果也会加入索引。
+"""
+import hashlib
+import logging
+import re
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# 只取内容的开头部分计算签名，超长的日志不会拖慢索引构建
+MAX_TEXT_CHARS = 10000
+DEFAULT_REUSE_THRESHOLD = 0.85
+DEFAULT_LINK_THRESHOLD = 0.5
+RISK_TEXTS = {2: '高风险', 1: '低风险', 0: '不涉及'}
+
+# 每个 shingle 用不同 person 参数的 blake2b 各取 16 个 32 位哈希，拼成 NUM_PERM 个独立哈希函数
+_HASH_PERSONS = [f'minhash{i}'.encode() for i in range(NUM_PERM // 16)]
+_UNPACK = struct.Struct('>16I').unpack
+
+# issue 模板中的标题和注释在所有 issue 中重复出现，不参与比较
+TEMPLATE_PATTERNS = [
+    re.compile(r'<!--.*?-->', re.DOTALL),
+    re.compile(r'^\s*#+ .*$', re.MULTILINE),
+]
+VOLATILE_PATTERNS = [
+    re.compile(r'0x[0-9a-f]+'),                                  # 内存地址、偏移
+    re.compile(r'\b[0-9a-f]{7,40}\b'),                            # commit sha、容器ID
+    re.compile(r'\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}:\d{2}[\d.:z+-]*'),  # 时间戳
+    re.compile(r'\d+'),                                           # goroutine 编号、行号、端口等
+]
+TOKEN_PATTERN = re.compile(r'[a-z_][\w./-]*|[\u4e00-\u9fff]')
+
+def normalize_tokens(text):
+    """归一化文本并切分为词"""
+    text = (text or '')[:MAX_TEXT_CHARS].lower()
+    for pattern in TEMPLATE_PATTERNS + VOLATILE_PATTERNS:
+        text = pattern.sub(' ', text)
+    return TOKEN_PATTERN.findall(text)
+
+def shingles(text, size=SHINGLE_SIZE):
+    """词级 shingle 集合，词数不足时整体作为一个 shingle"""
+    tokens = normalize_tokens(text)
+    if len(tokens) <= size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def minhash(shingle_set):
+    """计算 MinHash 签名"""
+    if not shingle_set:
+        return None
+    columns = []
+    for person in _HASH_PERSONS:
+        hashes = [_UNPACK(hashlib.blake2b(s.encode('utf-8'), digest_size=64, person=person).digest()) for s in shingle_set]
+        columns.extend(map(min, zip(*hashes)))
+    return tuple(columns)
+
+def similarity(sig1, sig2):
+    """由签名估算 Jaccard 相似度"""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / NUM_PERM
+
+def issue_text(title, body):
+    return f"{title}\n{body or ''}"
+
+class DuplicateIndex:
+    """
+    已分析 issue 的 MinHash/LSH 索引
+
+    Args:
+        reuse_threshold: 相似度不低于该值时直接沿用已有结论
+        link_threshold: 相似度不低于该值时在结果中关联相似 issue，但仍正常分析
+    """
+
+    def __init__(self, reuse_threshold=DEFAULT_REUSE_THRESHOLD, link_threshold=DEFAULT_LINK_THRESHOLD):
+        self.reuse_threshold = reuse_threshold
+        self.link_threshold = link_threshold
+        self._lock = threading.Lock()
+        self._signatures = {}
+        self._verdicts = {}
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def add(self, issue_number, title, body, verdict):
+        """
+        加入一个已分析的 issue
+
+        Args:
+            verdict: 可沿用的结论：issue_url、has_risk、analysis、stage_model
+        """
+        signature = minhash(shingles(issue_text(title, body)))
+        if signature is None:
+            return
+        with self._lock:
+            if issue_number in self._signatures:
+                self._remove(issue_number)
+            self._signatures[issue_number] = signature
+            self._verdicts[issue_number] = verdict
+            for band in range(BANDS):
+                key = (band, signature[band * ROWS:(band + 1) * ROWS])
+                self._buckets.setdefault(key, set()).add(issue_number)
+
+    def _remove(self, issue_number):
+        signature = self._signatures.pop(issue_number)
+        self._verdicts.pop(issue_number, None)
+        for band in range(BANDS):
+            self._buckets.get((band, signature[band * ROWS:(band + 1) * ROWS]), set()).discard(issue_number)
+
+    def find(self, issue_number, title, body):
+        """
+        查找与给定 issue 最相似的已分析 issue，排除 issue 自身
+
+        Returns:
+            dict: {'issue_number', 'similarity', 'verdict'}，相似度低于 link_threshold 时返回 None
+        """
+        signature = minhash(shingles(issue_text(title, body)))
+        if signature is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for band in range(BANDS):
+                candidates |= self._buckets.get((band, signature[band * ROWS:(band + 1) * ROWS]), set())
+            candidates.discard(issue_number)
+            best, best_score = None, 0.0
+            for candidate in candidates:
+                score = similarity(signature, self._signatures[candidate])
+                if score > best_score:
+                    best, best_score = candidate, score
+            if best is None or best_score < self.link_threshold:
+                return None
+            return {'issue_number': best, 'similarity': best_score, 'verdict': self._verdicts[best]}
+
+    def add_results(self, results):
+        """加入分析结果（如增量扫描状态、任务日志中的结果），近似重复和预筛判定的结果不再加入"""
+        count = 0
+        for result in results:
+            if result.get('stage') in ('duplicate', 'prefilter'):
+                continue
+            self.add(result['issue_number'], result['issue_title'], result.get('issue_body', ''), {
+                'issue_url': result['issue_url'],
+                'has_risk': result['has_risk'],
+                'analysis': result['analysis'],
+                'stage_model': result.get('stage_model', '')
+            })
+            count += 1
+        return count
+
+    def add_report_index(self, report_index):
+        """加入历史报告检索库中的 issue，同一 issue 出现在多份报告中时以最新月份为准，近似重复和预筛判定的结论不加入"""
+        with report_index._connect() as conn:
+            rows = conn.execute(
+                "SELECT issue_number, title, url, content, model, risk_level, risk, analysis, poc, explain "
+                "FROM issues WHERE stage NOT IN ('duplicate', 'prefilter') ORDER BY month, id"
+            ).fetchall()
+        for issue_number, title, url, content, model, risk_level, risk, analysis, poc, explain in rows:
+            # 报告中的 issue 内容之后还有评论和 commit，只取 issue 正文与新 issue 比较
+            body = re.split(r'\n### (?:相关评论|相关Commit)\n', content, maxsplit=1)[0]
+            self.add(issue_number, title, body, {
+                'issue_url': url,
+                'has_risk': risk_level,
+                'analysis': {'has_risk': risk or RISK_TEXTS.get(risk_level, ''), 'analysis': analysis, 'poc': poc, 'explain': explain},
+                'stage_model': model
+            })
+        return len(rows)
+
+def build_duplicate_index(results=(), report_index=None, reuse_threshold=DEFAULT_REUSE_THRESHOLD,
+                          link_threshold=DEFAULT_LINK_THRESHOLD):
+    """由历史报告检索库和已有分析结果构建索引"""
+    index = DuplicateIndex(reuse_threshold, link_threshold)
+    if report_index is not None:
+        try:
+            index.add_report_index(report_index)
+        except Exception as e:
+            logger.warning(f"从历史报告检索库构建近似重复索引失败: {str(e)}")
+    index.add_results(results)
+    logger.info(f"近似重复索引共 {len(index)} 个已分析的issue")
+    return index
@@ -0,0 +1,206 @@
+"""
+调用大模型前的本地预筛
+
+CI flake、失败的测试、文档和功能需求类 issue 在批量结果中几乎都是"不涉及"，预筛在获取详情和调用大模型之前：
+- 按标签（kind/flake、kind/documentation 等）和标题模式（[Flaky Test]、[Failing Test] 等）直接判定
+- 用历史报告的结论训练朴素贝叶斯模型，阈值是目标精度：交叉验证选出满足该精度的评分线，达不到时模型不启用
+标题或标签涉及安全关键词的 issue 一律交给大模型分析。阈值越高误判越少，但能省下的调用也越少。
+"""
+import logging
+import math
+import re
+
+from near_duplicates import normalize_tokens
+from prompt_budget import SECURITY_PATH
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.97
+# 训练样本太少时不使用模型，只按规则判定
+MIN_TRAINING_SAMPLES = 200
+CALIBRATION_FOLDS = 5
+# 选择阈值时至少要覆盖的留出样本数，避免只凭少数几个高分样本得出精度
+MIN_CALIBRATION_SUPPORT = 20
+MAX_BODY_CHARS = 4000
+
+NON_SECURITY_LABELS = {
+    'kind/flake', 'kind/failing-test', 'kind/documentation', 'kind/feature', 'kind/cleanup', 'kind/support',
+    'kind/api-change', 'kind/deprecation'
+}
+SECURITY_LABELS = {'area/security', 'kind/security', 'sig/auth', 'committee/security-response'}
+NON_SECURITY_TITLE = re.compile(
+    r'^\s*\[?(flaky test|failing test|flake|test flake|docs?|documentation|feature request|kep)\b'
+    r'|\b(is flaky|flakes?|flaking|failing test|typo|bump|upgrade to go)\b',
+    re.IGNORECASE
+)
+SECURITY_WORDS = re.compile(
+    r'cve-\d|vulnerab|exploit|escalat|bypass|escape|injection|traversal|leak|unauthori[sz]ed|privilege|'
+    r'denial of service|\bdos\b|ssrf|xss|csrf|rce\b|漏洞|越权|提权|泄露|逃逸|注入',
+    re.IGNORECASE
+)
+
+def issue_tokens(title, body):
+    """标题的词单独加前缀，与内容中的同名词区分权重"""
+    return ['t:' + token for token in normalize_tokens(title)] + normalize_tokens((body or '')[:MAX_BODY_CHARS])
+
+def mentions_security(title, body, labels):
+    if SECURITY_LABELS & set(labels):
+        return True
+    if SECURITY_PATH.search(title) or SECURITY_WORDS.search(title):
+        return True
+    return bool(SECURITY_WORDS.search((body or '')[:MAX_BODY_CHARS]))
+
+class NaiveBayesClassifier:
+    """二分类多项式朴素贝叶斯：0 为不涉及，1 为存在风险（低风险/高风险）"""
+
+    def __init__(self):
+        self.doc_counts = [0, 0]
+        self.token_counts = [{}, {}]
+        self.token_totals = [0, 0]
+        self.vocabulary = set()
+
+    def __len__(self):
+        return sum(self.doc_counts)
+
+    def train(self, tokens, label):
+        self.doc_counts[label] += 1
+        counts = self.token_counts[label]
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        self.token_totals[label] += len(tokens)
+        self.vocabulary.update(tokens)
+
+    def score(self, tokens):
+        """
+        "不涉及"相对"存在风险"的平均每词对数似然比，越大越可能不涉及
+
+        长文本的后验概率会饱和到 0 或 1，按词取平均后不同长度的 issue 可以用同一个阈值比较
+        """
+        vocab_size = len(self.vocabulary) + 1
+        totals = [self.token_totals[label] + vocab_size for label in (0, 1)]
+        ratio, known = 0.0, 0
+        for token in set(tokens):
+            if token in self.vocabulary:
+                ratio += math.log((self.token_counts[0].get(token, 0) + 1) / totals[0])
+                ratio -= math.log((self.token_counts[1].get(token, 0) + 1) / totals[1])
+                known += 1
+        return ratio / known if known else 0.0
+
+def calibrate_cutoff(samples, precision, folds=CALIBRATION_FOLDS):
+    """
+    交叉验证选择评分阈值
+
+    用留出的样本评分，按评分从高到低找出"不涉及"占比仍不低于 precision 的最长前缀，
+    该前缀的最低评分即阈值；历史结论不足以达到目标精度时返回 None
+
+    Returns:
+        tuple: (阈值, 交叉验证精度, 交叉验证中可跳过的比例)
+    """
+    scored = []
+    for fold in range(folds):
+        classifier = NaiveBayesClassifier()
+        for i, (tokens, label) in enumerate(samples):
+            if i % folds != fold:
+                classifier.train(tokens, label)
+        scored.extend((classifier.score(tokens), label) for i, (tokens, label) in enumerate(samples) if i % folds == fold)
+    scored.sort(key=lambda item: item[0], reverse=True)
+
+    best, negatives = None, 0
+    for count, (score, label) in enumerate(scored, 1):
+        negatives += label == 0
+        if count >= MIN_CALIBRATION_SUPPORT and negatives / count >= precision:
+            best = (score, negatives / count, count / len(scored))
+    return best
+
+class Prefilter:
+    """
+    本地预筛
+
+    Args:
+        threshold: 目标精度，即模型判定为不涉及的issue中确实不涉及的比例，越高跳过的issue越少
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.classifier = None
+        self.cutoff = None
+        self.precision = self.coverage = None
+        # 模型未启用的原因
+        self.disabled_reason = '没有历史报告检索库'
+
+    def classify(self, title, body, labels=()):
+        """
+        判断 issue 是否可以不经大模型直接判定为不涉及
+
+        Returns:
+            dict: {'method', 'reason', 'score'}，需要交给大模型分析时返回 None
+        """
+        labels = list(labels)
+        if mentions_security(title, body, labels):
+            return None
+
+        matched_labels = sorted(NON_SECURITY_LABELS & set(labels))
+        if matched_labels:
+            return {'method': 'rules', 'reason': f"标签 {', '.join(matched_labels)} 属于非安全类issue", 'score': None}
+        m = NON_SECURITY_TITLE.search(title)
+        if m:
+            return {'method': 'rules', 'reason': f"标题包含 \"{m.group(0).strip()}\"，属于测试/文档/需求类issue", 'score': None}
+
+        if self.classifier is not None:
+            score = self.classifier.score(issue_tokens(title, body))
+            if score >= self.cutoff:
+                return {'method': 'naive-bayes', 'reason': f"历史结论模型评分 {score:.3f} 不低于阈值 {self.cutoff:.3f}",
+                        'score': round(score, 3)}
+        return None
+
+    def train_report_index(self, report_index):
+        """
+        用历史报告检索库中的结论训练模型，交叉验证达不到目标精度时只使用规则
+
+        Returns:
+            int: 训练样本数
+        """
+        with report_index._connect() as conn:
+            # 近似重复和预筛判定的结论来自本地规则和模型自身，不作为训练样本
+            rows = conn.execute(
+                "SELECT title, content, risk_level FROM issues WHERE stage NOT IN ('duplicate', 'prefilter')"
+            ).fetchall()
+        samples = []
+        for title, content, risk_level in rows:
+            body = re.split(r'\n### (?:相关评论|相关Commit)\n', content, maxsplit=1)[0]
+            samples.append((issue_tokens(title, body), 0 if risk_level == 0 else 1))
+        if len(samples) < MIN_TRAINING_SAMPLES:
+            self.disabled_reason = f"历史结论只有 {len(samples)} 个，不足 {MIN_TRAINING_SAMPLES} 个"
+            logger.warning(self.describe())
+            return len(samples)
+
+        calibration = calibrate_cutoff(samples, self.threshold)
+        if calibration is None:
+            self.disabled_reason = f"{len(samples)} 个历史结论在交叉验证中达不到 {self.threshold} 的目标精度"
+            logger.warning(self.describe())
+            return len(samples)
+        self.cutoff, self.precision, self.coverage = calibration
+        self.classifier = NaiveBayesClassifier()
+        for tokens, label in samples:
+            self.classifier.train(tokens, label)
+        self.disabled_reason = None
+        logger.info(self.describe())
+        return len(samples)
+
+    def describe(self):
+        """预筛模型的状态，模型未启用时说明原因"""
+        if self.classifier is None:
+            return f"预筛模型未启用（{self.disabled_reason}），只按标签和标题规则预筛"
+        return (f"预筛模型阈值 {self.cutoff:.3f}，交叉验证精度 {self.precision:.3f}，"
+                f"可跳过 {self.coverage:.1%} 的issue")
+
+def build_prefilter(report_index=None, threshold=DEFAULT_THRESHOLD):
+    """构建预筛，提供历史报告检索库时训练朴素贝叶斯模型"""
+    prefilter = Prefilter(threshold)
+    if report_index is not None:
+        try:
+            prefilter.train_report_index(report_index)
+        except Exception as e:
+            prefilter.disabled_reason = f"训练失败: {str(e)}"
+            logger.warning(f"训练预筛模型失败: {str(e)}")
+    return prefilter
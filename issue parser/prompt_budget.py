@@ -0,0 +1,212 @@
+"""
+按 token 预算压缩分析提示词的输入
+
+在 Issue 内容、评论和 patch 之间分配 token 预算：
+- 过滤机器人评论和只包含 /assign、/triage 等指令的样板评论，超长评论截断
+- patch 按 hunk 拆分，优先保留安全敏感路径和 issue 中提到的文件，测试、vendor、生成代码靠后
+- commit/PR 消息超长时截断，消息和文件列表同样计入预算，预算不足时丢弃相关性最低的整个 commit
+这样提示词大小有上限且可预期，大 issue 不会超出上下文或产生过高费用。
+"""
+import logging
+import re
+from pathlib import PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 24000
+# 各部分占总预算的上限比例，未用完的预算顺延给后面的部分
+BODY_SHARE = 0.3
+COMMENTS_SHARE = 0.35
+MAX_COMMENT_TOKENS = 1500
+MAX_FILES_LISTED = 50
+MAX_MESSAGE_TOKENS = 300
+
+BOT_AUTHORS = {'k8s-ci-robot', 'k8s-triage-robot', 'k8s-github-robot', 'fejta-bot', 'k8s-bot'}
+SLASH_COMMAND = re.compile(r'^\s*/[a-z][\w-]*(\s+.*)?$')
+BOILERPLATE = re.compile(r'^\s*(\+1|same here|me too|thanks!?|thank you!?|bump|any updates\??)\s*$', re.IGNORECASE)
+
+SECURITY_PATH = re.compile(
+    r'auth|rbac|secret|token|credential|cert|tls|x509|admission|webhook|exec|attach|portforward|privilege'
+    r'|security|sandbox|seccomp|apparmor|selinux|podsecurity|serviceaccount|csr|proxy|escalat|permission',
+    re.IGNORECASE
+)
+LOW_VALUE_PATH = re.compile(r'(_test\.go$|/test/|/tests?/|testdata/|/e2e/|^vendor/|/vendor/|zz_generated|\.pb\.go$|go\.sum$|\.md$)')
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('o200k_base')
+except Exception:
+    _encoding = None
+
+def count_tokens(text):
+    """统计 token 数，未安装 tiktoken 时按中文每字 1 个、其他字符每 4 个 1 个估算"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(re.findall(r'[\u3000-\u9fff\uff00-\uffef]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def truncate_to_tokens(text, budget, marker="\n... (内容已截断)"):
+    """将文本截断到预算以内"""
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text
+    if budget <= 0:
+        return ''
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:budget]) + marker
+    return text[:int(len(text) * budget / tokens)] + marker
+
+def is_noise_comment(comment):
+    """判断是否为机器人或样板评论"""
+    author = (comment.get('author') or '').lower()
+    if author in BOT_AUTHORS or author.endswith('[bot]') or author.endswith('-robot') or author.endswith('-bot'):
+        return True
+    lines = [line for line in (comment.get('body') or '').splitlines() if line.strip()]
+    if not lines:
+        return True
+    return all(SLASH_COMMAND.match(line) or BOILERPLATE.match(line) for line in lines)
+
+def select_comments(comments, budget):
+    """过滤噪声评论并在预算内保留首条和最新的评论，保持原有顺序"""
+    candidates = []
+    for comment in comments:
+        if is_noise_comment(comment):
+            continue
+        body = truncate_to_tokens(comment['body'], MAX_COMMENT_TOKENS)
+        candidates.append((dict(comment, body=body), count_tokens(body)))
+
+    if sum(tokens for _, tokens in candidates) <= budget:
+        return [c for c, _ in candidates], sum(tokens for _, tokens in candidates)
+
+    # 第一条评论通常是维护者的初步分析，其余优先保留最新的讨论
+    order = [0] + list(range(len(candidates) - 1, 0, -1)) if candidates else []
+    keep, used = set(), 0
+    for idx in order:
+        tokens = candidates[idx][1]
+        if used + tokens <= budget:
+            keep.add(idx)
+            used += tokens
+    return [candidates[i][0] for i in sorted(keep)], used
+
+def split_hunks(patch):
+    """将 '--- 文件名 ---' 格式的 patch 拆分为 (文件名, hunk) 列表"""
+    hunks = []
+    for m in re.finditer(r'^--- (.+?) ---\n(.*?)(?=^--- .+? ---\n|\Z)', patch or '', re.MULTILINE | re.DOTALL):
+        filename, body = m.group(1), m.group(2).rstrip('\n')
+        for hunk in re.split(r'(?m)^(?=@@)', body):
+            if hunk.strip():
+                hunks.append((filename, hunk.rstrip('\n')))
+    return hunks
+
+def score_hunk(filename, hunk, mentioned):
+    """hunk 相关性评分，分数越高越优先保留"""
+    score = 0
+    if SECURITY_PATH.search(filename):
+        score += 3
+    if SECURITY_PATH.search(hunk):
+        score += 1
+    if PurePosixPath(filename).name.lower() in mentioned or filename.lower() in mentioned:
+        score += 4
+    if LOW_VALUE_PATH.search(filename):
+        score -= 3
+    return score
+
+def mentioned_files(text):
+    """提取 issue 文本中提到的文件名"""
+    names = set()
+    for path in re.findall(r'[\w./-]+\.[a-z]{1,5}\b', text or ''):
+        path = path.lower()
+        names.add(path)
+        names.add(PurePosixPath(path).name)
+    return names
+
+def commit_header(commit):
+    """commit 在提示词中 patch 之前的部分，与 build_analysis_content 的格式一致"""
+    header = f"Commit: {commit['sha'][:8]}\n作者: {commit['author']}\n时间: {commit['date']}\n消息: {commit['message']}\n"
+    if commit.get('files_changed'):
+        header += f"修改文件: {', '.join(commit['files_changed'])}\n"
+    return header
+
+def select_patches(commits, budget, issue_text):
+    """
+    在预算内挑选 commit 并按相关性挑选其中的 hunk，返回压缩后的 commit 列表
+
+    commit/PR 消息超长时截断，消息和文件列表等头部信息同样计入预算；
+    预算不足以容纳所有头部时，按其中 hunk 的最高相关性丢弃整个 commit
+    """
+    mentioned = mentioned_files(issue_text)
+    hunks, entries = [], []
+    for ci, commit in enumerate(commits):
+        files = commit.get('files_changed') or []
+        if len(files) > MAX_FILES_LISTED:
+            files = files[:MAX_FILES_LISTED] + [f"等共{len(files)}个文件"]
+        entry = dict(commit, message=truncate_to_tokens(commit.get('message') or '', MAX_MESSAGE_TOKENS),
+                     files_changed=files)
+        commit_hunks = []
+        for hi, (filename, hunk) in enumerate(split_hunks(commit.get('patch'))):
+            commit_hunks.append({
+                'commit': ci, 'order': hi, 'file': filename, 'text': hunk,
+                'tokens': count_tokens(hunk) + 8,
+                'score': score_hunk(filename, hunk, mentioned)
+            })
+        hunks += commit_hunks
+        score = max((h['score'] for h in commit_hunks), default=0) + bool(SECURITY_PATH.search(entry['message']))
+        entries.append({'commit': entry, 'score': score, 'tokens': count_tokens(commit_header(entry)) + 8})
+
+    kept_commits, used = set(), 0
+    for ci in sorted(range(len(entries)), key=lambda i: (-entries[i]['score'], entries[i]['tokens'])):
+        if used + entries[ci]['tokens'] <= budget:
+            kept_commits.add(ci)
+            used += entries[ci]['tokens']
+    if len(kept_commits) < len(entries):
+        logger.debug(f"预算不足，丢弃 {len(entries) - len(kept_commits)}/{len(entries)} 个相关性最低的commit")
+
+    selected = set()
+    for h in sorted(hunks, key=lambda h: (-h['score'], h['tokens'])):
+        if h['commit'] in kept_commits and used + h['tokens'] <= budget:
+            selected.add((h['commit'], h['order']))
+            used += h['tokens']
+
+    compacted = []
+    for ci, entry in enumerate(entries):
+        if ci not in kept_commits:
+            continue
+        kept = [h for h in hunks if h['commit'] == ci and (ci, h['order']) in selected]
+        total = sum(1 for h in hunks if h['commit'] == ci)
+        parts, last_file = [], None
+        for h in kept:
+            if h['file'] != last_file:
+                parts.append(f"--- {h['file']} ---")
+                last_file = h['file']
+            parts.append(h['text'])
+        patch = "\n".join(parts)
+        if len(kept) < total:
+            patch += f"\n... (已按相关性保留 {len(kept)}/{total} 个hunk)"
+        compacted.append(dict(entry['commit'], patch=patch if kept else ''))
+    return compacted, used
+
+def compact_issue_inputs(issue_title, issue_body, issue_details=None, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    按 token 预算压缩 issue 内容、评论和 patch
+
+    Returns:
+        tuple: (压缩后的issue内容, 压缩后的issue详情)，结构与输入一致
+    """
+    remaining = token_budget - count_tokens(issue_title)
+    body = truncate_to_tokens(issue_body or '', int(token_budget * BODY_SHARE))
+    remaining -= count_tokens(body)
+
+    if not issue_details:
+        return body, issue_details
+
+    comments, used = select_comments(issue_details.get('comments') or [], min(int(token_budget * COMMENTS_SHARE), remaining))
+    remaining -= used
+
+    issue_text = body + '\n' + '\n'.join(c['body'] for c in comments)
+    commits, used = select_patches(issue_details.get('commits') or [], max(remaining, 0), issue_text)
+    remaining -= used
+    logger.debug(f"提示词预算 {token_budget}，剩余 {remaining}")
+
+    return body, dict(issue_details, comments=comments, commits=commits)
@@ -0,0 +1,313 @@
+"""
+历史月度报告的本地检索库
+
+将导出的 Markdown 报告（如 k8s issue 2024/202401.md）解析回结构化记录并导入 SQLite，
+按风险等级、月份建立索引，标题、issue 内容和分析文本建立 FTS5 全文索引，
+"2024-01 以来所有涉及 kubelet 的高风险 issue" 这类查询无需再对整个目录执行 grep。
+报告文件未变化时跳过导入，重复执行只处理新增或修改的报告。
+
+示例：
+    python report_index.py import
+    python report_index.py search kubelet --risk 2 --since 2024-01
+"""
+import argparse
+import logging
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+from analysis_stream import parse_risk_level
+
+logger = logging.getLogger(__name__)
+
+GROUP_PATTERN = re.compile(r'^# \S+ (存在高风险|存在安全风险|存在低风险|不涉及安全风险)的 Issues \(\d+ 个\)\s*$')
+GROUP_LEVELS = {'存在高风险': 2, '存在安全风险': 2, '存在低风险': 1, '不涉及安全风险': 0}
+ISSUE_PATTERN = re.compile(r'^## Issue #(\d+) ?(.*)$')
+MODEL_PATTERN = re.compile(r'^> 分析模型：(.+)$')
+LINK_PATTERN = re.compile(r'^- Issue 链接：\[#\d+\]\((\S+)\)', re.MULTILINE)
+# 分析结果中的字段，按导出顺序排列，每个字段最多出现一次
+FIELD_NAMES = ('风险定级', '判定阶段', '判断依据', '复现过程', '解释说明')
+FIELD_PATTERN = re.compile(r'^\*\*(' + '|'.join(FIELD_NAMES) + r')：\*\*[ \t]*$', re.MULTILINE)
+STAGE_NAMES = {'初筛': 'triage', '完整分析': 'full', '近似重复': 'duplicate', '预筛': 'prefilter'}
+SEARCH_COLUMNS = ('title', 'content', 'analysis', 'explain')
+
+def get_index_path():
+    """获取检索库路径 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'report_index.db'
+
+def find_reports(base_dir=None):
+    """查找默认的月度报告，即 'k8s issue <年份>' 目录下的 Markdown 文件"""
+    base_dir = Path(base_dir) if base_dir else Path(__file__).parent
+    return sorted(base_dir.glob('k8s issue */*.md'))
+
+def report_month(path):
+    """从报告文件名解析月份，如 202401.md、20250214.md 对应 2024-01、2025-02"""
+    m = re.match(r'(\d{4})(\d{2})', Path(path).stem)
+    return f"{m.group(1)}-{m.group(2)}" if m else ''
+
+def parse_analysis(block):
+    """
+    解析"### 分析结果"之后的内容
+
+    早期报告没有风险定级等字段，整段内容作为判断依据
+    """
+    fields = {}
+    matches = []
+    for m in FIELD_PATTERN.finditer(block):
+        name = m.group(1)
+        # 字段只接受首次出现且顺序在已识别字段之后的标题，避免分析正文中的同名加粗文字打乱切分
+        if name in fields or (matches and FIELD_NAMES.index(name) < FIELD_NAMES.index(matches[-1].group(1))):
+            continue
+        fields[name] = ''
+        matches.append(m)
+
+    if not matches:
+        return {'risk': '', 'stage': '', 'analysis': block.strip(), 'poc': '', 'explain': ''}
+
+    for m, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(block)
+        fields[m.group(1)] = block[m.end():end].strip()
+
+    poc = fields.get('复现过程', '')
+    poc = re.sub(r'^```\w*\n', '', poc)
+    poc = re.sub(r'\n```$', '', poc)
+    stage = fields.get('判定阶段', '')
+    return {
+        'risk': fields.get('风险定级', ''),
+        'stage': next((value for label, value in STAGE_NAMES.items() if stage.startswith(label)), ''),
+        'analysis': fields.get('判断依据', ''),
+        'poc': poc,
+        'explain': fields.get('解释说明', '')
+    }
+
+def parse_issue_section(lines, group_level):
+    """将单个 issue 的 Markdown 行解析为记录"""
+    m = ISSUE_PATTERN.match(lines[0])
+    text = ''.join(lines[1:])
+    # issue 内容中的 ### 标题在导出时已降级为 ####，最后一个"### 分析结果"即分析部分
+    content, sep, analysis_block = text.rpartition('\n### 分析结果\n')
+    if not sep:
+        content, analysis_block = text, ''
+    analysis_block = re.sub(r'\n---\s*$', '', analysis_block.rstrip())
+    content = content.split('### Issue 内容\n', 1)[-1].strip()
+    link = LINK_PATTERN.search(text)
+
+    record = {
+        'issue_number': int(m.group(1)),
+        'title': m.group(2).strip(),
+        'url': link.group(1) if link else '',
+        'content': content
+    }
+    record.update(parse_analysis(analysis_block))
+    if group_level is not None:
+        record['risk_level'] = group_level
+    else:
+        record['risk_level'] = parse_risk_level(record['risk'])
+    return record
+
+def parse_report(path):
+    """
+    逐个解析报告中的 issue
+
+    Yields:
+        dict: issue_number, title, url, content, risk_level, risk, stage, analysis, poc, explain, model
+    """
+    model = ''
+    group_level = None
+    section = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not section and not model:
+                m = MODEL_PATTERN.match(line)
+                if m:
+                    model = m.group(1).strip()
+                    continue
+            group = GROUP_PATTERN.match(line)
+            if group or ISSUE_PATTERN.match(line):
+                if section:
+                    yield dict(parse_issue_section(section, group_level), model=model)
+                section = [line] if not group else []
+                if group:
+                    group_level = GROUP_LEVELS[group.group(1)]
+            elif section:
+                section.append(line)
+    if section:
+        yield dict(parse_issue_section(section, group_level), model=model)
+
+class ReportIndex:
+    """基于 SQLite FTS5 的历史报告检索库"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else get_index_path()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    report TEXT PRIMARY KEY,
+                    month TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS issues (
+                    id INTEGER PRIMARY KEY,
+                    report TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    issue_number INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    risk_level INTEGER NOT NULL,
+                    risk TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    poc TEXT NOT NULL,
+                    explain TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_issues_risk_month ON issues(risk_level, month)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_issues_number ON issues(issue_number)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_issues_report ON issues(report)")
+            # trigram 分词对中英文混合文本都能按子串匹配
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS issues_fts USING fts5(
+                    {', '.join(SEARCH_COLUMNS)}, content='issues', content_rowid='id', tokenize='trigram'
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def import_report(self, path, force=False):
+        """
+        导入单个报告，已导入且文件未变化时跳过
+
+        Returns:
+            int: 导入的 issue 数，跳过时返回 0
+        """
+        path = Path(path)
+        report = f"{path.parent.name}/{path.name}"
+        stat = path.stat()
+        with self._connect() as conn:
+            row = conn.execute("SELECT size, mtime FROM reports WHERE report = ?", (report,)).fetchone()
+            if row and not force and row == (stat.st_size, stat.st_mtime):
+                return 0
+
+            self._delete_report(conn, report)
+            month = report_month(path)
+            count = 0
+            for record in parse_report(path):
+                cursor = conn.execute(
+                    "INSERT INTO issues (report, month, issue_number, title, url, model, risk_level, risk, stage, "
+                    "content, analysis, poc, explain) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (report, month, record['issue_number'], record['title'], record['url'], record['model'],
+                     record['risk_level'], record['risk'], record['stage'], record['content'], record['analysis'],
+                     record['poc'], record['explain'])
+                )
+                conn.execute(
+                    f"INSERT INTO issues_fts (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                    (cursor.lastrowid,) + tuple(record[c] for c in SEARCH_COLUMNS)
+                )
+                count += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (report, month, size, mtime) VALUES (?, ?, ?, ?)",
+                (report, month, stat.st_size, stat.st_mtime)
+            )
+        logger.info(f"已导入 {report}：{count} 个 issue")
+        return count
+
+    def _delete_report(self, conn, report):
+        # 外部内容表需要用原始内容执行 delete 命令才能移除索引
+        conn.execute(f"""
+            INSERT INTO issues_fts (issues_fts, rowid, {', '.join(SEARCH_COLUMNS)})
+            SELECT 'delete', id, {', '.join(SEARCH_COLUMNS)} FROM issues WHERE report = ?
+        """, (report,))
+        conn.execute("DELETE FROM issues WHERE report = ?", (report,))
+
+    def import_reports(self, paths=None, force=False):
+        """导入多个报告，默认导入 find_reports 找到的全部报告"""
+        return sum(self.import_report(path, force) for path in (paths or find_reports()))
+
+    def search(self, query=None, risk_level=None, since=None, until=None, limit=50):
+        """
+        检索历史分析结果
+
+        Args:
+            query: 全文检索关键词，多个关键词用空格分隔，需全部匹配
+            risk_level: 风险等级：2为高风险，1为低风险，0为不涉及
+            since / until: 月份范围（YYYY-MM，包含边界）
+            limit: 最多返回条数，0表示不限制
+
+        Returns:
+            list: 记录列表，有关键词时按相关度排序，否则按月份倒序
+        """
+        conditions, params = [], []
+        terms = (query or '').split()
+        if risk_level is not None:
+            conditions.append("i.risk_level = ?")
+            params.append(risk_level)
+        if since:
+            conditions.append("i.month >= ?")
+            params.append(since)
+        if until:
+            conditions.append("i.month <= ?")
+            params.append(until)
+
+        # trigram 分词无法用 MATCH 检索少于3个字符的词，这类关键词改为子串匹配
+        match_terms = [t for t in terms if len(t) >= 3]
+        for term in terms:
+            if len(term) < 3:
+                conditions.append('(' + ' OR '.join(f"i.{c} LIKE ?" for c in SEARCH_COLUMNS) + ')')
+                params.extend([f'%{term}%'] * len(SEARCH_COLUMNS))
+
+        sql = "SELECT i.* FROM issues i"
+        if match_terms:
+            sql += " JOIN issues_fts f ON f.rowid = i.id"
+            conditions.insert(0, "issues_fts MATCH ?")
+            params.insert(0, ' AND '.join('"' + t.replace('"', '""') + '"' for t in match_terms))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY bm25(issues_fts)" if match_terms else " ORDER BY i.month DESC, i.issue_number DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params)]
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='将历史Markdown报告导入本地检索库并查询')
+    parser.add_argument('--db', help='检索库路径，默认为 report_index.db')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='导入报告，默认导入 k8s issue */*.md')
+    import_parser.add_argument('paths', nargs='*', help='报告路径')
+    import_parser.add_argument('--force', action='store_true', help='重新导入未变化的报告')
+
+    search_parser = subparsers.add_parser('search', help='检索已导入的分析结果')
+    search_parser.add_argument('query', nargs='*', help='关键词')
+    search_parser.add_argument('--risk', type=int, choices=(0, 1, 2), help='风险等级：2为高风险，1为低风险，0为不涉及')
+    search_parser.add_argument('--since', help='起始月份 YYYY-MM')
+    search_parser.add_argument('--until', help='结束月份 YYYY-MM')
+    search_parser.add_argument('--limit', type=int, default=50, help='最多返回条数，0表示不限制')
+    args = parser.parse_args()
+
+    index = ReportIndex(args.db)
+    if args.command == 'import':
+        count = index.import_reports(args.paths, force=args.force)
+        logger.info(f"共导入 {count} 个 issue")
+        return 0
+
+    rows = index.search(' '.join(args.query), risk_level=args.risk, since=args.since, until=args.until, limit=args.limit)
+    for row in rows:
+        print(f"{row['month']}  #{row['issue_number']}  [{row['risk_level']}]  {row['title']}  {row['url']}")
+    print(f"共 {len(rows)} 条")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
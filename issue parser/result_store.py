@@ -0,0 +1,193 @@
+"""
+结构化的分析结果存储
+
+与 Markdown 报告并行保存一份便于程序处理的结果：按仓库和 issue 创建月份追加到
+results/<仓库>/<YYYY-MM>.jsonl，每行一个扁平记录。安装 pyarrow 时可将月度文件压缩为
+同名 Parquet 列式文件，读取时优先使用不旧于 JSONL 的 Parquet，跨年查询只需读取对应月份的列。
+同一 issue 重新分析时追加新记录，读取时按 issue 编号保留最后一条。
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from issue_loader import parse_repo_fullname
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+_locks_lock = threading.Lock()
+_locks = {}
+
+def get_result_dir():
+    """获取结构化结果目录 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'results'
+
+def get_month_path(repo_name, month, suffix='.jsonl'):
+    return get_result_dir() / repo_name.replace('/', '_') / f'{month}{suffix}'
+
+def get_usage_path(month):
+    """按调用记录的用量文件，与各仓库的结果目录并列"""
+    return get_result_dir() / 'usage' / f'{month}.jsonl'
+
+def _get_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(str(path), threading.Lock())
+
+def to_record(result, analyzed_at=None):
+    """将分析结果转换为扁平记录"""
+    analysis = result.get('analysis') or {}
+    usage = result.get('usage') or {}
+    return {
+        'issue_number': result['issue_number'],
+        'title': result.get('issue_title', ''),
+        'url': result.get('issue_url', ''),
+        'labels': result.get('labels', []),
+        'created_at': result.get('created_at', ''),
+        'analyzed_at': analyzed_at or '',
+        'model': result.get('stage_model', ''),
+        'prompt_version': analysis.get('prompt_version', 0),
+        'stage': result.get('stage', ''),
+        'risk_level': result['has_risk'],
+        'analysis': analysis.get('analysis', ''),
+        'poc': analysis.get('poc', ''),
+        'explain': analysis.get('explain', ''),
+        'calls': usage.get('calls', 0),
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'cached_tokens': usage.get('cached_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        'reasoning_tokens': usage.get('reasoning_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+        'latency': usage.get('latency', 0.0),
+        'retries': usage.get('retries', 0),
+        'hedges': usage.get('hedges', 0),
+        'cached': usage.get('cached', False)
+    }
+
+def record_month(record):
+    """记录所属月份，按 issue 创建时间划分，没有创建时间时归入 unknown"""
+    return record['created_at'][:7] or 'unknown'
+
+def append_results(results, analyzed_at=None):
+    """
+    将分析结果追加到对应仓库、月份的 JSONL 文件
+
+    Args:
+        results: 分析结果列表，仓库名从 issue 链接中解析
+        analyzed_at: 分析时间（UTC 字符串），默认为当前时间
+
+    Returns:
+        set: 本次写入涉及的 (仓库名, 月份)
+    """
+    analyzed_at = analyzed_at or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    grouped = {}
+    for result in results:
+        record = to_record(result, analyzed_at)
+        key = (parse_repo_fullname(record['url']) or 'unknown', record_month(record))
+        grouped.setdefault(key, []).append(record)
+
+    for (repo_name, month), records in grouped.items():
+        path = get_month_path(repo_name, month)
+        lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        try:
+            with _get_lock(path):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+        except Exception as e:
+            logger.error(f"写入结构化结果失败 {path}: {str(e)}")
+    return set(grouped)
+
+def append_usage(record):
+    """
+    追加一条大模型调用的用量记录到 results/usage/<YYYY-MM>.jsonl
+
+    供没有结构化分析结果的调用（如 issue_poc 的分析和复现）按调用保存用量，按记录时间划分月份
+
+    Args:
+        record: 用量字段，如 source、stage、model、issue_url、prompt_tokens、completion_tokens、latency、retries
+    """
+    recorded_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    path = get_usage_path(recorded_at[:7])
+    line = json.dumps({'recorded_at': recorded_at, **record}, ensure_ascii=False) + '\n'
+    try:
+        with _get_lock(path):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+    except Exception as e:
+        logger.error(f"写入用量记录失败 {path}: {str(e)}")
+
+def _read_jsonl(path):
+    records = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['issue_number']] = record
+    return list(records.values())
+
+def compact_month(repo_name, month):
+    """
+    将月度 JSONL 去重后写为 Parquet 文件，未安装 pyarrow 时跳过
+
+    Returns:
+        bool: 是否已写入 Parquet
+    """
+    if pq is None:
+        return False
+    path = get_month_path(repo_name, month)
+    if not path.exists():
+        return False
+    parquet_path = get_month_path(repo_name, month, '.parquet')
+    with _get_lock(path):
+        records = _read_jsonl(path)
+        table = pa.Table.from_pylist(records)
+        tmp_path = parquet_path.with_suffix('.tmp')
+        pq.write_table(table, tmp_path, compression='zstd')
+        tmp_path.replace(parquet_path)
+    return True
+
+def list_months(repo_name):
+    """列出仓库已有结果的月份"""
+    repo_dir = get_result_dir() / repo_name.replace('/', '_')
+    if not repo_dir.exists():
+        return []
+    return sorted({p.stem for p in repo_dir.iterdir() if p.suffix in ('.jsonl', '.parquet')})
+
+def load_results(repo_name, since_month=None, until_month=None, columns=None):
+    """
+    读取指定月份范围内的结构化结果
+
+    Args:
+        repo_name: 仓库名
+        since_month / until_month: 月份范围（YYYY-MM，包含边界），为空表示不限
+        columns: 只读取的字段（仅 Parquet 生效，JSONL 读取后再裁剪）
+
+    Returns:
+        list: 记录列表，同一月份内每个 issue 只保留最后一条
+    """
+    records = []
+    for month in list_months(repo_name):
+        if (since_month and month < since_month) or (until_month and month > until_month):
+            continue
+        path = get_month_path(repo_name, month)
+        parquet_path = get_month_path(repo_name, month, '.parquet')
+        if pq is not None and parquet_path.exists() and (
+                not path.exists() or parquet_path.stat().st_mtime >= path.stat().st_mtime):
+            records.extend(pq.read_table(parquet_path, columns=columns).to_pylist())
+            continue
+        if path.exists():
+            month_records = _read_jsonl(path)
+            if columns:
+                month_records = [{c: r.get(c) for c in columns} for r in month_records]
+            records.extend(month_records)
+    return records
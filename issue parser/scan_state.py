@@ -0,0 +1,96 @@
+"""
+增量扫描状态管理
+
+每个 仓库+标签组合 对应一个状态文件，记录最后一次扫描推进到的 updated_at 检查点
+以及已分析的结果。增量模式只查询检查点之后创建或更新的 issue，并将新的分析结果合并到已有结果中。
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def get_scan_dir():
+    """获取扫描状态目录 - 与 config.json 保存在同一目录"""
+    return Path(__file__).parent / 'scan_state'
+
+def normalize_labels(labels):
+    """将逗号分隔的标签规范化为排序后的列表"""
+    return sorted({label.strip() for label in labels.split(',') if label.strip()})
+
+def get_scan_path(repo_name, labels):
+    """根据仓库和标签集合计算状态文件路径"""
+    key = f"{repo_name.lower()}|{','.join(normalize_labels(labels))}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return get_scan_dir() / f"{repo_name.replace('/', '_')}-{digest}.json"
+
+def format_time(dt):
+    """将 datetime 格式化为检查点使用的 UTC 时间字符串"""
+    return dt.strftime(TIME_FORMAT) if dt else ''
+
+def load_scan_state(repo_name, labels):
+    """加载扫描状态，不存在时返回空状态"""
+    path = get_scan_path(repo_name, labels)
+    state = {
+        'repo_name': repo_name,
+        'labels': normalize_labels(labels),
+        'checkpoint': None,
+        'results': []
+    }
+    if path.exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state.update(json.load(f))
+        except Exception as e:
+            logger.error(f"加载扫描状态失败: {str(e)}")
+    return state
+
+def save_scan_state(state):
+    """保存扫描状态，先写临时文件再替换，避免中途失败损坏状态"""
+    path = get_scan_path(state['repo_name'], ','.join(state['labels']))
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
+        tmp_path.replace(path)
+        return True
+    except Exception as e:
+        logger.error(f"保存扫描状态失败: {str(e)}")
+        return False
+
+def merge_results(stored_results, fresh_results):
+    """按 issue 编号合并结果，新结果覆盖旧结果，保持原有顺序"""
+    merged = {r['issue_number']: r for r in stored_results}
+    for r in fresh_results:
+        merged[r['issue_number']] = r
+    return list(merged.values())
+
+def is_analysis_current(result, updated_at):
+    """判断已有分析结果是否覆盖了 issue 的最新更新"""
+    if result is None:
+        return False
+    # 没有记录 updated_at 的旧结果视为有效
+    return not result.get('updated_at') or result['updated_at'] >= updated_at
+
+def advance_checkpoint(checkpoint, issue_updates, results):
+    """
+    推进检查点
+
+    Args:
+        checkpoint: 当前检查点
+        issue_updates: 本次查询到的 (updated_at, issue编号) 列表
+        results: 已有分析结果列表
+
+    Returns:
+        str: 按 updated_at 升序推进到第一个尚未分析（或分析后又有更新）的 issue 之前的检查点
+    """
+    results_by_number = {r['issue_number']: r for r in results}
+    for updated_at, number in sorted(issue_updates):
+        if not is_analysis_current(results_by_number.get(number), updated_at):
+            break
+        checkpoint = max(checkpoint or '', updated_at)
+    return checkpoint